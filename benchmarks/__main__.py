@@ -0,0 +1,60 @@
+import argparse
+import json
+import sys
+
+from benchmarks.run import compare, format_report, run_benchmarks, save_report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='benchmarks',
+        description='Measure how the hot paths of choose_activity scale.',
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser(
+        'run', help='generate data and measure the operations')
+    run_parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000],
+        help='number of activities and outcomes, up to 10000000')
+    run_parser.add_argument(
+        '--seed', type=int, default=42, help='seed of the generated data')
+    run_parser.add_argument(
+        '--max-runs', type=int, default=1000,
+        help='maximum number of measures of each operation')
+    run_parser.add_argument(
+        '--max-seconds', type=float, default=2.0,
+        help='time spent measuring each operation, after 3 runs')
+    run_parser.add_argument(
+        '-o', '--output', help='JSON file where to write the results')
+
+    compare_parser = subparsers.add_parser(
+        'compare', help='find regressions between two JSON results')
+    compare_parser.add_argument('old', help='the reference results')
+    compare_parser.add_argument('new', help='the results to check')
+    compare_parser.add_argument(
+        '--threshold', type=float, default=1.2,
+        help='slowdown or memory growth ratio considered a regression')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        report = run_benchmarks(
+            args.sizes, args.seed, args.max_runs, args.max_seconds)
+        print(format_report(report))
+        if args.output:
+            save_report(args.output, report)
+        return 0
+
+    with open(args.old) as f:
+        old = json.loads(f.read())
+    with open(args.new) as f:
+        new = json.loads(f.read())
+    regressions = compare(old, new, args.threshold)
+    for regression in regressions:
+        print(regression)
+    if not regressions:
+        print('No regressions')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
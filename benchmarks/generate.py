@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta, timezone
+import json
+from pathlib import Path
+from random import Random
+from typing import List
+
+WORDS = [
+    'read', 'write', 'article', 'German', 'Japanese', 'framework', 'try',
+    'learn', 'paper', 'book', 'chapter', 'exercise', 'run', 'cook', 'clean',
+    'call', 'practice', 'guitar', 'review', 'notes', 'watch', 'talk',
+]
+
+
+def activity_names(n: int, seed: int) -> List[str]:
+    """Generate n distinct, realistic looking, activity names."""
+    rng = Random(seed)
+    return [
+        f'{" ".join(rng.choices(WORDS, k=rng.randint(2, 5)))} #{i}'
+        for i in range(n)
+    ]
+
+
+def generate_state(fname: Path, names: List[str], seed: int) -> None:
+    """Write a state file with the given activities and random weights.
+
+    It's written as `save_state` does, without building the state first.
+    """
+    rng = Random(seed)
+    with open(fname, 'w') as f:
+        f.write('{\n  "activities": {')
+        for i, name in enumerate(names):
+            if i > 0:
+                f.write(',')
+            weight = round(rng.uniform(0.1, 10.0), 2)
+            f.write(f'\n    {json.dumps(name)}: {weight}')
+        f.write('\n  },\n  "current_activity": null,\n'
+                '  "current_activity_start": null\n}')
+
+
+def generate_log(
+        fname: Path,
+        names: List[str],
+        lines: int,
+        seed: int,
+) -> None:
+    """Write an outcome log with lines outcomes of the given activities.
+
+    The outcomes are ordered by time, as `log_activity_result` writes
+    them, and written one at a time.
+    """
+    rng = Random(seed)
+    moment = datetime(2019, 1, 1, tzinfo=timezone(timedelta(hours=1)))
+    with open(fname, 'w') as f:
+        for _ in range(lines):
+            start = moment + timedelta(minutes=rng.randint(1, 600))
+            moment = start + timedelta(minutes=rng.randint(5, 120))
+            f.write(json.dumps(dict(
+                activity=rng.choice(names),
+                start_at=start.isoformat(),
+                end_at=moment.isoformat(),
+                is_done=rng.random() < 0.7,
+                feedback=' '.join(rng.choices(WORDS, k=rng.randint(0, 12))),
+            )))
+            f.write('\n')
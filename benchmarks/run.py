@@ -0,0 +1,235 @@
+from datetime import datetime, timedelta, timezone
+import json
+from pathlib import Path
+import platform
+from random import Random
+import sys
+import tempfile
+from time import perf_counter
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from benchmarks.generate import activity_names, generate_log, generate_state
+from choose_activity.helpers import (
+    ActivityOutcome,
+    latest_outcome_for_activity,
+    load_state,
+    log_activity_result,
+    save_state,
+    user_selection,
+    weighted_choice,
+    weighted_sample,
+)
+from choose_activity import segments
+from choose_activity.option_index import OptionIndex
+from choose_activity.outcome_index import scan_latest_line
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of already sorted values."""
+    rank = max(0, min(len(sorted_values) - 1,
+                      round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def measure(
+        operation: Callable[[], Any],
+        min_runs: int,
+        max_runs: int,
+        max_seconds: float,
+) -> Dict[str, float]:
+    """Time an operation many times, then trace its memory once.
+
+    It runs at least min_runs times and then until max_runs or until
+    max_seconds are spent.
+
+    Returns
+    -------
+    Dict[str, float]
+        The latency percentiles and the maximum in milliseconds, the
+        number of runs and the peak memory allocated in KiB
+    """
+    timings = []
+    began = perf_counter()
+    while len(timings) < max_runs and (
+            len(timings) < min_runs or perf_counter() - began < max_seconds):
+        start = perf_counter()
+        operation()
+        timings.append((perf_counter() - start) * 1000)
+    timings.sort()
+    result = {f'p{p}_ms': percentile(timings, p) for p in PERCENTILES}
+    result['max_ms'] = timings[-1]
+    result['runs'] = len(timings)
+
+    tracemalloc.start()
+    try:
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    result['peak_kib'] = peak / 1024
+    return result
+
+
+def benchmark_size(
+        workdir: Path,
+        size: int,
+        seed: int,
+        max_runs: int,
+        max_seconds: float,
+) -> Dict[str, Dict[str, float]]:
+    """Measure all the hot paths with a state and a log of a given size."""
+    state_path = workdir / f'state_{size}.json'
+    log_path = workdir / f'outcomes_{size}.log'
+    names = activity_names(size, seed)
+    generate_state(state_path, names, seed)
+    generate_log(log_path, names, size, seed)
+    rng = Random(seed)
+
+    state = load_state(state_path)
+    activities = state.activities
+    # a query matching exactly one option, like a user typing a name
+    queries = [f'#{rng.randrange(size)} ' for _ in range(1000)]
+    options = [f'{name} ' for name in names]
+    # built once, like the CLI keeps it with the state
+    index = OptionIndex(options)
+    now = datetime.now(timezone.utc)
+    outcome = ActivityOutcome(
+        activity=names[0],
+        start_at=now - timedelta(minutes=30),
+        end_at=now,
+        is_done=True,
+        feedback='benchmark',
+    )
+
+    operations = {
+        'weighted_choice': lambda: weighted_choice(activities),
+        'weighted_sample_10': lambda: weighted_sample(activities, 10),
+        'user_selection': lambda: user_selection(
+            options, rng.choice(queries), index),
+        'load_state': lambda: load_state(state_path),
+        'save_state': lambda: save_state(workdir / 'saved.json', state),
+        # this also keeps the index of the log up to date
+        'log_activity_result': lambda: log_activity_result(log_path, outcome),
+        'latest_outcome_indexed': lambda: latest_outcome_for_activity(
+            log_path, rng.choice(names)),
+        'latest_outcome_tail_scan': lambda: scan_latest_line(
+            log_path, rng.choice(names)),
+    }
+    results = {}
+    for name, operation in operations.items():
+        # the first run builds caches and indexes, it's not measured
+        operation()
+        results[name] = measure(operation, 3, max_runs, max_seconds)
+    return results
+
+
+def run_benchmarks(
+        sizes: List[int],
+        seed: int = 42,
+        max_runs: int = 1000,
+        max_seconds: float = 2.0,
+) -> Dict[str, Any]:
+    """Run the benchmarks for all the sizes.
+
+    Parameters
+    ----------
+    sizes : List[int]
+        Number of activities and of outcomes to generate for each run
+    seed : int
+        Seed of the generated data, to compare runs on the same data
+    max_runs : int
+        Maximum number of times an operation is measured
+    max_seconds : float
+        Time after which an operation is not measured anymore, after the
+        first 3 runs
+
+    Returns
+    -------
+    Dict[str, Any]
+        The environment of the run, and the results of each operation
+        for each size
+    """
+    report = dict(
+        meta=dict(
+            python=platform.python_version(),
+            platform=platform.platform(),
+            seed=seed,
+            date=datetime.now(timezone.utc).isoformat(),
+        ),
+        results={},
+    )
+    # the big logs would be rotated away by the first append, leaving
+    # the lookups an empty log, so they're measured unrotated
+    max_bytes = segments.SEGMENT_MAX_BYTES
+    segments.SEGMENT_MAX_BYTES = sys.maxsize
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for size in sizes:
+                report['results'][str(size)] = benchmark_size(
+                    Path(workdir), size, seed, max_runs, max_seconds)
+    finally:
+        segments.SEGMENT_MAX_BYTES = max_bytes
+    return report
+
+
+def compare(
+        old: Dict[str, Any],
+        new: Dict[str, Any],
+        threshold: float = 1.2,
+) -> List[str]:
+    """Find the operations that got slower or use more memory.
+
+    Parameters
+    ----------
+    old : Dict[str, Any]
+        The report of the reference run
+    new : Dict[str, Any]
+        The report of the run to check
+    threshold : float
+        How many times bigger a median latency or a peak memory must be to
+        be a regression
+
+    Returns
+    -------
+    List[str]
+        A description of each regression
+    """
+    regressions = []
+    for size, operations in new['results'].items():
+        for name, result in operations.items():
+            reference = old['results'].get(size, {}).get(name)
+            if reference is None:
+                continue
+            for metric in ('p50_ms', 'peak_kib'):
+                if reference[metric] <= 0:
+                    continue
+                ratio = result[metric] / reference[metric]
+                if ratio > threshold:
+                    regressions.append(
+                        f'{name} at {size}: {metric} went from '
+                        f'{reference[metric]:.3f} to {result[metric]:.3f} '
+                        f'({ratio:.2f}x)')
+    return regressions
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """Represent the results as a table, to be read by humans."""
+    lines = [
+        f'{"size":>9} {"operation":<26} {"p50 ms":>10} {"p90 ms":>10}'
+        f' {"p99 ms":>10} {"peak KiB":>10}'
+    ]
+    for size, operations in report['results'].items():
+        for name, r in operations.items():
+            lines.append(
+                f'{size:>9} {name:<26} {r["p50_ms"]:>10.3f}'
+                f' {r["p90_ms"]:>10.3f} {r["p99_ms"]:>10.3f}'
+                f' {r["peak_kib"]:>10.1f}')
+    return '\n'.join(lines)
+
+
+def save_report(fname: Path, report: Dict[str, Any]) -> None:
+    with open(fname, 'w') as f:
+        f.write(json.dumps(report, indent=2, sort_keys=True))
@@ -1,22 +1,57 @@
-from datetime import datetime
+import argparse
+import cProfile
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+import os
 from pathlib import Path
+import signal
+import sys
 from textwrap import dedent
+from typing import Optional
 
 from choose_activity.helpers import (
+    ActivitiesState,
     ActivityOutcome,
+    ConflictError,
+    activity_index,
     get_answer,
     get_bool,
     get_weight,
-    load_state,
-    save_state,
-    weighted_choice,
-    log_activity_result,
-    latest_outcome_for_activity,
+    parse_weight,
+    pick_activity,
+    weighted_choice_counts,
+    weighted_sample,
     FontColor
     )
+from choose_activity.binary_log import binary_to_log, log_to_binary
+from choose_activity.bulk import (
+    FORMATS,
+    guess_format,
+    read_activities,
+    write_activities,
+)
+from choose_activity.daemon import DaemonError, send_request, serve
+from choose_activity import profiling
+from choose_activity.profiling import PROFILE_ENV_VAR
+from choose_activity.storage import (
+    FileStorage,
+    SQLiteStorage,
+    Storage,
+    migrate_to_sqlite,
+)
 
 ACTIVITIES_STATE_FILE_PATH = Path.home() / '.choose_activity.activities'
 ACTIVITIES_LOG_FILE_PATH = Path.home() / '.choose_activity.log'
+ACTIVITIES_DB_FILE_PATH = Path.home() / '.choose_activity.sqlite3'
+DAEMON_SOCKET_PATH = Path.home() / '.choose_activity.sock'
+
+# the commands changing the activities, both directly and through the daemon
+ACTIVITY_COMMANDS = ('pick', 'finish', 'add', 'reweight', 'delete')
+OUTCOME_DONE = 'done'
+# set it to "sqlite" to use the database instead of the files
+STORAGE_ENV_VAR = 'CHOOSE_ACTIVITY_STORAGE'
+# set it to "1" to keep the activities in a CompactActivities
+COMPACT_ENV_VAR = 'CHOOSE_ACTIVITY_COMPACT'
 
 TXT_NEW_ACTIVITY = 'Add a new type of activity'
 TXT_CHANGE_WEIGHT = 'Change the weight of an activity'
@@ -27,15 +62,353 @@ TXT_DONE = 'Done that'
 TXT_SKIPPED = 'Skipped'
 
 
-def main():
-    activities_state = load_state(ACTIVITIES_STATE_FILE_PATH)
+def open_storage() -> Storage:
+    """Open the storage chosen with the environment variables."""
+    compact = os.environ.get(COMPACT_ENV_VAR) == '1'
+    if os.environ.get(STORAGE_ENV_VAR, 'file') == 'sqlite':
+        return SQLiteStorage(ACTIVITIES_DB_FILE_PATH, compact)
+    return FileStorage(
+        ACTIVITIES_STATE_FILE_PATH, ACTIVITIES_LOG_FILE_PATH, compact)
+
+
+def plan(storage: Storage, k: int):
+    """Print k distinct activities chosen at random, by weight."""
+    activities_state = storage.load_state()
+    planned = weighted_sample(activities_state.activities, k)
+    if not planned:
+        print('There are no activities to plan')
+        return
+    for i, activity in enumerate(planned):
+        print(f'{i + 1}) {activity}')
+
+
+def simulate(storage: Storage, n: int, seed=None):
+    """Draw n activities and compare the frequencies with the weights."""
+    activities_state = storage.load_state()
+    activities = activities_state.activities
+    if not activities or n <= 0:
+        print('Nothing to simulate')
+        return
+    counts = weighted_choice_counts(activities, n, seed)
+    if not counts:
+        print('All the weights are 0, nothing to simulate')
+        return
+    total_weight = sum(activities.values())
+    print(f'{"expected":>9} {"empirical":>9}  activity')
+    for activity, weight in activities.items():
+        expected = weight / total_weight
+        empirical = counts.get(activity, 0) / n
+        print(f'{expected:>9.2%} {empirical:>9.2%}  {activity}')
+
+
+def _format_seconds(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return '-'
+    return str(timedelta(seconds=round(seconds)))
+
+
+def show_stats(storage: Storage):
+    """Print the statistics of each activity, the most done first."""
+    stats = storage.activity_stats()
+    if not stats:
+        print('No outcome stored yet')
+        return
+    print(f'{"done":>5} {"skipped":>7} {"rate":>5} {"total":>10}'
+          f' {"median":>9} {"last done":>10}  activity')
+    for activity, s in sorted(stats.items(), key=lambda i: -i[1].done):
+        last_done = '-'
+        if s.last_done is not None:
+            last_done = s.last_done.date().isoformat()
+        print(f'{s.done:>5} {s.skipped:>7} {s.done_rate:>5.0%}'
+              f' {_format_seconds(s.total_time):>10}'
+              f' {_format_seconds(s.median_time):>9}'
+              f' {last_done:>10}  {activity}')
+
+
+def _parse_moment(text: str) -> datetime:
+    """A date or date and time in ISO 8601, by default in the local zone."""
+    moment = datetime.fromisoformat(text)
+    if moment.tzinfo is None:
+        moment = moment.astimezone()
+    return moment
+
+
+def show_history(
+        storage: Storage,
+        since: Optional[datetime],
+        until: Optional[datetime],
+):
+    """Print the outcomes ended in a range of time, the oldest first."""
+    found = False
+    for outcome in storage.outcomes_between(since, until):
+        found = True
+        end_at = outcome.end_at.astimezone().strftime('%Y-%m-%d %H:%M')
+        result = OUTCOME_DONE if outcome.is_done else 'skipped'
+        duration = _format_seconds(
+            (outcome.end_at - outcome.start_at).total_seconds())
+        feedback = f': {outcome.feedback}' if outcome.feedback else ''
+        print(f'{end_at} {result:>7} {duration:>9}  {outcome.activity}'
+              f'{feedback}')
+    if not found:
+        print('No outcome in this time range')
+
+
+def migrate():
+    """Copy the content of the files into a new SQLite database."""
+    try:
+        migrate_to_sqlite(
+            ACTIVITIES_STATE_FILE_PATH,
+            ACTIVITIES_LOG_FILE_PATH,
+            ACTIVITIES_DB_FILE_PATH,
+        ).close()
+    except FileExistsError as fe:
+        print(fe.args[0])
+        return
+    print(f'Migrated to {ACTIVITIES_DB_FILE_PATH}, set {STORAGE_ENV_VAR}'
+          '=sqlite to use it')
+
+
+def export_log(fname: str):
+    """Append the outcomes of the log to a binary log."""
+    try:
+        count = log_to_binary(ACTIVITIES_LOG_FILE_PATH, Path(fname))
+    except ValueError as ve:
+        print(f'{ve.args[0]}, nothing was exported')
+        return
+    print(f'Exported {count} outcomes to {fname}')
+
+
+def import_log(fname: str):
+    """Append the outcomes of a binary log to the log."""
+    try:
+        count = binary_to_log(Path(fname), ACTIVITIES_LOG_FILE_PATH)
+    except ValueError as ve:
+        print(f'{ve.args[0]}, nothing was imported')
+        return
+    print(f'Imported {count} outcomes from {fname}')
+
+
+def weight_argument(text: str) -> float:
+    """Parse the weight given on the command line, see `parse_weight`."""
+    try:
+        return parse_weight(text)
+    except ValueError as ve:
+        raise argparse.ArgumentTypeError(ve.args[0])
+
+
+def add_activity_commands(subparsers):
+    """Add the commands to change the activities without interaction."""
+    subparsers.add_parser('pick', help='choose an activity and start it')
+    finish_parser = subparsers.add_parser(
+        'finish', help='finish the current activity')
+    finish_parser.add_argument('outcome', choices=[OUTCOME_DONE, 'skipped'])
+    finish_parser.add_argument(
+        '-m', '--message', default='', help='how do you feel about it')
+    finish_parser.add_argument(
+        '--delete', action='store_true', help='delete the activity too')
+    for name, help_text in [
+            ('add', 'add an activity'),
+            ('reweight', 'change the weight of an activity'),
+            ('delete', 'delete an activity')]:
+        command_parser = subparsers.add_parser(name, help=help_text)
+        command_parser.add_argument('activity')
+        if name != 'delete':
+            command_parser.add_argument('weight', type=weight_argument)
+
+
+def finish_activity(
+        storage: Storage,
+        activities_state: ActivitiesState,
+        is_done: bool,
+        feedback: str,
+        delete: bool,
+):
+    """Finish the current activity, storing its outcome."""
+    activity = activities_state.current_activity
+    start_at = activities_state.current_activity_start
+    # finish first, so it fails if another session already did
+    storage.record_mutation(activities_state, 'finish')
+    storage.log_activity_result(ActivityOutcome(
+        activity=activity,
+        start_at=start_at,
+        end_at=datetime.now().astimezone(),
+        is_done=is_done,
+        feedback=feedback
+    ))
+    if delete:
+        storage.record_mutation(
+            activities_state,
+            'delete',
+            activity=activity,
+        )
+        print('Deleted!')
+
+
+def run_activity_command(storage: Storage, args: argparse.Namespace):
+    """Run one of the commands added by add_activity_commands."""
+    activities_state = storage.load_state()
+    activities = activities_state.activities
+    if args.command == 'add':
+        storage.record_mutation(
+            activities_state,
+            'add',
+            activity=args.activity,
+            weight=args.weight,
+        )
+        print(f'Activity inserted: {args.activity}')
+        return
+    if args.command in ('reweight', 'delete'):
+        if args.activity not in activities:
+            print(f'Unknown activity {args.activity}')
+            return
+    if args.command == 'reweight':
+        storage.record_mutation(
+            activities_state,
+            'reweight',
+            activity=args.activity,
+            weight=args.weight,
+        )
+        print(f'Activity updated: {args.activity} has now weight'
+              f' {args.weight}')
+        return
+    if args.command == 'delete':
+        storage.record_mutation(
+            activities_state, 'delete', activity=args.activity)
+        print(f'Activity deleted: {args.activity}')
+        return
+    if args.command == 'pick':
+        if activities_state.current_activity is not None:
+            print(f'The activity {activities_state.current_activity}'
+                  ' is going on, finish it first')
+            return
+        activity = pick_activity(activities_state)
+        if activity is None:
+            print('There are no activities')
+            return
+        storage.record_mutation(
+            activities_state,
+            'start',
+            activity=activity,
+            at=datetime.now().astimezone(),
+        )
+        print(f'The chosen activity is: {activity}')
+        latest = storage.latest_outcome_for_activity(activity)
+        if latest is not None:
+            print(f'The latest outcome was: {latest}')
+        return
+    if args.command == 'finish':
+        if activities_state.current_activity is None:
+            print('No activity is going on')
+            return
+        finish_activity(
+            storage,
+            activities_state,
+            args.outcome == OUTCOME_DONE,
+            args.message,
+            args.delete,
+        )
+        print('Bye.')
+
+
+def import_activities(
+        storage: Storage,
+        fname: str,
+        fmt: Optional[str],
+        replace: bool,
+):
+    """Add or update the activities in a file, with a single write."""
+    activities_state = storage.load_state()
+    if replace:
+        activities_state.activities.clear()
+    fmt = fmt or guess_format(fname)
+    count = 0
+    with _open_file(fname, 'r') as f:
+        try:
+            for activity, weight in read_activities(f, fmt):
+                activities_state.activities[activity] = weight
+                count += 1
+        except ValueError as ve:
+            print(f'{ve.args[0]}, nothing was imported')
+            return
+    storage.save_state(activities_state)
+    print(f'Imported {count} activities')
+
+
+def export_activities(storage: Storage, fname: str, fmt: Optional[str]):
+    """Write the activities to a file."""
+    activities_state = storage.load_state()
+    with _open_file(fname, 'w') as f:
+        write_activities(
+            f, activities_state.activities, fmt or guess_format(fname))
+
+
+def _open_file(fname: str, mode: str):
+    """Open a file, - being the standard input or output."""
+    if fname == '-':
+        return nullcontext(sys.stdin if mode == 'r' else sys.stdout)
+    return open(fname, mode, newline='')
+
+
+def client(args: argparse.Namespace):
+    """Send a command to the daemon and show the answer."""
+    request = dict(command=args.client_command)
+    if args.client_command in ('add', 'reweight', 'delete'):
+        request['activity'] = args.activity
+    if args.client_command in ('add', 'reweight'):
+        request['weight'] = args.weight
+    if args.client_command == 'finish':
+        request['command'] = 'feedback'
+        request['is_done'] = args.outcome == OUTCOME_DONE
+        request['feedback'] = args.message
+        request['delete'] = args.delete
+    try:
+        response = send_request(DAEMON_SOCKET_PATH, request)
+    except OSError:
+        print('The daemon is not running, start it with: '
+              'python3 -m choose_activity serve')
+        return
+    if 'error' in response:
+        print(response['error'])
+        return
+    if args.client_command == 'pick':
+        print(f'The chosen activity is: {response["activity"]}')
+        if response['latest'] is not None:
+            print(f'The latest outcome was: {response["latest"]}')
+    elif args.client_command in ('add', 'reweight'):
+        print(f'{response["activity"]} has now weight {response["weight"]}')
+    elif args.client_command == 'delete':
+        print(f'Activity deleted: {response["activity"]}')
+    elif args.client_command == 'finish':
+        print(f'Outcome stored for {response["activity"]}')
+
+
+def interactive(storage: Storage):
+    activities_state = storage.load_state()
 
     def add_activity():
         activity_name = input('What is the name of the new activity? ')
         activity_weight = get_weight('Weight for this activity', input)
-        activities_state.activities[activity_name] = activity_weight
+        storage.record_mutation(
+            activities_state,
+            'add',
+            activity=activity_name,
+            weight=activity_weight,
+        )
         print('Activity inserted!')
-        save_state(ACTIVITIES_STATE_FILE_PATH, activities_state)
+
+    def ask_activity():
+        candidates = list(activities_state.activities) + [TXT_EXIT]
+        # the index of the activities is kept, exit is there only now
+        index = activity_index(activities_state)
+        added = TXT_EXIT not in index
+        index.add(TXT_EXIT)
+        try:
+            print(FontColor.Magenta, end="")
+            return get_answer(candidates, input, index)
+        finally:
+            print(FontColor.Reset)
+            if added:
+                index.remove(TXT_EXIT)
 
     # if an activity is going on, ask for a feedback to quit it
     print('')
@@ -49,22 +422,8 @@ def main():
         is_done = get_answer([TXT_DONE, TXT_SKIPPED], input) == TXT_DONE
         print(':)' if is_done else ':(')
         feedback = input('How do you feel about it?\n')
-        log_activity_result(
-            ACTIVITIES_LOG_FILE_PATH,
-            ActivityOutcome(
-                activity=activities_state.current_activity,
-                start_at=activities_state.current_activity_start,
-                end_at=datetime.now().astimezone(),
-                is_done=is_done,
-                feedback=feedback
-            ))
-        if get_bool('Delete this activity from the list?', input):
-            del activities_state.activities[activities_state.current_activity]
-            print('Deleted!')
-
-        activities_state.current_activity = None
-        activities_state.current_activity_start = None
-        save_state(ACTIVITIES_STATE_FILE_PATH, activities_state)
+        delete = get_bool('Delete this activity from the list?', input)
+        finish_activity(storage, activities_state, is_done, feedback, delete)
         print('Bye.')
         return
     # one can always add an activity
@@ -84,17 +443,16 @@ def main():
         return
 
     if choice == TXT_DELETE_ACTIVITY:
-        delete_candidates = list(activities_state.activities)
-        delete_candidates += [TXT_EXIT]
-        print(FontColor.Magenta, end="")
-        choice = get_answer(delete_candidates, input)
-        print(FontColor.Reset)
+        choice = ask_activity()
         if choice == TXT_EXIT:
             print('Exiting without changes')
             return
 
-        del activities_state.activities[choice]
-        save_state(ACTIVITIES_STATE_FILE_PATH, activities_state)
+        storage.record_mutation(
+            activities_state,
+            'delete',
+            activity=choice,
+        )
         print(f'Activity deleted: {choice}')
         return
 
@@ -103,24 +461,23 @@ def main():
         return
 
     if choice == TXT_CHANGE_WEIGHT:
-        change_candidates = list(activities_state.activities)
-        change_candidates += [TXT_EXIT]
-        print(FontColor.Magenta, end="")
-        choice = get_answer(change_candidates, input)
-        print(FontColor.Reset)
-
+        choice = ask_activity()
         if choice == TXT_EXIT:
             print('Exiting without changes')
             return
         print(f'The current weight is {activities_state.activities[choice]}')
         new_weight = get_weight(f'New weight for the activity {choice}', input)
-        activities_state.activities[choice] = new_weight
-        save_state(ACTIVITIES_STATE_FILE_PATH, activities_state)
+        storage.record_mutation(
+            activities_state,
+            'reweight',
+            activity=choice,
+            weight=new_weight,
+        )
         print(f'Activity updated: {choice} has now weight {new_weight}')
         return
 
     if choice == TXT_DO_ACTIVITY:
-        activity = weighted_choice(activities_state.activities)
+        activity = pick_activity(activities_state)
         print(dedent(f'''
         The chosen activity is:
         {FontColor.Green}
@@ -128,10 +485,7 @@ def main():
         {FontColor.Reset}
         Go!
         '''))
-        latest = latest_outcome_for_activity(
-            ACTIVITIES_LOG_FILE_PATH,
-            activity,
-        )
+        latest = storage.latest_outcome_for_activity(activity)
         if latest is not None:
             print(dedent(f'''
             This activity has already been done, the latest outcome was:
@@ -139,13 +493,201 @@ def main():
               📖 {latest}
 
             '''))
-        activities_state.current_activity = activity
-        activities_state.current_activity_start = datetime.now().astimezone()
-        save_state(ACTIVITIES_STATE_FILE_PATH, activities_state)
+        storage.record_mutation(
+            activities_state,
+            'start',
+            activity=activity,
+            at=datetime.now().astimezone(),
+        )
         return
 
     raise NotImplementedError(f'Choice {choice} not implemented!')
 
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='choose_activity',
+        description='Choose a random activity to do from a list. '
+                    'Without a command it runs interactively.',
+    )
+    subparsers = parser.add_subparsers(dest='command')
+    plan_parser = subparsers.add_parser(
+        'plan',
+        help='print some distinct activities chosen at random',
+    )
+    plan_parser.add_argument(
+        'k', type=int, help='how many activities to choose')
+
+    simulate_parser = subparsers.add_parser(
+        'simulate',
+        help='draw many activities and show their frequency',
+    )
+    simulate_parser.add_argument(
+        '-n', type=int, default=1_000_000, help='how many draws to do')
+    simulate_parser.add_argument(
+        '--seed', type=int, help='seed of the random generator')
+
+    subparsers.add_parser(
+        'migrate-sqlite',
+        help='copy the activities and outcomes to a new SQLite database',
+    )
+
+    serve_parser = subparsers.add_parser(
+        'serve',
+        help='keep the activities in memory and serve the client commands',
+    )
+    serve_parser.add_argument(
+        '--flush-interval', type=float, default=1.0,
+        help='minimum seconds between two writes of the changes')
+
+    client_parser = subparsers.add_parser(
+        'client',
+        help='send a command to the running daemon',
+    )
+    add_activity_commands(client_parser.add_subparsers(
+        dest='client_command', required=True))
+    add_activity_commands(subparsers)
+
+    import_parser = subparsers.add_parser(
+        'import',
+        help='add or update many activities from a CSV or JSONL file',
+    )
+    import_parser.add_argument(
+        'file', help='the file to read, - for the standard input')
+    import_parser.add_argument(
+        '--format', choices=FORMATS,
+        help='the format of the file, by default guessed from the name')
+    import_parser.add_argument(
+        '--replace', action='store_true',
+        help='remove the activities not in the file')
+
+    export_parser = subparsers.add_parser(
+        'export',
+        help='write the activities to a CSV or JSONL file',
+    )
+    export_parser.add_argument(
+        'file', nargs='?', default='-',
+        help='the file to write, by default the standard output')
+    export_parser.add_argument(
+        '--format', choices=FORMATS,
+        help='the format of the file, by default guessed from the name')
+
+    subparsers.add_parser(
+        'stats',
+        help='show how often each activity was done and for how long',
+    )
+
+    history_parser = subparsers.add_parser(
+        'history',
+        help='show the outcomes ended in a range of time',
+    )
+    since_group = history_parser.add_mutually_exclusive_group()
+    since_group.add_argument(
+        '--since', type=_parse_moment,
+        help='ISO date or date and time to start from, included')
+    since_group.add_argument(
+        '--days', type=float,
+        help='start from this many days ago')
+    history_parser.add_argument(
+        '--until', type=_parse_moment,
+        help='ISO date or date and time to stop at, excluded')
+
+    export_log_parser = subparsers.add_parser(
+        'export-log',
+        help='append the outcomes to a compact binary log',
+    )
+    export_log_parser.add_argument('file', help='the binary log to write')
+    import_log_parser = subparsers.add_parser(
+        'import-log',
+        help='append the outcomes of a binary log to the log',
+    )
+    import_log_parser.add_argument('file', help='the binary log to read')
+
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='print the time spent in each step, also enabled by the'
+             f' environment variable {PROFILE_ENV_VAR}=1')
+    parser.add_argument(
+        '--profile-trace', metavar='FILE',
+        help='write the timed steps to a Chrome trace file')
+    parser.add_argument(
+        '--profile-dump', metavar='FILE',
+        help='write the cProfile statistics to a file')
+
+    args = parser.parse_args(argv)
+    show_breakdown = args.profile or os.environ.get(PROFILE_ENV_VAR) == '1'
+    if not (show_breakdown or args.profile_trace or args.profile_dump):
+        run_command(args)
+        return
+    profiler = profiling.enable()
+    function_profiler = cProfile.Profile() if args.profile_dump else None
+    try:
+        with profiler.span('total'):
+            if function_profiler is None:
+                run_command(args)
+            else:
+                function_profiler.runcall(run_command, args)
+    finally:
+        profiling.disable()
+        if function_profiler is not None:
+            function_profiler.dump_stats(args.profile_dump)
+        if args.profile_trace:
+            profiler.write_trace(args.profile_trace)
+        if show_breakdown:
+            print(profiler.breakdown(), file=sys.stderr)
+
+
+def run_command(args: argparse.Namespace) -> None:
+    """Run the command parsed from the command line."""
+    if args.command == 'migrate-sqlite':
+        migrate()
+        return
+    if args.command == 'client':
+        client(args)
+        return
+    if args.command == 'export-log':
+        export_log(args.file)
+        return
+    if args.command == 'import-log':
+        import_log(args.file)
+        return
+    with profiling.span('open_storage'):
+        storage = open_storage()
+    try:
+        if args.command == 'plan':
+            plan(storage, args.k)
+        elif args.command == 'simulate':
+            simulate(storage, args.n, args.seed)
+        elif args.command in ACTIVITY_COMMANDS:
+            run_activity_command(storage, args)
+        elif args.command == 'stats':
+            show_stats(storage)
+        elif args.command == 'history':
+            since = args.since
+            if args.days is not None:
+                since = datetime.now().astimezone() - timedelta(days=args.days)
+            show_history(storage, since, args.until)
+        elif args.command == 'import':
+            import_activities(storage, args.file, args.format, args.replace)
+        elif args.command == 'export':
+            export_activities(storage, args.file, args.format)
+        elif args.command == 'serve':
+            print(f'Listening on {DAEMON_SOCKET_PATH}')
+            # stop cleanly, persisting the changes, when terminated
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            try:
+                serve(DAEMON_SOCKET_PATH, storage, args.flush_interval)
+            except KeyboardInterrupt:
+                print('Bye.')
+        else:
+            interactive(storage)
+    except ConflictError as ce:
+        print(f'{ce.args[0]}, nothing was changed. Please try again.')
+    except DaemonError as de:
+        print(de.args[0])
+    finally:
+        storage.close()
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,145 @@
+"""Coroutines for the storage operations, to use from an event loop.
+
+The blocking work runs in a bounded pool of threads, each with its own
+storage, so the loop is never stalled by the disk.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+from functools import partial
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from choose_activity.helpers import ActivitiesState, ActivityOutcome
+from choose_activity.stats import ActivityStats
+from choose_activity.storage import Storage
+
+
+class AsyncStorage:
+    """The operations of a `Storage` as coroutines.
+
+    Reads requested while the same read is already running wait for it
+    instead of reading again, so a burst of requests for the state costs
+    a single load. Writes run one at a time, in the order requested, and
+    reads requested after a write never get data older than it.
+
+    Use it as an async context manager, or call `close` when done.
+
+    Parameters
+    ----------
+    open_storage : Callable[[], Storage]
+        Create a storage, called once by each thread of the pool
+    max_workers : int
+        Maximum number of threads doing the blocking work
+    """
+
+    def __init__(
+            self,
+            open_storage: Callable[[], Storage],
+            max_workers: int = 4,
+    ):
+        self.open_storage = open_storage
+        self.executor = ThreadPoolExecutor(
+            max_workers, thread_name_prefix='choose_activity')
+        self._local = threading.local()
+        self._storages: List[Storage] = []
+        self._storages_lock = threading.Lock()
+        # the reads running right now, by operation and arguments
+        self._reads: Dict[Hashable, asyncio.Future] = {}
+        self._write_lock: Optional[asyncio.Lock] = None
+
+    def _storage(self) -> Storage:
+        """The storage of the current thread of the pool."""
+        storage = getattr(self._local, 'storage', None)
+        if storage is None:
+            storage = self._local.storage = self.open_storage()
+            with self._storages_lock:
+                self._storages.append(storage)
+        return storage
+
+    def _call(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        return getattr(self._storage(), method)(*args, **kwargs)
+
+    def _run(self, method: str, *args: Any, **kwargs: Any) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(
+            self.executor, partial(self._call, method, *args, **kwargs))
+
+    async def _read(self, method: str, *args: Any) -> Any:
+        key = (method, *args)
+        future = self._reads.get(key)
+        if future is None:
+            future = self._reads[key] = self._run(method, *args)
+            future.add_done_callback(partial(self._forget, key))
+        # a cancelled caller must not cancel the read of the others
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._reads.get(key) is future:
+            del self._reads[key]
+
+    async def _write(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        if self._write_lock is None:
+            # created here, to be bound to the running loop
+            self._write_lock = asyncio.Lock()
+        async with self._write_lock:
+            # the reads running now may miss this write, later ones must
+            # not wait for them
+            self._reads.clear()
+            return await self._run(method, *args, **kwargs)
+
+    async def load_state(self) -> ActivitiesState:
+        """Load the state, an empty one if nothing was stored yet.
+
+        Each caller gets its own copy, even when the load was shared.
+        """
+        state = await self._read('load_state')
+        return replace(state, activities=dict(state.activities))
+
+    async def save_state(self, state: ActivitiesState) -> None:
+        """Store the whole state, see `Storage.save_state`."""
+        await self._write('save_state', state)
+
+    async def record_mutation(
+            self,
+            state: ActivitiesState,
+            op: str,
+            **fields: Any,
+    ) -> None:
+        """Apply a mutation and persist it, see `Storage.record_mutation`.
+
+        The state must not be used by others until it's done.
+        """
+        await self._write('record_mutation', state, op, **fields)
+
+    async def log_activity_result(self, outcome: ActivityOutcome) -> None:
+        """Store the outcome of an activity."""
+        await self._write('log_activity_result', outcome)
+
+    async def latest_outcome_for_activity(
+            self,
+            activity: str,
+    ) -> Optional[str]:
+        """The feedback of the latest outcome of an activity, if any."""
+        return await self._read('latest_outcome_for_activity', activity)
+
+    async def activity_stats(self) -> Dict[str, ActivityStats]:
+        """The statistics of the outcomes of each activity.
+
+        Callers sharing the read get the same object, do not change it.
+        """
+        return await self._read('activity_stats')
+
+    async def close(self) -> None:
+        """Wait for the pending work, then close every storage."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.executor.shutdown)
+        for storage in self._storages:
+            storage.close()
+        self._storages.clear()
+
+    async def __aenter__(self) -> 'AsyncStorage':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
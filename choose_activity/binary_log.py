@@ -0,0 +1,274 @@
+"""A compact binary format for the outcomes, and conversion to JSONL.
+
+Every activity name is written once, the first time it's met, and then
+referred to by its number. A record is either the definition of a name
+or an outcome, starting with a tag byte:
+
+- `N`: the length of the name (uint16) and the name in UTF-8; names are
+  numbered from 0 in the order they are defined
+- `O`: the number of the activity (uint32); start and end as
+  microseconds since the epoch (int64) and offset from UTC in seconds
+  (int32) each; a flags byte; the length of the feedback (uint32) and
+  the feedback in UTF-8
+
+All the integers are little endian. The file starts with MAGIC.
+"""
+from datetime import datetime, timedelta, timezone
+import os
+from pathlib import Path
+import struct
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+
+from choose_activity.helpers import ActivityOutcome
+from choose_activity.locking import file_lock
+from choose_activity.outcome_range import (
+    check_order,
+    outcomes_between,
+    skip_logged,
+)
+from choose_activity.outcome_writer import OutcomeWriter
+
+MAGIC = b'CHACTLOG\x01'
+
+_NAME_TAG = ord('N')
+_OUTCOME_TAG = ord('O')
+_NAME = struct.Struct('<H')
+_OUTCOME = struct.Struct('<IqiqiBI')
+
+# how many outcomes are appended to a JSONL log at a time
+BATCH_SIZE = 10_000
+
+_IS_DONE = 1
+# a moment without time zone, stored as if it was in UTC
+_START_NAIVE = 2
+_END_NAIVE = 4
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+# the time zones met while reading, by offset
+_ZONES: Dict[int, timezone] = {}
+
+CHUNK_SIZE = 1 << 16
+
+
+def _encode_moment(moment: datetime) -> Tuple[int, int, bool]:
+    """Microseconds since the epoch, offset in seconds, whether naive."""
+    offset = moment.utcoffset()
+    if offset is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+        return (moment - _EPOCH) // _MICROSECOND, 0, True
+    return (moment - _EPOCH) // _MICROSECOND, int(offset.total_seconds()), \
+        False
+
+
+def _decode_moment(micros: int, offset: int, naive: bool) -> datetime:
+    seconds, microsecond = divmod(micros, 1_000_000)
+    if naive:
+        moment = datetime.fromtimestamp(seconds, timezone.utc)
+        return moment.replace(microsecond=microsecond, tzinfo=None)
+    zone = _ZONES.get(offset)
+    if zone is None:
+        zone = _ZONES[offset] = timezone(timedelta(seconds=offset))
+    moment = datetime.fromtimestamp(seconds, zone)
+    return moment.replace(microsecond=microsecond) if microsecond else moment
+
+
+class _Reader:
+    """Parse the records of a binary log, a chunk of it at a time."""
+
+    def __init__(self, f: BinaryIO):
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('Not a binary outcome log')
+        self.f = f
+        self.names: List[str] = []
+        self.buffer = b''
+        self.pos = 0
+        # where the buffer starts in the file
+        self.start = len(MAGIC)
+
+    @property
+    def end(self) -> int:
+        """Where the last complete record ends."""
+        return self.start + self.pos
+
+    def _available(self, size: int) -> bool:
+        """Whether the next bytes are in the buffer, reading more if not."""
+        if self.pos + size <= len(self.buffer):
+            return True
+        self.start += self.pos
+        self.buffer = self.buffer[self.pos:] + self.f.read(
+            max(size, CHUNK_SIZE))
+        self.pos = 0
+        return size <= len(self.buffer)
+
+    def outcomes(self) -> Iterator[ActivityOutcome]:
+        """The outcomes, until the end or an incomplete record."""
+        names = self.names
+        while self._available(1):
+            tag = self.buffer[self.pos]
+            if tag == _NAME_TAG:
+                if not self._available(1 + _NAME.size):
+                    return
+                size, = _NAME.unpack_from(self.buffer, self.pos + 1)
+                record_size = 1 + _NAME.size + size
+                if not self._available(record_size):
+                    return
+                names.append(self.buffer[
+                    self.pos + 1 + _NAME.size:self.pos + record_size
+                ].decode())
+                self.pos += record_size
+            elif tag == _OUTCOME_TAG:
+                if not self._available(1 + _OUTCOME.size):
+                    return
+                (activity, start, start_offset, end, end_offset, flags,
+                 feedback_size) = _OUTCOME.unpack_from(
+                    self.buffer, self.pos + 1)
+                record_size = 1 + _OUTCOME.size + feedback_size
+                if not self._available(record_size):
+                    return
+                feedback = self.buffer[
+                    self.pos + 1 + _OUTCOME.size:self.pos + record_size]
+                self.pos += record_size
+                yield ActivityOutcome(
+                    activity=names[activity],
+                    start_at=_decode_moment(
+                        start, start_offset, bool(flags & _START_NAIVE)),
+                    end_at=_decode_moment(
+                        end, end_offset, bool(flags & _END_NAIVE)),
+                    is_done=bool(flags & _IS_DONE),
+                    feedback=feedback.decode(),
+                )
+            else:
+                raise ValueError(f'Unknown record {bytes([tag])!r}')
+
+
+def read_outcomes(fname: Path) -> Iterator[ActivityOutcome]:
+    """The outcomes stored in a binary log, in order.
+
+    An incomplete record at the end, being written or left by a crash, is
+    ignored.
+    """
+    with open(fname, 'rb') as f:
+        yield from _Reader(f).outcomes()
+
+
+class BinaryLogWriter:
+    """Append outcomes to a binary log, created if missing.
+
+    The names already defined in the log are read first, and an
+    incomplete record at its end is removed.
+
+    Parameters
+    ----------
+    fname : Path
+        The binary log file path
+    """
+
+    def __init__(self, fname: Path):
+        self.f = open(fname, 'a+b')
+        self.ids: Dict[str, int] = {}
+        if self.f.seek(0, os.SEEK_END) == 0:
+            self.f.write(MAGIC)
+            return
+        self.f.seek(0)
+        try:
+            reader = _Reader(self.f)
+            for _ in reader.outcomes():
+                pass
+        except BaseException:
+            self.f.close()
+            raise
+        self.ids = {name: i for i, name in enumerate(reader.names)}
+        self.f.truncate(reader.end)
+        self.f.seek(reader.end)
+
+    def write(self, outcome: ActivityOutcome) -> None:
+        """Append an outcome, defining its activity if it's new."""
+        activity = self.ids.get(outcome.activity)
+        if activity is None:
+            name = outcome.activity.encode()
+            self.f.write(bytes([_NAME_TAG]) + _NAME.pack(len(name)) + name)
+            activity = self.ids[outcome.activity] = len(self.ids)
+        start, start_offset, start_naive = _encode_moment(outcome.start_at)
+        end, end_offset, end_naive = _encode_moment(outcome.end_at)
+        flags = (
+            (_IS_DONE if outcome.is_done else 0)
+            | (_START_NAIVE if start_naive else 0)
+            | (_END_NAIVE if end_naive else 0)
+        )
+        feedback = outcome.feedback.encode()
+        self.f.write(bytes([_OUTCOME_TAG]) + _OUTCOME.pack(
+            activity, start, start_offset, end, end_offset, flags,
+            len(feedback)) + feedback)
+
+    def close(self) -> None:
+        self.f.close()
+
+    def __enter__(self) -> 'BinaryLogWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def log_to_binary(log_fname: Path, binary_fname: Path) -> int:
+    """Append the outcomes of a JSONL log to a binary one.
+
+    The rotated segments of the log are converted too.
+
+    Returns
+    -------
+    int
+        The number of outcomes converted
+    """
+    count = 0
+    with BinaryLogWriter(binary_fname) as writer:
+        for outcome in outcomes_between(log_fname):
+            writer.write(outcome)
+            count += 1
+    return count
+
+
+def binary_to_log(binary_fname: Path, log_fname: Path) -> int:
+    """Append the outcomes of a binary log to a JSONL one.
+
+    They are written by an `OutcomeWriter`, a batch at a time, so the
+    index of the log is kept and it's rotated when needed. The outcomes
+    already in the log are skipped, so importing an export of the log
+    appends nothing. The JSONL log is kept ordered by end time: nothing
+    is appended if the outcomes are not, or if any of the others ended
+    before the latest one of the log.
+
+    Returns
+    -------
+    int
+        The number of outcomes appended
+
+    Raises
+    ------
+    ValueError
+        If the file is not a binary log, or the outcomes can't be
+        appended in order
+    """
+    count = 0
+    with file_lock(log_fname):
+        # all of them are checked first, not to append only a part
+        check_order(log_fname, (
+            outcome.end_at
+            for outcome in skip_logged(log_fname, read_outcomes(binary_fname))
+        ))
+        # only the outcomes ending at the latest moment of the log are
+        # compared, the appended ones end at it or after
+        with OutcomeWriter(
+                log_fname, max_count=BATCH_SIZE, lock=False) as writer:
+            for outcome in skip_logged(
+                    log_fname, read_outcomes(binary_fname)):
+                writer.write(outcome)
+                count += 1
+    return count
+
+
+def is_binary_log(fname: Path) -> bool:
+    """Whether a file is a binary log, from its first bytes."""
+    with open(fname, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
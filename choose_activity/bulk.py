@@ -0,0 +1,82 @@
+import csv
+import json
+from typing import IO, Iterator, Mapping, Tuple
+
+from choose_activity.helpers import parse_weight
+
+FORMATS = ('csv', 'jsonl')
+
+
+def guess_format(fname: str) -> str:
+    """The format of a file from its extension, JSONL unless it's CSV."""
+    return 'csv' if fname.lower().endswith('.csv') else 'jsonl'
+
+
+def read_activities(f: IO[str], fmt: str) -> Iterator[Tuple[str, float]]:
+    """Read activities and weights from a file, one at a time.
+
+    A CSV file has the columns `activity` and `weight` with a header, a
+    JSONL file has an object with the same keys on each line. Only one
+    line at a time is kept in memory.
+
+    Parameters
+    ----------
+    f : IO[str]
+        The file to read
+    fmt : str
+        The format, `csv` or `jsonl`
+
+    Returns
+    -------
+    Iterator[Tuple[str, float]]
+        The activities and their weight, in the order of the file
+
+    Raises
+    ------
+    ValueError
+        If an activity is not valid, with its position in the file, for
+        example if its weight is negative or not finite
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown format {fmt}')
+    rows = csv.DictReader(f) if fmt == 'csv' else f
+    for number, row in enumerate(rows, start=1):
+        try:
+            if fmt == 'jsonl':
+                if not row.strip():
+                    continue
+                row = json.loads(row)
+            activity, weight = row['activity'], parse_weight(row['weight'])
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f'Invalid activity number {number}: {e!r}')
+        yield activity, weight
+
+
+def write_activities(
+        f: IO[str],
+        activities: Mapping[str, float],
+        fmt: str,
+) -> None:
+    """Write activities and weights to a file, one at a time.
+
+    The format is the same read by `read_activities`.
+
+    Parameters
+    ----------
+    f : IO[str]
+        The file to write
+    activities : Mapping[str, float]
+        The activities and their weight
+    fmt : str
+        The format, `csv` or `jsonl`
+    """
+    if fmt == 'csv':
+        writer = csv.writer(f)
+        writer.writerow(['activity', 'weight'])
+        writer.writerows(activities.items())
+    elif fmt == 'jsonl':
+        for activity, weight in activities.items():
+            f.write(json.dumps(dict(activity=activity, weight=weight)))
+            f.write('\n')
+    else:
+        raise ValueError(f'Unknown format {fmt}')
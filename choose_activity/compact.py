@@ -0,0 +1,235 @@
+"""A mapping of activities to weights taking little memory.
+
+A dictionary costs about 55 bytes per activity, counting the float
+objects of the weights. `CompactActivities` keeps the names in a list,
+the weights in an array of doubles and its own hash table in an array of
+integers, for less than half of that.
+"""
+from array import array
+from typing import (
+    Iterable,
+    ItemsView,
+    Iterator,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Tuple,
+    Union,
+    ValuesView,
+)
+
+# slots of the hash table, the others are the position of a name plus 1
+_EMPTY = 0
+_DELETED = -1
+_MIN_SLOTS = 8
+
+
+def _slot_array(size: int) -> array:
+    """An array of empty slots, with the smallest item fitting the ids."""
+    typecode = 'i' if size < 2 ** 31 else 'q'
+    return array(typecode, bytes(array(typecode).itemsize * size))
+
+
+class CompactActivities(MutableMapping[str, float]):
+    """A mapping of names to weights, in insertion order like a dict.
+
+    The hash table uses open addressing with the same probing as the
+    dictionaries of CPython. Deleted names leave a hole, and the holes
+    are removed once they are as many as the names. Every change is
+    counted in `changes`, so that what is computed from the weights can
+    be kept until they change.
+
+    >>> activities = CompactActivities({'a': 1.0, 'b': 2.0})
+    >>> del activities['a']
+    >>> dict(activities)
+    {'b': 2.0}
+
+    Parameters
+    ----------
+    activities : Union[Mapping[str, float], Iterable[Tuple[str, float]]]
+        Initial names and corresponding weights
+    """
+
+    __slots__ = (
+        '_names', '_weights', '_slots', '_len', '_filled', 'changes',
+        '__weakref__',
+    )
+
+    def __init__(
+            self,
+            activities: Union[
+                Mapping[str, float], Iterable[Tuple[str, float]]] = (),
+    ):
+        self._names: List[Optional[str]] = []
+        self._weights = array('d')
+        self._slots = _slot_array(_MIN_SLOTS)
+        self._len = 0
+        # slots not empty, deleted ones included
+        self._filled = 0
+        self.changes = 0
+        if isinstance(activities, Mapping):
+            # the names are distinct, there is no need to look them up
+            self._fill(list(activities), activities.values())
+            return
+        for name, weight in activities:
+            self[name] = weight
+
+    @classmethod
+    def from_lists(
+            cls,
+            names: List[str],
+            weights: Iterable[float],
+    ) -> 'CompactActivities':
+        """A mapping of distinct names to the weights in the same order.
+
+        The list of names is kept, not copied.
+        """
+        activities = cls()
+        activities._fill(names, weights)
+        return activities
+
+    def _fill(self, names: List[str], weights: Iterable[float]) -> None:
+        self._names = names
+        self._weights = array('d', weights)
+        self._len = len(names)
+        self.changes += 1
+        self._rebuild()
+
+    def _lookup(self, name: str) -> Tuple[int, int]:
+        """The slot of a name and its position, -1 if it's missing.
+
+        When missing, the slot is where it would be inserted.
+        """
+        slots = self._slots
+        mask = len(slots) - 1
+        h = hash(name)
+        perturb = h & 0xFFFFFFFFFFFFFFFF
+        i = h & mask
+        free = -1
+        while True:
+            position = slots[i]
+            if position == _EMPTY:
+                return (i if free < 0 else free), -1
+            if position == _DELETED:
+                if free < 0:
+                    free = i
+            else:
+                other = self._names[position - 1]
+                if other is name or other == name:
+                    return i, position - 1
+            perturb >>= 5
+            i = (5 * i + 1 + perturb) & mask
+
+    def _rebuild(self) -> None:
+        """Drop the holes and resize the hash table for the names."""
+        if len(self._names) == self._len:
+            names, weights = self._names, self._weights
+        else:
+            names = []
+            weights = array('d')
+            for name, weight in zip(self._names, self._weights):
+                if name is not None:
+                    names.append(name)
+                    weights.append(weight)
+        size = _MIN_SLOTS
+        while size * 2 < len(names) * 3:
+            size *= 2
+        self._names = names
+        self._weights = weights
+        self._slots = _slot_array(size * 2)
+        self._filled = len(names)
+        slots = self._slots
+        mask = len(slots) - 1
+        for position, name in enumerate(names, start=1):
+            # like _lookup, but the names are known to be distinct
+            h = hash(name)
+            perturb = h & 0xFFFFFFFFFFFFFFFF
+            i = h & mask
+            while slots[i] != _EMPTY:
+                perturb >>= 5
+                i = (5 * i + 1 + perturb) & mask
+            slots[i] = position
+
+    def __getitem__(self, name: str) -> float:
+        _, position = self._lookup(name)
+        if position < 0:
+            raise KeyError(name)
+        return self._weights[position]
+
+    def __setitem__(self, name: str, weight: float) -> None:
+        slot, position = self._lookup(name)
+        self.changes += 1
+        if position >= 0:
+            self._weights[position] = weight
+            return
+        if self._slots[slot] == _EMPTY:
+            self._filled += 1
+        self._names.append(name)
+        self._weights.append(weight)
+        self._slots[slot] = len(self._names)
+        self._len += 1
+        # at most 2/3 of the table is used, to keep the probes short
+        if self._filled * 3 >= len(self._slots) * 2:
+            self._rebuild()
+
+    def __delitem__(self, name: str) -> None:
+        slot, position = self._lookup(name)
+        if position < 0:
+            raise KeyError(name)
+        self.changes += 1
+        self._slots[slot] = _DELETED
+        self._names[position] = None
+        self._weights[position] = 0.0
+        self._len -= 1
+        if len(self._names) > 2 * self._len + _MIN_SLOTS:
+            self._rebuild()
+
+    def clear(self) -> None:
+        # the one of MutableMapping pops the names one at a time
+        self._fill([], ())
+
+    def columns(self) -> Tuple[List[Optional[str]], array]:
+        """The list of the names and the array of the weights.
+
+        They are not copied, so they change with the mapping. A deleted
+        name leaves a None, with weight 0, until the holes are removed.
+        """
+        return self._names, self._weights
+
+    def __iter__(self) -> Iterator[str]:
+        return (name for name in self._names if name is not None)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __contains__(self, name: object) -> bool:
+        return isinstance(name, str) and self._lookup(name)[1] >= 0
+
+    def items(self) -> ItemsView[str, float]:
+        return _ItemsView(self)
+
+    def values(self) -> ValuesView[float]:
+        return _ValuesView(self)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({dict(self.items())!r})'
+
+
+class _ItemsView(ItemsView[str, float]):
+    # iterating the arrays is faster than a lookup per name
+
+    def __iter__(self) -> Iterator[Tuple[str, float]]:
+        activities = self._mapping
+        for name, weight in zip(activities._names, activities._weights):
+            if name is not None:
+                yield name, weight
+
+
+class _ValuesView(ValuesView[float]):
+
+    def __iter__(self) -> Iterator[float]:
+        activities = self._mapping
+        for name, weight in zip(activities._names, activities._weights):
+            if name is not None:
+                yield weight
@@ -0,0 +1,336 @@
+from dataclasses import replace
+from datetime import datetime
+import inspect
+import json
+from pathlib import Path
+import socket
+import socketserver
+from time import monotonic
+from typing import Any, Dict, List, Optional, Tuple
+
+from choose_activity.helpers import (
+    ActivitiesState,
+    ActivityOutcome,
+    ConflictError,
+    apply_mutation,
+    check_mutation,
+    check_weight,
+    mutation_record,
+    weighted_choice,
+)
+from choose_activity.outcome_writer import OutcomeWriter
+from choose_activity.sampling import TreeSampler
+from choose_activity.storage import Storage
+
+
+class DaemonError(Exception):
+    """The daemon could not execute a request."""
+
+
+# the methods of ActivityService that can be requested
+COMMANDS = ('ping', 'pick', 'feedback', 'add', 'reweight', 'delete')
+
+
+def _check_activity(activity: Any) -> None:
+    if not isinstance(activity, str):
+        raise DaemonError(f'Invalid activity {activity!r}')
+
+
+def _check_weight(weight: Any) -> None:
+    try:
+        check_weight(weight)
+    except ValueError as ve:
+        raise DaemonError(ve.args[0])
+
+
+class ActivityService:
+    """The activities kept in memory, persisted in batches.
+
+    Changes are applied in memory right away and written to the storage
+    at most once per flush interval, so a burst of requests costs a
+    single write. If meanwhile the stored state was changed by someone
+    else, the pending changes are replayed on top of it, dropping those
+    that conflict. The outcome of a finish is logged only if the finish
+    is kept. The stored version is checked once per interval also when
+    nothing is pending, to serve the changes done by others.
+
+    Parameters
+    ----------
+    storage : Storage
+        Where the state is loaded from and persisted
+    flush_interval : float
+        Minimum number of seconds between two writes
+    """
+
+    def __init__(self, storage: Storage, flush_interval: float = 1.0):
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.state = storage.load_state()
+        self.state.activities = TreeSampler(self.state.activities)
+        # feedback of the latest outcome of each activity looked up so far
+        self.latest_outcomes: Dict[str, Optional[str]] = {}
+        # flushed by flush, not when the outcomes wait too long
+        self.outcomes = OutcomeWriter(storage, max_delay=float('inf'))
+        # the records not stored yet, with the state they were decided on
+        # and the outcome to log with them, if not logged yet
+        self.pending_mutations: List[Tuple[
+            ActivitiesState, Dict[str, Any], Optional[ActivityOutcome]]] = []
+        self.stored_version = self.state.version
+        self.last_flush = monotonic()
+
+    def ping(self) -> Dict[str, Any]:
+        """Do nothing, to check that the daemon is running."""
+        return {}
+
+    def _mutate(
+            self,
+            op: str,
+            outcome: Optional[ActivityOutcome] = None,
+            **fields: Any,
+    ) -> None:
+        # check_mutation only looks at the current activity of it
+        seen = replace(self.state, activities={})
+        record = mutation_record(op, **fields)
+        apply_mutation(self.state, record)
+        self.pending_mutations.append((seen, record, outcome))
+
+    def _merge(self) -> None:
+        """Replay the pending changes on the state stored meanwhile.
+
+        The changes conflicting with the stored ones are dropped, with
+        their outcomes.
+        """
+        state = self.storage.load_state()
+        stored_version = state.version
+        state.activities = TreeSampler(state.activities)
+        kept = []
+        for seen, record, outcome in self.pending_mutations:
+            try:
+                check_mutation(seen, state, record)
+            except ConflictError:
+                continue
+            apply_mutation(state, record)
+            kept.append((seen, record, outcome))
+        state.version = stored_version
+        self.state = state
+        self.stored_version = stored_version
+        self.pending_mutations = kept
+        # the latest outcomes may have been logged by others, or dropped
+        self.latest_outcomes = {
+            outcome.activity: outcome.feedback
+            for _, _, outcome in kept if outcome is not None}
+
+    def _latest_outcome(self, activity: str) -> Optional[str]:
+        if activity not in self.latest_outcomes:
+            self.latest_outcomes[activity] = (
+                self.storage.latest_outcome_for_activity(activity))
+        return self.latest_outcomes[activity]
+
+    def pick(self) -> Dict[str, Any]:
+        """Choose an activity and start it."""
+        if self.state.current_activity is not None:
+            raise DaemonError(
+                f'The activity {self.state.current_activity} is going on')
+        activity = weighted_choice(self.state.activities)
+        if activity is None:
+            raise DaemonError('There are no activities')
+        self._mutate(
+            'start', activity=activity, at=datetime.now().astimezone())
+        return dict(activity=activity, latest=self._latest_outcome(activity))
+
+    def feedback(
+            self,
+            is_done: bool,
+            feedback: str,
+            delete: bool = False,
+    ) -> Dict[str, Any]:
+        """Finish the current activity, storing its outcome."""
+        activity = self.state.current_activity
+        if activity is None:
+            raise DaemonError('No activity is going on')
+        if not isinstance(is_done, bool) or not isinstance(feedback, str):
+            raise DaemonError('Invalid feedback')
+        self._mutate('finish', outcome=ActivityOutcome(
+            activity=activity,
+            start_at=self.state.current_activity_start,
+            end_at=datetime.now().astimezone(),
+            is_done=is_done,
+            feedback=feedback,
+        ))
+        self.latest_outcomes[activity] = feedback
+        if delete:
+            self._mutate('delete', activity=activity)
+        return dict(activity=activity)
+
+    def add(self, activity: str, weight: float) -> Dict[str, Any]:
+        """Add an activity, or change its weight if it exists."""
+        _check_activity(activity)
+        _check_weight(weight)
+        self._mutate('add', activity=activity, weight=weight)
+        return dict(activity=activity, weight=weight)
+
+    def reweight(self, activity: str, weight: float) -> Dict[str, Any]:
+        """Change the weight of an existing activity."""
+        _check_activity(activity)
+        _check_weight(weight)
+        if activity not in self.state.activities:
+            raise DaemonError(f'Unknown activity {activity}')
+        self._mutate('reweight', activity=activity, weight=weight)
+        return dict(activity=activity, weight=weight)
+
+    def delete(self, activity: str) -> Dict[str, Any]:
+        """Delete an existing activity."""
+        _check_activity(activity)
+        if activity not in self.state.activities:
+            raise DaemonError(f'Unknown activity {activity}')
+        self._mutate('delete', activity=activity)
+        return dict(activity=activity)
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Execute a request, the answer has an `error` if it failed.
+
+        The request has a `command`, which is the name of one of the
+        methods above, and its arguments.
+        """
+        if not isinstance(request, dict):
+            return dict(error='Invalid request')
+        command = request.pop('command', None)
+        if command not in COMMANDS:
+            return dict(error=f'Unknown command {command}')
+        method = getattr(self, command)
+        try:
+            inspect.signature(method).bind(**request)
+        except TypeError as e:
+            return dict(error=f'Invalid arguments: {e}')
+        # the arguments are checked before changing anything, an error
+        # raised later is a bug and not a bad request
+        try:
+            return method(**request)
+        except DaemonError as e:
+            return dict(error=str(e))
+
+    def _log_outcomes(self) -> None:
+        """Log the outcomes of the pending changes not logged yet."""
+        for i, (seen, record, outcome) in enumerate(self.pending_mutations):
+            if outcome is not None:
+                self.outcomes.write(outcome)
+                self.pending_mutations[i] = (seen, record, None)
+        self.outcomes.flush()
+
+    def flush(self, force: bool = False) -> None:
+        """Persist the pending changes, if the interval passed.
+
+        If nothing is pending, the state is reloaded if someone else
+        changed it.
+        """
+        if not force and monotonic() - self.last_flush < self.flush_interval:
+            return
+        self.last_flush = monotonic()
+        if self.storage.stored_version() != self.stored_version:
+            self._merge()
+        if not self.pending_mutations:
+            return
+        while True:
+            # the outcomes first, so the finish of the activity is not
+            # stored without them
+            self._log_outcomes()
+            # the versions in memory were only counting the changes
+            self.state.version = self.stored_version
+            try:
+                self.storage.save_state(self.state)
+            except ConflictError:
+                # changed right now, this is rare
+                self._merge()
+            else:
+                break
+        self.stored_version = self.state.version
+        self.pending_mutations.clear()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Answer the requests of a connection, one JSON object per line."""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = dict(error='Invalid request')
+            else:
+                response = self.server.service.handle(request)
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class ActivityServer(socketserver.UnixStreamServer):
+    """Serve an `ActivityService` on a Unix socket.
+
+    Requests are served one at a time, and the pending changes are
+    persisted between them.
+    """
+
+    def __init__(self, socket_path: Path, service: ActivityService):
+        self.service = service
+        super().__init__(str(socket_path), _RequestHandler)
+
+    def service_actions(self):
+        self.service.flush()
+
+
+def serve(socket_path: Path, storage: Storage, flush_interval: float = 1.0):
+    """Run the daemon until interrupted, then persist everything.
+
+    Changes done meanwhile without going through the daemon are kept,
+    its own changes are merged with them when persisted.
+
+    Parameters
+    ----------
+    socket_path : Path
+        Path of the Unix socket to listen on, a leftover one is replaced
+    storage : Storage
+        Where the state is loaded from and persisted
+    flush_interval : float
+        Minimum number of seconds between two writes
+    """
+    if socket_path.exists():
+        try:
+            send_request(socket_path, dict(command='ping'))
+        except OSError:
+            # nobody is listening, it's left by a daemon that crashed
+            socket_path.unlink()
+        else:
+            raise DaemonError(f'A daemon is already running on {socket_path}')
+    service = ActivityService(storage, flush_interval)
+    with ActivityServer(socket_path, service) as server:
+        try:
+            server.serve_forever(poll_interval=min(flush_interval, 0.5))
+        finally:
+            service.flush(force=True)
+            socket_path.unlink()
+
+
+def send_request(socket_path: Path, request: Dict[str, Any]) -> Dict[str, Any]:
+    """Send a request to the daemon and return its answer.
+
+    Parameters
+    ----------
+    socket_path : Path
+        Path of the Unix socket of the daemon
+    request : Dict[str, Any]
+        The request, see `ActivityService.handle`
+
+    Returns
+    -------
+    Dict[str, Any]
+        The answer of the daemon, with an `error` if it failed
+
+    Raises
+    ------
+    OSError
+        If the daemon is not running
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(socket_path))
+        sock.sendall(json.dumps(request).encode() + b'\n')
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile('rb') as f:
+            return json.loads(f.readline())
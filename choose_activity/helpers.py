@@ -1,24 +1,71 @@
-from dataclasses import dataclass
+from collections import Counter
+from dataclasses import dataclass, field, replace
 from datetime import datetime
+import heapq
+import io
+from itertools import accumulate
 import json
+from math import isfinite, log
+import os
 from pathlib import Path
-from random import random
-from typing import Callable, Dict, List, Optional
+from random import Random, random
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Tuple,
+)
+import weakref
 
+from choose_activity.compact import CompactActivities
+from choose_activity.journal import (
+    append_record,
+    clear_journal,
+    journal_path,
+    last_record,
+    read_records,
+)
+from choose_activity.locking import file_lock
+from choose_activity.option_index import OptionIndex
+from choose_activity.outcome_index import latest_line, record_offsets
+from choose_activity.sampling import AliasSampler, TreeSampler
+from choose_activity.segments import maybe_rotate, read_latest
+from choose_activity.state_cache import read_cache, write_cache
+from choose_activity.state_reader import read_state_file, read_version
 
 @dataclass
 class ActivitiesState:
-    """Represent the available activities and state of the current one."""
+    """Represent the available activities and state of the current one.
 
-    activities: Dict[str, float]
+    The activities are usually a plain dictionary, a `TreeSampler` can be
+    used instead when they change often and are sampled many times, and a
+    `CompactActivities` when they are so many that memory matters.
+    """
+
+    activities: MutableMapping[str, float]
     current_activity: Optional[str] = None
     current_activity_start: Optional[datetime] = None
+    # increased at every change, to detect concurrent ones
+    version: int = 0
+    # the search index of the activities, with the version it matches
+    search_index: Optional[Tuple[int, OptionIndex]] = field(
+        default=None, init=False, repr=False, compare=False)
+    # the alias table of the activities, with the version it matches
+    sampler: Optional[Tuple[int, AliasSampler]] = field(
+        default=None, init=False, repr=False, compare=False)
 
 
 @dataclass
 class ActivityOutcome:
     """Represent the result of an activity."""
 
+    __slots__ = ('activity', 'start_at', 'end_at', 'is_done', 'feedback')
+
     activity: str
     start_at: datetime
     end_at: datetime
@@ -26,6 +73,10 @@ class ActivityOutcome:
     feedback: str
 
 
+class ConflictError(Exception):
+    """The state was changed by someone else in an incompatible way."""
+
+
 class FontColor:
     """The ANSI code colors used to change the display text in the console."""
     White = "\u001b[30m"
@@ -39,6 +90,22 @@ class FontColor:
     Reset = "\u001b[0m"
 
 
+# the journal is merged into the state snapshot when it grows bigger than
+# this and the snapshot itself, so that replaying it stays cheap
+JOURNAL_CHECKPOINT_MIN_BYTES = 64 * 1024
+
+# long lists of options are shown in pages of this size
+PAGE_SIZE = 20
+# the commands to move between the pages and filter the options
+CMD_NEXT_PAGE = '>'
+CMD_PREV_PAGE = '<'
+CMD_FILTER = '/'
+
+# the alias table of the latest weighted_choice call, with the mapping it
+# was built for and the count of its changes back then
+_latest_sampler: Optional[Tuple[weakref.ref, int, AliasSampler]] = None
+
+
 def weighted_choice(choices_and_weights: Dict[str, float]) -> str:
     """Choose a key with a probability proportional to the value.
 
@@ -46,25 +113,274 @@ def weighted_choice(choices_and_weights: Dict[str, float]) -> str:
     ----------
     choices_and_weights : Dict[str, float]
         Dictionary of choices and corresponding weights. Weights are
-        expected to be strictly greater than 0, or the behavior of
+        expected to be greater than or equal to 0, or the behavior of
         the function is undefined
 
     Returns
     -------
     str
-        One of the keys of the dictionary, None if it's empty
+        One of the keys of the dictionary, None if it's empty or all
+        the weights are 0
+
+    Notes
+    -----
+    A `TreeSampler` is sampled directly in O(log n). For
+    `CompactActivities` an alias table is built on its arrays and kept
+    until they change, so repeated calls cost O(1) each after the first
+    one. A dictionary can't tell whether it changed, it's scanned once
+    per call, use `pick_activity` to sample the activities of a state.
     """
-    if choices_and_weights is None:
+    global _latest_sampler
+    if not choices_and_weights:
         return None
+    if isinstance(choices_and_weights, TreeSampler):
+        return choices_and_weights.choice(random)
+
+    if not isinstance(choices_and_weights, CompactActivities):
+        return _scan_choice(choices_and_weights)
+    changes = choices_and_weights.changes
+    if (_latest_sampler is None
+            or _latest_sampler[0]() is not choices_and_weights
+            or _latest_sampler[1] != changes):
+        _latest_sampler = (
+            weakref.ref(choices_and_weights),
+            changes,
+            AliasSampler.from_lists(*choices_and_weights.columns()),
+        )
+    return _latest_sampler[2].choice(random)
+
+
+def pick_activity(state: ActivitiesState) -> Optional[str]:
+    """Choose one of the activities of a state, like `weighted_choice`.
 
-    chosen_weight = random() * sum(choices_and_weights.values())
+    When the activities are a dictionary, an alias table is built for
+    them and kept in the state until its version changes, so repeated
+    picks cost O(1) each after the first one.
+
+    Parameters
+    ----------
+    state : ActivitiesState
+        The state with the activities to choose from
+
+    Returns
+    -------
+    Optional[str]
+        One of the activities, None if there are none or all the weights
+        are 0
+    """
+    activities = state.activities
+    if isinstance(activities, (TreeSampler, CompactActivities)):
+        return weighted_choice(activities)
+    if state.sampler is None or state.sampler[0] != state.version:
+        state.sampler = (state.version, AliasSampler(activities))
+    return state.sampler[1].choice(random)
+
+
+def _scan_choice(choices_and_weights: Mapping[str, float]) -> Optional[str]:
+    total = sum(choices_and_weights.values())
+    if total <= 0:
+        return None
+    chosen_weight = random() * total
+    last = None
     for k, v in choices_and_weights.items():
         chosen_weight -= v
         if chosen_weight < 0:
             return k
+        if v > 0:
+            last = k
+    # what is left is a rounding error
+    return last
+
+
+def weighted_sample(
+        choices_and_weights: Dict[str, float],
+        k: int,
+        random_fun: Callable[[], float] = random,
+) -> List[str]:
+    """Choose k distinct keys with a probability proportional to the value.
+
+    It uses the Efraimidis-Spirakis algorithm: every key gets the score
+    log(u) / weight with u uniform in (0, 1], and the k highest scores are
+    kept in a heap while scanning the dictionary once, so it takes
+    O(n log k).
+
+    Parameters
+    ----------
+    choices_and_weights : Dict[str, float]
+        Dictionary of choices and corresponding weights. Keys with a
+        weight of 0 or less are never chosen
+    k : int
+        How many keys to choose, if greater than the number of keys
+        with a positive weight all of them are returned
+    random_fun : Callable[[], float]
+        Function returning a uniform float in [0, 1)
+
+    Returns
+    -------
+    List[str]
+        The chosen keys, in the order they would have been drawn one
+        after the other
+    """
+    if not choices_and_weights or k <= 0:
+        return []
+    heap = []
+    for key, weight in choices_and_weights.items():
+        if weight <= 0:
+            continue
+        score = log(1.0 - random_fun()) / weight
+        if len(heap) < k:
+            heapq.heappush(heap, (score, key))
+        elif score > heap[0][0]:
+            heapq.heapreplace(heap, (score, key))
+    return [key for _, key in sorted(heap, reverse=True)]
+
+
+def _numpy():
+    """The numpy module, None if it's not installed.
+
+    It's imported only for bulk sampling, importing it takes longer than
+    anything else done by a command.
+    """
+    try:
+        import numpy
+    except ImportError:  # numpy is optional, used only for bulk sampling
+        return None
+    return numpy
+
+
+def _draw_indexes(weights: List[float], n: int, seed: Optional[int]):
+    """Draw n indexes of the weights, as a numpy array if installed.
+
+    None is returned when all the weights are 0.
+    """
+    cum_weights = list(accumulate(weights))
+    if cum_weights[-1] <= 0:
+        return None
+    np = _numpy()
+    if np is None:
+        return Random(seed).choices(
+            range(len(weights)), cum_weights=cum_weights, k=n)
+
+    cum_array = np.asarray(cum_weights)
+    targets = np.random.default_rng(seed).random(n) * cum_array[-1]
+    indexes = np.searchsorted(cum_array, targets, side='right')
+    # guard against the rounding of the last cumulative value
+    np.minimum(indexes, len(weights) - 1, out=indexes)
+    return indexes
+
+
+def weighted_choice_many(
+        choices_and_weights: Dict[str, float],
+        n: int,
+        seed: Optional[int] = None,
+) -> List[str]:
+    """Choose n keys, with replacement, proportionally to the value.
 
+    The cumulative weights are computed once and every draw is a binary
+    search on them. When numpy is installed all the draws are done with a
+    single vectorized searchsorted, otherwise the standard library
+    bisection of `random.choices` is used.
 
-def user_selection(options: List[str], choice: str) -> str:
+    Parameters
+    ----------
+    choices_and_weights : Dict[str, float]
+        Dictionary of choices and corresponding weights. Weights are
+        expected to be greater than or equal to 0, or the behavior of
+        the function is undefined
+    n : int
+        How many draws to do
+    seed : Optional[int]
+        Seed for the random generator, to get reproducible draws
+
+    Returns
+    -------
+    List[str]
+        The n chosen keys, empty if all the weights are 0
+    """
+    if not choices_and_weights or n <= 0:
+        return []
+    keys = list(choices_and_weights)
+    indexes = _draw_indexes(list(choices_and_weights.values()), n, seed)
+    if indexes is None:
+        return []
+    if not isinstance(indexes, list):
+        indexes = indexes.tolist()
+    return [keys[i] for i in indexes]
+
+
+def weighted_choice_counts(
+        choices_and_weights: Dict[str, float],
+        n: int,
+        seed: Optional[int] = None,
+) -> Dict[str, int]:
+    """Count how many times each key is chosen in n weighted draws.
+
+    The draws are the ones of `weighted_choice_many` with the same seed,
+    but with numpy they are counted with `bincount` instead of building
+    the list of the chosen keys.
+
+    Parameters
+    ----------
+    choices_and_weights : Dict[str, float]
+        Dictionary of choices and corresponding weights. Weights are
+        expected to be greater than or equal to 0, or the behavior of
+        the function is undefined
+    n : int
+        How many draws to do
+    seed : Optional[int]
+        Seed for the random generator, to get reproducible draws
+
+    Returns
+    -------
+    Dict[str, int]
+        How many times each key was chosen, empty if all the weights are
+        0. The keys never chosen are not there
+    """
+    if not choices_and_weights or n <= 0:
+        return {}
+    keys = list(choices_and_weights)
+    indexes = _draw_indexes(list(choices_and_weights.values()), n, seed)
+    if indexes is None:
+        return {}
+    if isinstance(indexes, list):
+        counts = Counter(indexes)
+        return {keys[i]: count for i, count in sorted(counts.items())}
+    counts = _numpy().bincount(indexes, minlength=len(keys))
+    return {
+        keys[i]: count
+        for i, count in enumerate(counts.tolist()) if count > 0
+    }
+
+
+def activity_index(state: ActivitiesState) -> OptionIndex:
+    """Get the search index of the activities of a state.
+
+    The index is kept in the state and updated by `apply_mutation`, it's
+    rebuilt only when the version shows that the activities were changed
+    in some other way.
+    """
+    if state.search_index is None or state.search_index[0] != state.version:
+        state.search_index = (state.version, OptionIndex(state.activities))
+    return state.search_index[1]
+
+
+def _search(
+        options: List[str],
+        text: str,
+        index: Optional[OptionIndex],
+) -> List[str]:
+    """The options containing the text ignoring the case, in order."""
+    if index is not None:
+        return index.search(text)
+    lowered = text.lower()
+    return [option for option in options if lowered in option.lower()]
+
+
+def user_selection(
+        options: List[str],
+        choice: str,
+        index: Optional[OptionIndex] = None,
+) -> str:
     """Choose a value from the user input answer.
 
     If the choice is a number, it's used as 1-based index.
@@ -84,6 +400,8 @@ def user_selection(options: List[str], choice: str) -> str:
         List of options
     choice : str
         The user input, can be an 1-based index or a string to match
+    index : Optional[OptionIndex]
+        The search index of the options, if not given they are scanned
 
     Returns
     -------
@@ -101,10 +419,7 @@ def user_selection(options: List[str], choice: str) -> str:
         return options[choice_index - 1]
 
     except ValueError:
-        chosen = []
-        for option in options:
-            if choice.lower() in option.lower():
-                chosen.append(option)
+        chosen = _search(options, choice, index)
         if len(chosen) == 1:
             return chosen[0]
         if len(chosen) > 1:
@@ -113,7 +428,11 @@ def user_selection(options: List[str], choice: str) -> str:
     raise IndexError('invalid choice')
 
 
-def enumerate_options(options: List[str]) -> str:
+def enumerate_options(
+        options: List[str],
+        start: int = 0,
+        stop: Optional[int] = None,
+) -> str:
     """Represent the options nicely.
 
     The returned value places the options in such a way that it's easy
@@ -123,25 +442,57 @@ def enumerate_options(options: List[str]) -> str:
     ----------
     options : List[str]
         List of options to enumerate
+    start : int
+        Position of the first option to show, to show only a page
+    stop : Optional[int]
+        Position after the last option to show, to show only a page
 
     Returns
     -------
     str
         A string representing the options to be printed
     """
-    return '\n'.join([
-        f'{i + 1}) {option}' for i, option in enumerate(options)
-    ])
+    return '\n'.join(
+        f'{i + 1}) {option}'
+        for i, option in enumerate(options[start:stop], start=start)
+    )
+
+
+def _print_page(
+        options: List[str],
+        shown: List[str],
+        page: int,
+        page_size: int,
+) -> None:
+    """Print a page of the options, or of the filtered ones."""
+    start = page * page_size
+    if shown is options:
+        print(enumerate_options(options, start, start + page_size))
+    elif shown:
+        # the filtered options are chosen by name, not by number
+        for option in shown[start:start + page_size]:
+            print(f' -  {option}')
+    else:
+        print('No option matches the filter')
+    pages = max(1, -(-len(shown) // page_size))
+    print(f'\nPage {page + 1} of {pages}: {CMD_NEXT_PAGE} next page, '
+          f'{CMD_PREV_PAGE} previous page, {CMD_FILTER}text to filter')
 
 
 def get_answer(
         options: List[str],
         input_fun: Callable[..., str],
+        index: Optional[OptionIndex] = None,
+        page_size: int = PAGE_SIZE,
 ) -> str:
     """Ask for an answer until it gets one.
 
     The input function will be invoked until the user provides an answer
-    within the options.
+    within the options. When nothing matches, the most similar options
+    are suggested.
+
+    When there are more options than the page size they are shown one page
+    at a time, and the user can move between pages or filter them.
 
     Parameters
     ----------
@@ -150,59 +501,187 @@ def get_answer(
     input_fun : Callable[..., str]
         Function to be invoked, possibly multiple times,
         to get the input from the user
+    index : Optional[OptionIndex]
+        The search index of the options, if not given they are scanned,
+        and indexed only to suggest similar ones after a wrong choice
+    page_size : int
+        How many options to show at once
 
     Returns
     -------
     str
         The valid choice from the user
     """
-    print(enumerate_options(options))
+    paginated = len(options) > page_size
+    shown = options
+    page = 0
+    if paginated:
+        _print_page(options, shown, page, page_size)
+    else:
+        print(enumerate_options(options))
     print('\nChoose an option using the number or a word:')
     while True:
         choice = input_fun()
+        command = choice.strip()
+        if paginated and command in (CMD_NEXT_PAGE, CMD_PREV_PAGE):
+            last_page = max(0, (len(shown) - 1) // page_size)
+            if command == CMD_NEXT_PAGE:
+                page = min(page + 1, last_page)
+            else:
+                page = max(page - 1, 0)
+            _print_page(options, shown, page, page_size)
+            continue
+        if paginated and command.startswith(CMD_FILTER):
+            text = command[len(CMD_FILTER):].strip()
+            shown = _search(options, text, index) if text else options
+            page = 0
+            _print_page(options, shown, page, page_size)
+            continue
         try:
-            return user_selection(options, choice)
+            return user_selection(options, choice, index)
         except IndexError as ie:
             print(ie.args[0])
             if len(ie.args) == 2:
                 print('Matches:')
-                for opt in ie.args[1]:
+                for opt in ie.args[1][:page_size]:
                     print(f' -  {opt}')
+                if len(ie.args[1]) > page_size:
+                    print(f' ... and {len(ie.args[1]) - page_size} more')
                 print('Please be more specific')
+            elif command:
+                if index is None:
+                    # only for the suggestions, when the choice is wrong
+                    index = OptionIndex(options)
+                suggestions = index.fuzzy(choice)
+                if suggestions:
+                    print('Did you mean:')
+                    for opt in suggestions:
+                        print(f' -  {opt}')
+
+
+def _read_state(fname: Path, compact: bool = False) -> ActivitiesState:
+    """Read the snapshot and replay the journal, without locking."""
+    if not fname.exists():
+        state = ActivitiesState(CompactActivities() if compact else {})
+    else:
+        with open(fname, 'rb') as f:
+            cached = read_cache(fname, f, compact)
+            if cached is not None:
+                activities, raw_obj = cached
+            else:
+                activities = CompactActivities() if compact else {}
+                f.seek(0)
+                text = io.TextIOWrapper(f)
+                # parsed a chunk at a time, the text is never all in memory
+                raw_obj = read_state_file(text, activities)
+                # or closing the wrapper would close the file
+                text.detach()
+                write_cache(fname, f, activities, raw_obj)
+        if raw_obj['current_activity_start'] is not None:
+            raw_obj['current_activity_start'] = datetime.fromisoformat(
+                raw_obj['current_activity_start'])
+        state = ActivitiesState(
+            activities,
+            current_activity=raw_obj['current_activity'],
+            current_activity_start=raw_obj['current_activity_start'],
+            version=raw_obj.get('version', 0),
+        )
+    for record in read_records(fname):
+        # records older than the snapshot are already part of it
+        if record.get('version', state.version + 1) > state.version:
+            apply_mutation(state, record)
+    return state
 
 
-def load_state(fname: Path) -> ActivitiesState:
+def _write_state(fname: Path, state: ActivitiesState) -> None:
+    """Replace the snapshot atomically and drop the journal."""
+    write_date = None
+    if state.current_activity_start is not None:
+        write_date = state.current_activity_start.isoformat()
+    raw_obj = dict(
+        # first, so that reading it does not need the rest of the file
+        version=state.version,
+        activities=dict(state.activities),
+        current_activity=state.current_activity,
+        current_activity_start=write_date,
+    )
+    tmp_fname = Path(f'{fname}.tmp')
+    with open(tmp_fname, 'w') as f:
+        f.write(json.dumps(raw_obj, indent=2))
+    os.replace(tmp_fname, fname)
+    clear_journal(fname)
+
+
+def _stored_version(fname: Path) -> int:
+    """The version of the stored state, without parsing all of it.
+
+    It's the one of the last record of the journal, or the one at the
+    start of the snapshot, only older snapshots need to be parsed.
+    """
+    record = last_record(fname)
+    if record is not None and 'version' in record:
+        return record['version']
+    try:
+        with open(fname) as f:
+            version = read_version(f)
+    except FileNotFoundError:
+        return 0
+    if version is not None:
+        return version
+    return _read_state(fname).version
+
+
+def stored_version(fname: Path) -> int:
+    """The version of the state stored in a file, 0 if there is none.
+
+    Only the end of the journal, or the start of the state file, is read,
+    so it's a cheap way to tell whether the state changed.
+    """
+    if not fname.exists() and not journal_path(fname).exists():
+        return 0
+    with file_lock(fname, exclusive=False):
+        return _stored_version(fname)
+
+
+def load_state(fname: Path, compact: bool = False) -> ActivitiesState:
     """Load the state from the activities file.
 
-    If the file does not exist, an empty state is generated.
+    If the file does not exist, an empty state is generated. The
+    mutations in the journal, if any, are applied to the loaded state.
+    The parsed file is cached, and the cache used while the file is the
+    same.
 
     Parameters
     ----------
     fname : Path
         file path from where to load
+    compact : bool
+        Whether to load the activities in a `CompactActivities`, that
+        takes less memory than a dictionary
 
     Returns
     -------
     ActivitiesState
         The loaded activities or an initialised one
     """
-    if not fname.exists():
-        return ActivitiesState({})
-
-    raw_obj = json.loads(open(fname).read())
-    if raw_obj['current_activity_start'] is not None:
-        raw_obj['current_activity_start'] = datetime.fromisoformat(
-            raw_obj['current_activity_start'])
-    return ActivitiesState(
-        raw_obj['activities'],
-        current_activity=raw_obj['current_activity'],
-        current_activity_start=raw_obj['current_activity_start'],
-    )
+    if not fname.exists() and not journal_path(fname).exists():
+        # nothing to protect, and the lock would create its file
+        return ActivitiesState(CompactActivities() if compact else {})
+    with file_lock(fname, exclusive=False):
+        return _read_state(fname, compact)
 
 
 def save_state(fname: Path, state: ActivitiesState) -> None:
     """Save the state in a file.
 
+    The whole state is written, replacing whatever was stored, so the
+    journal is not needed anymore and gets removed. The file is replaced
+    atomically and the version of the state is increased.
+
+    The state must be the stored one with some changes: if meanwhile
+    someone else changed the stored one, which is detected by the
+    version, nothing is written.
+
     Parameters
     ----------
     fname : Path
@@ -213,17 +692,202 @@ def save_state(fname: Path, state: ActivitiesState) -> None:
     Returns
     -------
     None
+
+    Raises
+    ------
+    ConflictError
+        If the stored state has another version than the given one
     """
-    write_date = None
-    if state.current_activity_start is not None:
-        write_date = state.current_activity_start.isoformat()
-    raw_obj = dict(
-        activities=state.activities,
-        current_activity=state.current_activity,
-        current_activity_start=write_date,
-    )
-    with open(fname, 'w') as f:
-        f.write(json.dumps(raw_obj, indent=2))
+    with file_lock(fname):
+        if _stored_version(fname) != state.version:
+            raise ConflictError('The state was changed meanwhile')
+        state.version += 1
+        _write_state(fname, state)
+
+
+def apply_mutation(state: ActivitiesState, record: Dict[str, Any]) -> None:
+    """Apply a mutation record to the state.
+
+    The records are:
+
+    * `add` and `reweight`, with `activity` and `weight`
+    * `delete`, with `activity`
+    * `start`, with `activity` and `at` as ISO 8601 string
+    * `finish`, without other fields
+
+    Every record can have a `version`, which becomes the version of the
+    state, otherwise the version is increased by one.
+
+    Parameters
+    ----------
+    state : ActivitiesState
+        The state to change
+    record : Dict[str, Any]
+        The mutation record
+    """
+    op = record['op']
+    index = None
+    if state.search_index is not None and (
+            state.search_index[0] == state.version):
+        index = state.search_index[1]
+    if op in ('add', 'reweight'):
+        state.activities[record['activity']] = record['weight']
+        if index is not None:
+            index.add(record['activity'])
+    elif op == 'delete':
+        state.activities.pop(record['activity'], None)
+        if index is not None and record['activity'] in index:
+            index.remove(record['activity'])
+    elif op == 'start':
+        state.current_activity = record['activity']
+        state.current_activity_start = datetime.fromisoformat(record['at'])
+    elif op == 'finish':
+        state.current_activity = None
+        state.current_activity_start = None
+    else:
+        raise ValueError(f'Unknown mutation {op}')
+    state.version = record.get('version', state.version + 1)
+    if index is not None:
+        state.search_index = (state.version, index)
+
+
+def check_mutation(
+        seen: ActivitiesState,
+        current: ActivitiesState,
+        record: Dict[str, Any],
+) -> None:
+    """Check that a mutation still makes sense after a concurrent change.
+
+    Parameters
+    ----------
+    seen : ActivitiesState
+        The state on which the mutation was decided
+    current : ActivitiesState
+        The state as changed meanwhile by someone else
+    record : Dict[str, Any]
+        The mutation record
+
+    Raises
+    ------
+    ConflictError
+        If the mutation conflicts with the changes
+    """
+    op = record['op']
+    if op == 'reweight' and record['activity'] not in current.activities:
+        raise ConflictError(
+            f'The activity {record["activity"]} was deleted meanwhile')
+    if op == 'start' and current.current_activity is not None:
+        raise ConflictError(
+            f'The activity {current.current_activity} was started meanwhile')
+    if op == 'finish' and (
+            current.current_activity != seen.current_activity
+            or current.current_activity_start != seen.current_activity_start
+    ):
+        raise ConflictError('The activity was already finished meanwhile')
+
+
+def mutation_record(op: str, **fields: Any) -> Dict[str, Any]:
+    """Build the record of a mutation, with dates as ISO 8601 strings."""
+    record = dict(op=op, **fields)
+    if isinstance(record.get('at'), datetime):
+        record['at'] = record['at'].isoformat()
+    return record
+
+
+def refresh_state(state: ActivitiesState, current: ActivitiesState) -> None:
+    """Replace in place the content of a state with a newer one."""
+    state.activities.clear()
+    state.activities.update(current.activities)
+    state.current_activity = current.current_activity
+    state.current_activity_start = current.current_activity_start
+    state.version = current.version
+
+
+def record_mutation(
+        fname: Path,
+        state: ActivitiesState,
+        op: str,
+        **fields: Any,
+) -> None:
+    """Apply a mutation to the state and persist it.
+
+    The mutation is appended to the journal of the state file instead of
+    rewriting the whole state, which is done only once in a while to
+    keep the journal short. For example a new activity is added with
+    `record_mutation(path, state, 'add', activity='read', weight=1.0)`.
+
+    The state file is locked only while writing. If meanwhile someone
+    else changed it, which is detected by the version, the state is
+    reloaded and the mutation applied on top of the new one, unless the
+    two conflict.
+
+    Parameters
+    ----------
+    fname : Path
+        File path of the state
+    state : ActivitiesState
+        The state to change, as loaded from the path
+    op : str
+        The mutation, see `apply_mutation` for the possible ones
+    fields : Any
+        The fields of the mutation
+
+    Raises
+    ------
+    ConflictError
+        If the state was changed meanwhile in a way that conflicts with
+        the mutation, in which case the state is the reloaded one
+    """
+    record = mutation_record(op, **fields)
+    with file_lock(fname):
+        if _stored_version(fname) != state.version:
+            seen = replace(state, activities=dict(state.activities))
+            refresh_state(state, _read_state(fname))
+            check_mutation(seen, state, record)
+        record['version'] = state.version + 1
+        apply_mutation(state, record)
+        journal_size = append_record(fname, record)
+        if journal_size < JOURNAL_CHECKPOINT_MIN_BYTES:
+            return
+        try:
+            snapshot_size = fname.stat().st_size
+        except FileNotFoundError:
+            snapshot_size = 0
+        if journal_size > snapshot_size:
+            _write_state(fname, state)
+
+
+def check_weight(weight: Any) -> float:
+    """Refuse a weight before it reaches a sampler, or it breaks it.
+
+    A weight is a finite number, 0 or more. Booleans are refused even if
+    they are numbers for Python.
+
+    Raises
+    ------
+    ValueError
+        If the weight is not valid
+    """
+    if (isinstance(weight, bool) or not isinstance(weight, (int, float))
+            or not isfinite(weight) or weight < 0):
+        raise ValueError(f'Invalid weight {weight!r}')
+    return float(weight)
+
+
+def parse_weight(text: str) -> float:
+    """Parse a weight written as a number, see `check_weight`.
+
+    It's meant as the `type` of a command line argument too.
+
+    Raises
+    ------
+    ValueError
+        If the text is not a valid weight
+    """
+    try:
+        return check_weight(float(text))
+    except (ValueError, TypeError):
+        raise ValueError(f'Invalid weight {text!r}') from None
 
 
 def get_weight(prompt: str, input_fun: Callable[..., str]) -> float:
@@ -246,15 +910,28 @@ def get_weight(prompt: str, input_fun: Callable[..., str]) -> float:
     while True:
         candidate = input_fun()
         try:
-            return float(candidate)
+            return parse_weight(candidate)
         except ValueError:
-            print(f'Invalid value "{candidate}", use a number with dot as'
-                  ' decimal separator')
+            print(f'Invalid value "{candidate}", use a number of 0 or more'
+                  ' with dot as decimal separator')
+
+
+def outcome_line(outcome: ActivityOutcome) -> bytes:
+    """The line of the log storing an outcome."""
+    return (json.dumps(dict(
+        activity=outcome.activity,
+        start_at=outcome.start_at.isoformat(),
+        end_at=outcome.end_at.isoformat(),
+        is_done=outcome.is_done,
+        feedback=outcome.feedback
+    )) + '\n').encode()
 
 
 def log_activity_result(fname: Path, outcome: ActivityOutcome):
     """Log the result of an activity.
 
+    The index of the latest outcome of each activity is updated too.
+
     Parameters
     ----------
     fname : Path
@@ -262,20 +939,83 @@ def log_activity_result(fname: Path, outcome: ActivityOutcome):
     outcome : ActivityOutcome
         The activity outcome to store
     """
-    with open(fname, 'a') as f:
-        f.write(json.dumps(dict(
-            activity=outcome.activity,
-            start_at=outcome.start_at.isoformat(),
-            end_at=outcome.end_at.isoformat(),
-            is_done=outcome.is_done,
-            feedback=outcome.feedback
-        )))
-        f.write('\n')
+    log_activity_results(fname, [outcome])
+
+
+def log_activity_results(
+        fname: Path,
+        outcomes: Iterable[ActivityOutcome],
+        fsync: bool = False,
+) -> None:
+    """Log the results of many activities with a single write.
+
+    The index of the latest outcome of each activity is updated once.
+
+    Parameters
+    ----------
+    fname : Path
+        File path where to write
+    outcomes : Iterable[ActivityOutcome]
+        The activity outcomes to store, in order
+    fsync : bool
+        Whether to wait for the lines to reach the disk
+    """
+    lines = [(outcome.activity, outcome_line(outcome)) for outcome in outcomes]
+    if not lines:
+        return
+    # the lock keeps the log from being rotated meanwhile
+    with file_lock(fname):
+        append_lines(fname, lines, fsync)
+
+
+def append_lines(
+        fname: Path,
+        lines: List[Tuple[str, bytes]],
+        fsync: bool = False,
+) -> None:
+    """Append lines made by `outcome_line` to the log, with a single write.
+
+    The index is updated and the log rotated if needed, like
+    `log_activity_results` does. The caller must hold the lock of the log.
+
+    Parameters
+    ----------
+    fname : Path
+        File path where to write
+    lines : List[Tuple[str, bytes]]
+        The activity and the line of each outcome, in order
+    fsync : bool
+        Whether to wait for the lines to reach the disk
+    """
+    # the offsets are relative to the start of the write
+    offsets = {}
+    size = 0
+    for activity, line in lines:
+        offsets[activity] = size
+        size += len(line)
+    with open(fname, 'ab') as f:
+        start = f.tell()
+        f.write(b''.join(line for _, line in lines))
+        log_size = f.tell()
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    record_offsets(
+        fname,
+        {activity: start + offset for activity, offset in offsets.items()},
+        start,
+        log_size,
+    )
+    maybe_rotate(fname)
 
 
 def latest_outcome_for_activity(fname: Path, activity: str) -> Optional[str]:
     """Retrieve the latest result of an activity.
 
+    The line is found with the log index, or scanning the log backwards
+    when the index is missing or does not match the log. If the activity
+    is not in the log, the summary of the rotated segments is used.
+
     Parameters
     ----------
     fname : Path
@@ -287,16 +1027,12 @@ def latest_outcome_for_activity(fname: Path, activity: str) -> Optional[str]:
     -------
     The activity latest outcome, None if not found
     """
-    latest_outcome = None
-    try:
-        with open(fname, 'r') as f:
-            for line in f:
-                logm = json.loads(line)
-                if logm['activity'] == activity:
-                    latest_outcome = logm['feedback']
-        return latest_outcome
-    except FileNotFoundError:
-        return None
+    with file_lock(fname, exclusive=False):
+        # the lock keeps it from being rotated away meanwhile
+        logm = latest_line(fname, activity) if fname.exists() else None
+        if logm is not None:
+            return logm['feedback']
+        return read_latest(fname).get(activity)
 
 
 def get_bool(prompt: str, input_fun: Callable[..., str]) -> bool:
@@ -0,0 +1,90 @@
+import json
+import mmap
+import os
+from pathlib import Path
+from typing import Iterator, Optional
+
+
+def journal_path(state_fname: Path) -> Path:
+    """The path of the mutation journal for a given state file."""
+    return Path(f'{state_fname}.journal')
+
+
+def append_record(state_fname: Path, record: dict) -> int:
+    """Append a mutation record to the journal of a state file.
+
+    An incomplete record at the end, left by a crash, is removed first so
+    that it does not hide the new one. The caller must hold the lock of
+    the state file.
+
+    Parameters
+    ----------
+    state_fname : Path
+        The state file path
+    record : dict
+        The mutation to store, must be serializable as JSON
+
+    Returns
+    -------
+    int
+        The size of the journal after the append
+    """
+    with open(journal_path(state_fname), 'a+b') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size > 0:
+            f.seek(size - 1)
+            if f.read(1) != b'\n':
+                f.seek(0)
+                f.truncate(f.read().rfind(b'\n') + 1)
+        f.write(json.dumps(record).encode() + b'\n')
+        return f.tell()
+
+
+def last_record(state_fname: Path) -> Optional[dict]:
+    """The latest complete mutation record of the journal, if any."""
+    try:
+        f = open(journal_path(state_fname), 'rb')
+    except FileNotFoundError:
+        return None
+    with f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # anything after the last newline is an incomplete record
+            end = mm.rfind(b'\n')
+            if end < 0:
+                return None
+            start = mm.rfind(b'\n', 0, end) + 1
+            try:
+                return json.loads(mm[start:end])
+            except ValueError:
+                return None
+
+
+def read_records(state_fname: Path) -> Iterator[dict]:
+    """Iterate over the mutation records of the journal of a state file.
+
+    Reading stops at the first incomplete or invalid record, which can
+    only be the result of a write interrupted by a crash.
+    """
+    try:
+        f = open(journal_path(state_fname), 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                return
+            try:
+                record = json.loads(line)
+            except ValueError:
+                return
+            yield record
+
+
+def clear_journal(state_fname: Path) -> None:
+    """Remove the journal, after its content was saved in the snapshot."""
+    try:
+        os.remove(journal_path(state_fname))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,61 @@
+from contextlib import contextmanager
+import os
+from pathlib import Path
+import tempfile
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, where there's no locking
+    fcntl = None
+
+
+def lock_path(fname: Path) -> Path:
+    """The path of the lock file protecting a given file."""
+    return Path(f'{fname}.lock')
+
+
+@contextmanager
+def file_lock(fname: Path, exclusive: bool = True) -> Iterator[None]:
+    """Hold an advisory lock on a file for the duration of the block.
+
+    The lock is taken on a separate lock file, so the file itself can be
+    replaced while the lock is held. Locks are per open file, so the same
+    process must not take it again inside the block or it will wait
+    forever.
+
+    Parameters
+    ----------
+    fname : Path
+        The file to protect
+    exclusive : bool
+        Whether to take an exclusive lock, for writers, or a shared one,
+        for readers
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(lock_path(fname), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def write_atomically(target: Path, data: bytes) -> None:
+    """Replace a file with new content, readers see the old or the new one.
+
+    The content is written to a temporary file with a unique name and
+    renamed over the target, so many processes can write the same file
+    holding a shared lock.
+    """
+    fd, tmp_name = tempfile.mkstemp(
+        dir=target.parent, prefix=f'{target.name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_name, target)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
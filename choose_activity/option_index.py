@@ -0,0 +1,141 @@
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+# queries shorter than this have no trigram, all options are checked
+GRAM_SIZE = 3
+
+
+def _grams(text: str) -> Set[str]:
+    return {
+        text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)
+    }
+
+
+class OptionIndex:
+    """Trigram index of a list of options, for case insensitive search.
+
+    Finding the options containing a text only checks the ones sharing
+    all its trigrams, instead of all of them. Options can be added and
+    removed without rebuilding the index.
+
+    >>> index = OptionIndex(['apple', 'banana', 'orange'])
+    >>> index.search('AN')
+    ['banana', 'orange']
+    >>> index.fuzzy('banan')
+    ['banana']
+
+    Parameters
+    ----------
+    options : Iterable[str]
+        The options to index, duplicates are ignored
+    """
+
+    def __init__(self, options: Iterable[str] = ()):
+        self._options: List[Optional[str]] = []
+        self._lowered: List[Optional[str]] = []
+        self._ids: Dict[str, int] = {}
+        self._postings: Dict[str, Set[int]] = defaultdict(set)
+        for option in options:
+            self.add(option)
+
+    def add(self, option: str) -> None:
+        """Add an option, after the existing ones."""
+        if option in self._ids:
+            return
+        option_id = len(self._options)
+        self._ids[option] = option_id
+        self._options.append(option)
+        lowered = option.lower()
+        self._lowered.append(lowered)
+        for gram in _grams(lowered):
+            self._postings[gram].add(option_id)
+
+    def remove(self, option: str) -> None:
+        """Remove an option, raise KeyError if it's not indexed."""
+        option_id = self._ids.pop(option)
+        for gram in _grams(self._lowered[option_id]):
+            posting = self._postings[gram]
+            posting.discard(option_id)
+            if not posting:
+                del self._postings[gram]
+        self._options[option_id] = None
+        self._lowered[option_id] = None
+
+    def __contains__(self, option: object) -> bool:
+        return option in self._ids
+
+    def __iter__(self) -> Iterator[str]:
+        return (o for o in self._options if o is not None)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _candidates(self, grams: Set[str]) -> Optional[Set[int]]:
+        """Ids having all the grams, None if there's no gram to filter."""
+        if not grams:
+            return None
+        postings = sorted(
+            (self._postings.get(gram, set()) for gram in grams), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates &= posting
+        return candidates
+
+    def search(self, text: str) -> List[str]:
+        """The options containing the text, ignoring the case.
+
+        Parameters
+        ----------
+        text : str
+            The text to look for
+
+        Returns
+        -------
+        List[str]
+            The matching options, in the order they were added
+        """
+        lowered = text.lower()
+        candidates = self._candidates(_grams(lowered))
+        if candidates is None:
+            candidate_ids = range(len(self._options))
+        else:
+            candidate_ids = sorted(candidates)
+        return [
+            self._options[i] for i in candidate_ids
+            if self._lowered[i] is not None and lowered in self._lowered[i]
+        ]
+
+    def fuzzy(self, text: str, limit: int = 5) -> List[str]:
+        """The options most similar to the text, even if not containing it.
+
+        The similarity is the share of trigrams in common, so typos and
+        swapped words still find the option.
+
+        Parameters
+        ----------
+        text : str
+            The text to look for
+        limit : int
+            The maximum number of options to return
+
+        Returns
+        -------
+        List[str]
+            The options sharing at least a trigram with the text, the most
+            similar first
+        """
+        grams = _grams(text.lower())
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+
+        def score(option_id):
+            option_grams = len(_grams(self._lowered[option_id]))
+            # Jaccard similarity of the two sets of trigrams
+            common = shared[option_id]
+            return common / (len(grams) + option_grams - common)
+
+        best = sorted(shared, key=lambda i: (-score(i), i))[:limit]
+        return [self._options[i] for i in best]
@@ -0,0 +1,340 @@
+"""Sidecar index of the outcome log.
+
+The index maps every activity to the byte offset of its latest line in
+the log, together with the size of the log it covers. It's a SQLite
+database keyed by activity, so a lookup reads a single row and an append
+only writes the rows of the appended activities, whatever the number of
+activities. When it's stale (the log grew behind its back) only the new
+lines are indexed. A corrupt index, or one covering more than the log
+contains, is rebuilt from scratch at the next append; until then lookups
+scan the log backwards from the end, where the latest outcomes are.
+"""
+from contextlib import closing, contextmanager
+from dataclasses import dataclass, field
+import json
+import mmap
+import os
+from pathlib import Path
+import sqlite3
+from typing import Dict, Iterator, Optional
+
+# how long to wait for another process writing the index, in seconds
+BUSY_TIMEOUT = 10.0
+
+
+@dataclass
+class OutcomeIndex:
+    """Offset of the latest line of each activity in the outcome log."""
+
+    log_size: int = 0
+    offsets: Dict[str, int] = field(default_factory=dict)
+
+
+def index_path(log_fname: Path) -> Path:
+    """The path of the index for a given log file."""
+    return Path(f'{log_fname}.index')
+
+
+def remove_index(log_fname: Path) -> None:
+    """Remove the index of a log, with the journal of a crashed write."""
+    # a leftover journal would be rolled back into the next index
+    for suffix in ('', '-journal'):
+        try:
+            Path(f'{index_path(log_fname)}{suffix}').unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _connect(log_fname: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        str(index_path(log_fname)),
+        timeout=BUSY_TIMEOUT,
+        isolation_level=None,
+    )
+    # it can be rebuilt from the log, no need to wait for the disk
+    conn.execute('PRAGMA synchronous=OFF')
+    return conn
+
+
+def _open_index(log_fname: Path) -> Optional[sqlite3.Connection]:
+    """Open the index of a log, None if it's missing or corrupt."""
+    if not index_path(log_fname).exists():
+        return None
+    conn = None
+    try:
+        conn = _connect(log_fname)
+        _covered(conn)
+    except (sqlite3.DatabaseError, TypeError):
+        if conn is not None:
+            conn.close()
+        return None
+    return conn
+
+
+def _create_index(log_fname: Path) -> sqlite3.Connection:
+    """Open the index of a log, replacing it if it's missing or corrupt."""
+    conn = _open_index(log_fname)
+    if conn is not None:
+        return conn
+    remove_index(log_fname)
+    conn = _connect(log_fname)
+    conn.executescript('''
+        BEGIN IMMEDIATE;
+        CREATE TABLE IF NOT EXISTS coverage (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            log_size INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO coverage VALUES (0, 0);
+        CREATE TABLE IF NOT EXISTS offsets (
+            activity TEXT PRIMARY KEY,
+            offset INTEGER NOT NULL
+        ) WITHOUT ROWID;
+        COMMIT;
+    ''')
+    return conn
+
+
+def _covered(conn: sqlite3.Connection) -> int:
+    """The size of the log covered by the index."""
+    (log_size,) = conn.execute('SELECT log_size FROM coverage').fetchone()
+    if not isinstance(log_size, int):
+        raise TypeError('invalid log size')
+    return log_size
+
+
+@contextmanager
+def _transaction(conn: sqlite3.Connection) -> Iterator[None]:
+    """A write transaction, holding the database lock from the start."""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def read_index(log_fname: Path) -> Optional[OutcomeIndex]:
+    """Read the whole index of a log, None if it's missing or corrupt.
+
+    This reads every row, to inspect the index. Lookups use `latest_line`
+    which reads only the row of the activity.
+    """
+    conn = _open_index(log_fname)
+    if conn is None:
+        return None
+    with closing(conn):
+        return OutcomeIndex(
+            log_size=_covered(conn),
+            offsets=dict(conn.execute('SELECT activity, offset FROM offsets')),
+        )
+
+
+def index_lines(conn: sqlite3.Connection, log_fname: Path) -> None:
+    """Add to the index the lines appended after the ones it covers.
+
+    A truncated last line, being written right now, is not indexed. The
+    caller must hold a write transaction.
+    """
+    offsets = {}
+    with open(log_fname, 'rb') as f:
+        offset = _covered(conn)
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                activity = json.loads(line)['activity']
+            except (ValueError, KeyError, TypeError):
+                activity = None
+            if isinstance(activity, str):
+                offsets[activity] = offset
+            offset += len(line)
+    conn.executemany(
+        'INSERT OR REPLACE INTO offsets VALUES (?, ?)', offsets.items())
+    conn.execute('UPDATE coverage SET log_size = ?', (offset,))
+
+
+def record_offset(
+        log_fname: Path,
+        activity: str,
+        offset: int,
+        log_size: int,
+) -> None:
+    """Update the index after a line was appended to the log.
+
+    Parameters
+    ----------
+    log_fname : Path
+        The log file path
+    activity : str
+        The activity of the appended line
+    offset : int
+        Where the appended line starts
+    log_size : int
+        The size of the log after the append
+    """
+    record_offsets(log_fname, {activity: offset}, offset, log_size)
+
+
+def record_offsets(
+        log_fname: Path,
+        offsets: Dict[str, int],
+        start: int,
+        log_size: int,
+) -> None:
+    """Update the index after many lines were appended to the log.
+
+    Only the rows of the appended activities are written.
+
+    Parameters
+    ----------
+    log_fname : Path
+        The log file path
+    offsets : Dict[str, int]
+        Where the latest appended line of each activity starts
+    start : int
+        Where the first appended line starts
+    log_size : int
+        The size of the log after the append
+    """
+    with closing(_create_index(log_fname)) as conn, _transaction(conn):
+        covered = _covered(conn)
+        if covered > start:
+            # it's the index of another log, start again
+            conn.execute('DELETE FROM offsets')
+            conn.execute('UPDATE coverage SET log_size = 0')
+            covered = 0
+        if covered == start:
+            conn.executemany(
+                'INSERT OR REPLACE INTO offsets VALUES (?, ?)',
+                offsets.items())
+            conn.execute('UPDATE coverage SET log_size = ?', (log_size,))
+        else:
+            # the index is behind, the new lines are indexed with the others
+            index_lines(conn, log_fname)
+
+
+def read_line_at(log_fname: Path, offset: int) -> Optional[dict]:
+    """Parse the log line starting at the given offset, None if invalid."""
+    with open(log_fname, 'rb') as f:
+        f.seek(offset)
+        line = f.readline()
+    try:
+        logm = json.loads(line)
+    except ValueError:
+        return None
+    return logm if isinstance(logm, dict) else None
+
+
+def reverse_lines(buffer) -> Iterator[bytes]:
+    """Iterate over the lines of a buffer from the last to the first.
+
+    The lines are returned without the newline. No copy of the buffer is
+    done besides the lines themselves, so it works well over an mmap.
+    """
+    end = len(buffer)
+    if end > 0 and buffer[end - 1:end] == b'\n':
+        end -= 1
+    while end > 0:
+        start = buffer.rfind(b'\n', 0, end) + 1
+        yield buffer[start:end]
+        end = start - 1
+
+
+def scan_latest_line(log_fname: Path, activity: str) -> Optional[dict]:
+    """Find the latest log line of an activity reading the log backwards.
+
+    The log is memory mapped and only the lines containing the activity
+    name are parsed, so the cost depends on how far from the end the
+    line is and not on the size of the log.
+
+    Parameters
+    ----------
+    log_fname : Path
+        The log file path, the file must exist
+    activity : str
+        The name of the activity
+
+    Returns
+    -------
+    Optional[dict]
+        The parsed line, None if the activity is not in the log
+    """
+    # the log is written by json.dumps, so the name appears encoded this way
+    needle = json.dumps(activity).encode()
+    with open(log_fname, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in reverse_lines(mm):
+                if needle not in line:
+                    continue
+                try:
+                    logm = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(logm, dict) and logm.get('activity') == activity:
+                    return logm
+    return None
+
+
+def _indexed_offset(
+        log_fname: Path,
+        log_size: int,
+        activity: str,
+) -> Optional[int]:
+    """The indexed offset of the activity, None if it's not in the log.
+
+    The index is brought up to date first if the log grew. If it's
+    missing or does not match the log `sqlite3.DatabaseError` is raised.
+    """
+    conn = _open_index(log_fname)
+    if conn is None:
+        raise sqlite3.DatabaseError('missing or corrupt index')
+    with closing(conn):
+        covered = _covered(conn)
+        if covered > log_size:
+            raise sqlite3.DatabaseError('index of another log')
+        if covered < log_size:
+            with _transaction(conn):
+                # someone else may have done it meanwhile
+                if _covered(conn) < log_size:
+                    index_lines(conn, log_fname)
+        row = conn.execute(
+            'SELECT offset FROM offsets WHERE activity = ?',
+            (activity,)).fetchone()
+    return None if row is None else row[0]
+
+
+def latest_line(log_fname: Path, activity: str) -> Optional[dict]:
+    """Find the latest log line of an activity.
+
+    The index is used when available, updating it if the log grew. When
+    it's missing or does not match the log, the log is scanned backwards
+    instead and the index is left to be rebuilt by the next append.
+
+    Parameters
+    ----------
+    log_fname : Path
+        The log file path, the file must exist
+    activity : str
+        The name of the activity
+
+    Returns
+    -------
+    Optional[dict]
+        The parsed line, None if the activity is not in the log
+    """
+    log_size = log_fname.stat().st_size
+    try:
+        offset = _indexed_offset(log_fname, log_size, activity)
+    except (sqlite3.DatabaseError, TypeError):
+        return scan_latest_line(log_fname, activity)
+    if offset is None:
+        return None
+    logm = read_line_at(log_fname, offset)
+    if logm is not None and logm.get('activity') == activity:
+        return logm
+    remove_index(log_fname)
+    return scan_latest_line(log_fname, activity)
@@ -0,0 +1,290 @@
+"""Outcomes of the log in a range of time, without reading all of it.
+
+The log is appended when activities end, so its lines are ordered by
+`end_at`. The first line of a range is found by bisection on the byte
+offsets: from an offset in the middle of a line, the reading resumes at
+the next newline. Only O(log n) lines are parsed to find it, then the
+lines of the range are read in order. The same is done in the rotated
+segments overlapping the range, while the compressed ones are read from
+the block containing its start.
+"""
+from contextlib import nullcontext
+from datetime import datetime
+import json
+import mmap
+import os
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple
+
+from choose_activity.helpers import ActivityOutcome
+from choose_activity.locking import file_lock
+from choose_activity.segments import (
+    Block,
+    Segment,
+    compressed_lines,
+    read_blocks,
+    read_manifest,
+    segment_path,
+)
+
+
+def _line_from(f: BinaryIO, pos: int) -> Tuple[int, bytes]:
+    """The first line starting at or after an offset, and where it starts.
+
+    The line is empty at the end of the file.
+    """
+    if pos == 0:
+        f.seek(0)
+    else:
+        # from the previous byte, in case a line starts right at pos
+        f.seek(pos - 1)
+        f.readline()
+    return f.tell(), f.readline()
+
+
+def _end_at(line: bytes) -> datetime:
+    return datetime.fromisoformat(json.loads(line)['end_at'])
+
+
+def find_offset(f: BinaryIO, size: int, moment: datetime) -> int:
+    """Where the first line ending at or after a moment starts.
+
+    Parameters
+    ----------
+    f : BinaryIO
+        The log, ordered by end time
+    size : int
+        The size of the log, a line not ending by then is ignored
+    moment : datetime
+        The moment to look for, with a time zone
+
+    Returns
+    -------
+    int
+        The offset of the line, the size if every line ends before
+    """
+    # the lines starting before lo end before the moment, the ones
+    # starting from hi end at or after it
+    lo, hi = 0, size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start, line = _line_from(f, mid)
+        if start >= hi or not line.endswith(b'\n'):
+            # no complete line starts between mid and hi
+            hi = mid
+        elif _end_at(line) < moment:
+            lo = start + len(line)
+        else:
+            hi = start
+    return lo
+
+
+def _local(moment: Optional[datetime]) -> Optional[datetime]:
+    """The moment with a time zone, the local one if it has none."""
+    if moment is None or moment.tzinfo is not None:
+        return moment
+    return moment.astimezone()
+
+
+def _outcomes_in(
+        lines: Iterator[bytes],
+        since: Optional[datetime],
+        until: Optional[datetime],
+) -> Iterator[ActivityOutcome]:
+    """The outcomes of some lines that ended in a range of time."""
+    for line in lines:
+        if not line.endswith(b'\n'):
+            # being written right now
+            break
+        logm = json.loads(line)
+        end_at = datetime.fromisoformat(logm['end_at'])
+        if since is not None and end_at < since:
+            continue
+        if until is not None and end_at >= until:
+            break
+        yield ActivityOutcome(
+            activity=logm['activity'],
+            start_at=datetime.fromisoformat(logm['start_at']),
+            end_at=end_at,
+            is_done=logm['is_done'],
+            feedback=logm['feedback'],
+        )
+
+
+def _plain_lines(f: BinaryIO, since: Optional[datetime]) -> Iterator[bytes]:
+    """The lines of a plain log, from the first ending at since."""
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        f.seek(0 if since is None else find_offset(f, size, since))
+        yield from f
+
+
+def _compressed_lines(
+        f: BinaryIO,
+        segment: Segment,
+        blocks: List[Block],
+        since: Optional[datetime],
+) -> Iterator[bytes]:
+    with f:
+        yield from compressed_lines(f, segment.compression, blocks, since)
+
+
+def outcomes_between(
+        log_fname: Path,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        lock: bool = True,
+) -> Iterator[ActivityOutcome]:
+    """The outcomes of the log that ended in a range of time.
+
+    The rotated segments are read too, only the ones overlapping the
+    range, and of the compressed ones only the blocks overlapping it.
+
+    Parameters
+    ----------
+    log_fname : Path
+        The log file path
+    since : Optional[datetime]
+        The start of the range, included, from the first outcome if None
+    until : Optional[datetime]
+        The end of the range, excluded, up to the last outcome if None.
+        Without a time zone the moments are in the local one
+    lock : bool
+        Whether to take the lock of the log while opening its files,
+        False if the caller holds it
+
+    Returns
+    -------
+    Iterator[ActivityOutcome]
+        The outcomes, ordered by end time
+    """
+    since, until = _local(since), _local(until)
+    sources = []
+    # opened together, so a rotation meanwhile does not change what's read
+    with file_lock(log_fname, exclusive=False) if lock else nullcontext():
+        for segment in read_manifest(log_fname).segments:
+            if since is not None and datetime.fromisoformat(
+                    segment.last_end_at) < since:
+                continue
+            if until is not None and datetime.fromisoformat(
+                    segment.first_end_at) >= until:
+                break
+            f = open(segment_path(log_fname, segment), 'rb')
+            if segment.compression is None:
+                sources.append(_plain_lines(f, since))
+            else:
+                sources.append(_compressed_lines(
+                    f, segment, read_blocks(log_fname, segment), since))
+        try:
+            sources.append(_plain_lines(open(log_fname, 'rb'), since))
+        except FileNotFoundError:
+            pass
+    for lines in sources:
+        yield from _outcomes_in(lines, since, until)
+
+
+def last_end_at(log_fname: Path) -> Optional[datetime]:
+    """When the latest outcome of the log ended, None if there are none.
+
+    The caller must hold the lock of the log.
+    """
+    try:
+        f = open(log_fname, 'rb')
+    except FileNotFoundError:
+        f = None
+    if f is not None:
+        with f:
+            if os.fstat(f.fileno()).st_size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    # anything after the last newline is being written
+                    end = mm.rfind(b'\n')
+                    if end >= 0:
+                        start = mm.rfind(b'\n', 0, end) + 1
+                        return _local(_end_at(mm[start:end]))
+    # the log was just rotated, or is empty
+    segments = read_manifest(log_fname).segments
+    if segments:
+        return _local(datetime.fromisoformat(segments[-1].last_end_at))
+    return None
+
+
+def check_order(log_fname: Path, end_ats: Iterable[datetime]) -> None:
+    """Check that outcomes can be appended to the log keeping it ordered.
+
+    The caller must hold the lock of the log.
+
+    Parameters
+    ----------
+    log_fname : Path
+        The log file path
+    end_ats : Iterable[datetime]
+        When the outcomes to append ended, in the order they would be
+        appended. Without a time zone the moments are in the local one
+
+    Raises
+    ------
+    ValueError
+        If an outcome ended before the previous one, or before the
+        latest outcome of the log
+    """
+    previous = last_end_at(log_fname)
+    for position, end_at in enumerate(end_ats):
+        end_at = _local(end_at)
+        if previous is not None and end_at < previous:
+            raise ValueError(
+                f'The outcome {position + 1} ended before the previous one')
+        previous = end_at
+
+
+def skip_logged(
+        log_fname: Path,
+        outcomes: Iterable[ActivityOutcome],
+) -> Iterator[ActivityOutcome]:
+    """The outcomes that are not in the log yet.
+
+    The outcomes are ordered by end time. Those ending up to the latest
+    outcome of the log are looked up in it, reading it from the first of
+    them, so appending a log to a copy of itself appends nothing. The
+    caller must hold the lock of the log.
+
+    Parameters
+    ----------
+    log_fname : Path
+        The log file path
+    outcomes : Iterable[ActivityOutcome]
+        The outcomes to append, ordered by end time
+
+    Returns
+    -------
+    Iterator[ActivityOutcome]
+        The outcomes that are not in the log, in the same order
+    """
+    latest = last_end_at(log_fname)
+    logged: Optional[Iterator[ActivityOutcome]] = None
+    # the next outcome of the log, read but not compared yet
+    upcoming: Optional[ActivityOutcome] = None
+    moment = None
+    # the outcomes of the log ending at the moment, not matched yet
+    at_moment: List[ActivityOutcome] = []
+    for outcome in outcomes:
+        end_at = _local(outcome.end_at)
+        if latest is None or end_at > latest:
+            yield outcome
+            continue
+        if logged is None:
+            logged = outcomes_between(log_fname, since=end_at, lock=False)
+        if end_at != moment:
+            moment = end_at
+            at_moment = []
+            while True:
+                if upcoming is None:
+                    upcoming = next(logged, None)
+                if upcoming is None or _local(upcoming.end_at) > moment:
+                    break
+                if _local(upcoming.end_at) == moment:
+                    at_moment.append(upcoming)
+                upcoming = None
+        if outcome in at_moment:
+            at_moment.remove(outcome)
+        else:
+            yield outcome
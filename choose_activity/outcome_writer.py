@@ -0,0 +1,172 @@
+import atexit
+from pathlib import Path
+import threading
+from time import monotonic
+from typing import Any, List, Optional, Tuple, Union
+import weakref
+
+from choose_activity.helpers import (
+    ActivityOutcome,
+    append_lines,
+    latest_outcome_for_activity,
+    outcome_line,
+)
+from choose_activity.locking import file_lock
+from choose_activity.storage import FileStorage, Storage
+
+# the writers not closed yet, closed at exit without keeping them alive
+_open_writers: 'weakref.WeakSet[OutcomeWriter]' = weakref.WeakSet()
+
+
+@atexit.register
+def _close_writers() -> None:
+    for writer in list(_open_writers):
+        writer.close()
+
+
+class OutcomeWriter:
+    """Buffer outcomes in memory and append them to the log in batches.
+
+    The buffer is written with a single append, and optionally a single
+    fsync, when it holds too many outcomes or bytes, or when the oldest
+    outcome waited too long. The time is checked at every write and by
+    `flush_if_due`, there is no background thread. What is left is
+    written by `close`, when the writer is garbage collected or when the
+    interpreter exits.
+
+    The outcomes for a log file are buffered as the lines to append, so
+    each one is encoded once. Those for another storage are passed to
+    its `log_activity_results`.
+
+    Outcomes still in the buffer are not in the log, readers of the log
+    only see what was flushed. Use `latest_outcome_for_activity` of the
+    writer to see the buffered ones too.
+
+    Parameters
+    ----------
+    target : Union[Path, Storage]
+        The log file path, or the storage of the outcomes
+    max_count : int
+        Flush when this many outcomes are buffered
+    max_bytes : int
+        Flush when the buffered lines take this many bytes, the outcomes
+        for a storage that is not a log file don't count
+    max_delay : float
+        Flush when the oldest buffered outcome waited this many seconds
+    fsync : bool
+        Whether to wait for every flush of a log file to reach the disk
+    lock : bool
+        Whether to take the lock of the log file at every flush, False
+        if the caller holds it while using the writer
+    """
+
+    def __init__(
+            self,
+            target: Union[Path, Storage],
+            max_count: int = 1000,
+            max_bytes: int = 1 << 20,
+            max_delay: float = 1.0,
+            fsync: bool = False,
+            lock: bool = True,
+    ):
+        self.fname: Optional[Path] = None
+        self.storage: Optional[Storage] = None
+        if isinstance(target, FileStorage):
+            target = target.log_fname
+        if isinstance(target, Storage):
+            self.storage = target
+        else:
+            self.fname = target
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.fsync = fsync
+        self.lock = lock
+        # the activity, the feedback and the line, or the outcome for a
+        # storage, of each buffered outcome
+        self.pending: List[Tuple[str, str, Any]] = []
+        self.pending_bytes = 0
+        # when the oldest outcome of the buffer was written
+        self.pending_since: Optional[float] = None
+        self._lock = threading.Lock()
+        _open_writers.add(self)
+
+    def write(self, outcome: ActivityOutcome) -> None:
+        """Add an outcome to the buffer, flushing it if it's full."""
+        if self.storage is None:
+            item = outcome_line(outcome)
+            size = len(item)
+        else:
+            item = outcome
+            size = 0
+        with self._lock:
+            if not self.pending:
+                self.pending_since = monotonic()
+            self.pending.append((outcome.activity, outcome.feedback, item))
+            self.pending_bytes += size
+            if (len(self.pending) >= self.max_count
+                    or self.pending_bytes >= self.max_bytes
+                    or self._due()):
+                self._flush()
+
+    def _due(self) -> bool:
+        return (self.pending_since is not None
+                and monotonic() - self.pending_since >= self.max_delay)
+
+    def _flush(self) -> None:
+        if not self.pending:
+            return
+        if self.storage is not None:
+            self.storage.log_activity_results(
+                [outcome for _, _, outcome in self.pending])
+        elif self.lock:
+            with file_lock(self.fname):
+                self._append()
+        else:
+            self._append()
+        self.pending = []
+        self.pending_bytes = 0
+        self.pending_since = None
+
+    def _append(self) -> None:
+        append_lines(
+            self.fname,
+            [(activity, line) for activity, _, line in self.pending],
+            self.fsync,
+        )
+
+    def flush(self) -> None:
+        """Append the buffered outcomes to the log."""
+        with self._lock:
+            self._flush()
+
+    def flush_if_due(self) -> None:
+        """Flush if the oldest buffered outcome waited too long."""
+        with self._lock:
+            if self._due():
+                self._flush()
+
+    def latest_outcome_for_activity(self, activity: str) -> Optional[str]:
+        """The latest outcome of an activity, buffered or in the log."""
+        with self._lock:
+            for pending_activity, feedback, _ in reversed(self.pending):
+                if pending_activity == activity:
+                    return feedback
+        if self.storage is not None:
+            return self.storage.latest_outcome_for_activity(activity)
+        return latest_outcome_for_activity(self.fname, activity)
+
+    def close(self) -> None:
+        """Flush the buffer, the writer should not be used anymore."""
+        self.flush()
+        _open_writers.discard(self)
+
+    def __del__(self) -> None:
+        # like a file, what is buffered is not lost when it's collected
+        self.close()
+
+    def __enter__(self) -> 'OutcomeWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,178 @@
+"""Timing of the I/O and selection steps, enabled on demand.
+
+When enabled, the functions listed in INSTRUMENTED are replaced, in every
+module referencing them, by wrappers recording how long each call took.
+When not enabled nothing is replaced, so there is no overhead at all.
+"""
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+import importlib
+import json
+import os
+from pathlib import Path
+import sys
+import threading
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# set it to 1 to print the time spent in each step
+PROFILE_ENV_VAR = 'CHOOSE_ACTIVITY_PROFILE'
+
+# the functions and methods to time, as module:qualified name
+INSTRUMENTED = (
+    'choose_activity.helpers:load_state',
+    'choose_activity.helpers:save_state',
+    'choose_activity.helpers:record_mutation',
+    'choose_activity.helpers:log_activity_result',
+    'choose_activity.helpers:log_activity_results',
+    'choose_activity.helpers:latest_outcome_for_activity',
+    'choose_activity.helpers:weighted_choice',
+    'choose_activity.helpers:pick_activity',
+    'choose_activity.helpers:weighted_sample',
+    'choose_activity.helpers:weighted_choice_many',
+    'choose_activity.helpers:weighted_choice_counts',
+    'choose_activity.helpers:user_selection',
+    'choose_activity.outcome_index:index_lines',
+    'choose_activity.outcome_index:scan_latest_line',
+    'choose_activity.stats:activity_stats',
+    'choose_activity.storage:SQLiteStorage.load_state',
+    'choose_activity.storage:SQLiteStorage.save_state',
+    'choose_activity.storage:SQLiteStorage.record_mutation',
+    'choose_activity.storage:SQLiteStorage.log_activity_result',
+    'choose_activity.storage:SQLiteStorage.log_activity_results',
+    'choose_activity.storage:SQLiteStorage.latest_outcome_for_activity',
+    'choose_activity.storage:SQLiteStorage.activity_stats',
+)
+
+
+class Profiler:
+    """Collect the duration of every span, also nested ones."""
+
+    def __init__(self):
+        self.origin = perf_counter()
+        # name, start and duration in seconds, thread id
+        self.events: List[Tuple[str, float, float, int]] = []
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Record the time spent in the block."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.events.append((
+                name,
+                start - self.origin,
+                perf_counter() - start,
+                threading.get_ident(),
+            ))
+
+    def wrap(self, name: str, fun: Callable) -> Callable:
+        """Wrap a function so that every call is recorded as a span."""
+        @wraps(fun)
+        def timed(*args, **kwargs):
+            with self.span(name):
+                return fun(*args, **kwargs)
+        return timed
+
+    def breakdown(self) -> str:
+        """The number of calls and time spent in each span, as a table."""
+        totals: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+        for name, _, duration, _ in self.events:
+            totals[name][0] += 1
+            totals[name][1] += duration
+        lines = [f'{"calls":>6} {"total ms":>10} {"mean ms":>10}  step']
+        for name, (calls, total) in sorted(
+                totals.items(), key=lambda i: -i[1][1]):
+            lines.append(
+                f'{calls:>6} {total * 1000:>10.3f}'
+                f' {total * 1000 / calls:>10.3f}  {name}')
+        return '\n'.join(lines)
+
+    def write_trace(self, fname: Path) -> None:
+        """Write the spans in the Chrome trace format.
+
+        The file can be opened with chrome://tracing or Perfetto.
+        """
+        pid = os.getpid()
+        trace_events = [
+            dict(
+                name=name,
+                ph='X',
+                ts=start * 1e6,
+                dur=duration * 1e6,
+                pid=pid,
+                tid=tid,
+            )
+            for name, start, duration, tid in self.events
+        ]
+        with open(fname, 'w') as f:
+            f.write(json.dumps(dict(traceEvents=trace_events)))
+
+
+_profiler: Optional[Profiler] = None
+
+
+def _resolve(target: str):
+    """The owner of the attribute to replace, its name and its value."""
+    module_name, qualified_name = target.split(':')
+    owner = importlib.import_module(module_name)
+    *path, attribute = qualified_name.split('.')
+    for part in path:
+        owner = getattr(owner, part)
+    return owner, attribute, getattr(owner, attribute)
+
+
+def _replace(old: Callable, new: Callable) -> None:
+    """Replace a function in every module of the package referencing it."""
+    for module in list(sys.modules.values()):
+        spec = getattr(module, '__spec__', None)
+        # the entry point is named __main__ when run with -m
+        if spec is None or not spec.name.startswith('choose_activity'):
+            continue
+        for key, value in list(vars(module).items()):
+            if value is old:
+                setattr(module, key, new)
+
+
+def enable() -> Profiler:
+    """Start timing the instrumented functions, return the profiler.
+
+    Calling it again returns the same profiler.
+    """
+    global _profiler
+    if _profiler is not None:
+        return _profiler
+    _profiler = Profiler()
+    for target in INSTRUMENTED:
+        owner, attribute, original = _resolve(target)
+        name = target.split(':')[1]
+        timed = _profiler.wrap(name, original)
+        if isinstance(owner, type):
+            setattr(owner, attribute, timed)
+            continue
+        _replace(original, timed)
+    return _profiler
+
+
+def disable() -> None:
+    """Stop timing, restoring the original functions."""
+    global _profiler
+    if _profiler is None:
+        return
+    for target in INSTRUMENTED:
+        owner, attribute, timed = _resolve(target)
+        original = timed.__wrapped__
+        if isinstance(owner, type):
+            setattr(owner, attribute, original)
+            continue
+        _replace(timed, original)
+    _profiler = None
+
+
+def span(name: str):
+    """Time a block as a span, if profiling is enabled."""
+    if _profiler is None:
+        return nullcontext()
+    return _profiler.span(name)
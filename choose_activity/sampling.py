@@ -0,0 +1,278 @@
+from array import array
+from itertools import chain
+from random import random
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Sequence,
+)
+
+# how many times TreeSampler.choice draws again when it lands off
+MAX_DRAWS = 8
+
+
+class AliasSampler:
+    """Draw keys with a probability proportional to their weight in O(1).
+
+    The table is built once using the Walker/Vose alias method, which
+    takes O(n), then every draw costs a single random number and two
+    array lookups regardless of the number of choices.
+
+    >>> sampler = AliasSampler({'only me!': 1.0})
+    >>> sampler.choice()
+    'only me!'
+
+    Parameters
+    ----------
+    choices_and_weights : Mapping[str, float]
+        Choices and corresponding weights. Weights are expected to be
+        greater than or equal to 0, or the behavior of the sampler is
+        undefined
+    """
+
+    def __init__(self, choices_and_weights: Mapping[str, float]):
+        self._keys: List[Optional[str]] = list(choices_and_weights)
+        self._build(choices_and_weights.values())
+
+    @classmethod
+    def from_lists(
+            cls,
+            keys: List[Optional[str]],
+            weights: Sequence[float],
+    ) -> 'AliasSampler':
+        """A sampler of the keys with the weights in the same order.
+
+        The list of keys is kept, not copied. A key can be None if its
+        weight is 0, it's never drawn.
+        """
+        sampler = cls.__new__(cls)
+        sampler._keys = keys
+        sampler._build(weights)
+        return sampler
+
+    def _build(self, weights: Iterable[float]) -> None:
+        n = len(self._keys)
+        self._len = n - self._keys.count(None)
+        self._prob = array('d', bytes(8 * n))
+        self._alias = array('q', range(n))
+        scaled = array('d', weights)
+        self._total = sum(scaled)
+        if self._total <= 0:
+            return
+        for i, w in enumerate(scaled):
+            scaled[i] = w * n / self._total
+        small = [i for i, p in enumerate(scaled) if 0.0 < p < 1.0]
+        # the empty ones are paired first, while there is surely a large
+        # one for them, and never drawn
+        small.extend(i for i, p in enumerate(scaled) if p == 0.0)
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            g = large.pop()
+            self._prob[s] = scaled[s]
+            self._alias[s] = g
+            scaled[g] = scaled[g] + scaled[s] - 1.0
+            if scaled[g] < 1.0:
+                small.append(g)
+            else:
+                large.append(g)
+        # whatever is left is 1 up to floating point errors
+        for i in large + small:
+            self._prob[i] = 1.0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def choice(
+            self,
+            random_fun: Callable[[], float] = random,
+    ) -> Optional[str]:
+        """Draw a key, None if the sampler is empty.
+
+        Parameters
+        ----------
+        random_fun : Callable[[], float]
+            Function returning a uniform float in [0, 1)
+
+        Returns
+        -------
+        str
+            One of the keys, None if there are none or all the weights
+            are 0
+        """
+        if self._total <= 0:
+            return None
+        n = len(self._keys)
+        u = random_fun() * n
+        # guard against u rounding up to n for huge tables
+        i = min(int(u), n - 1)
+        if u - i < self._prob[i]:
+            return self._keys[i]
+        return self._keys[self._alias[i]]
+
+
+class TreeSampler(MutableMapping[str, float]):
+    """A mapping of choices to weights that can be sampled in O(log n).
+
+    The weights are stored in a Fenwick tree, so inserting, changing and
+    deleting a choice cost O(log n), as does a draw. Since it behaves as
+    a dictionary it can be used directly as `ActivitiesState.activities`
+    and stays in sync with every change done to the activities.
+
+    >>> sampler = TreeSampler({'a': 1.0, 'b': 2.0})
+    >>> del sampler['a']
+    >>> sampler.choice()
+    'b'
+
+    Parameters
+    ----------
+    choices_and_weights : Mapping[str, float]
+        Initial choices and corresponding weights. Weights are expected
+        to be strictly greater than 0, or the behavior of the sampler is
+        undefined
+    """
+
+    def __init__(
+            self,
+            choices_and_weights: Optional[Mapping[str, float]] = None,
+    ):
+        self._index: Dict[str, int] = {}
+        self._keys: List[Optional[str]] = []
+        self._weights: List[float] = []
+        self._free: List[int] = []
+        # 1-based, self._tree[0] is unused
+        self._tree: List[float] = [0.0]
+        if choices_and_weights:
+            self._bulk_load(choices_and_weights)
+
+    def _bulk_load(self, choices_and_weights: Mapping[str, float]) -> None:
+        """Build the tree in O(n) instead of n insertions."""
+        for k, w in choices_and_weights.items():
+            self._index[k] = len(self._keys)
+            self._keys.append(k)
+            self._weights.append(w)
+        n = len(self._weights)
+        self._tree = [0.0] + self._weights
+        for i in range(1, n + 1):
+            parent = i + (i & -i)
+            if parent <= n:
+                self._tree[parent] += self._tree[i]
+
+    def _update(self, slot: int, delta: float) -> None:
+        i = slot + 1
+        n = len(self._weights)
+        while i <= n:
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, slot_count: int) -> float:
+        total = 0.0
+        i = slot_count
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _append_slot(self, key: str, weight: float) -> int:
+        self._keys.append(key)
+        self._weights.append(weight)
+        i = len(self._weights)
+        # the new node covers its own weight plus the nodes below it
+        node = weight
+        j = i - 1
+        lowest = i - (i & -i)
+        while j > lowest:
+            node += self._tree[j]
+            j -= j & -j
+        self._tree.append(node)
+        return i - 1
+
+    def __getitem__(self, key: str) -> float:
+        return self._weights[self._index[key]]
+
+    def __setitem__(self, key: str, weight: float) -> None:
+        slot = self._index.get(key)
+        if slot is not None:
+            self._update(slot, weight - self._weights[slot])
+            self._weights[slot] = weight
+            return
+        if self._free:
+            slot = self._free.pop()
+            self._keys[slot] = key
+            self._weights[slot] = weight
+            self._update(slot, weight)
+        else:
+            slot = self._append_slot(key, weight)
+        self._index[key] = slot
+
+    def __delitem__(self, key: str) -> None:
+        slot = self._index.pop(key)
+        self._update(slot, -self._weights[slot])
+        self._weights[slot] = 0.0
+        self._keys[slot] = None
+        self._free.append(slot)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({dict(self.items())!r})'
+
+    def total(self) -> float:
+        """The sum of all the weights."""
+        return self._prefix(len(self._weights))
+
+    def choice(
+            self,
+            random_fun: Callable[[], float] = random,
+    ) -> Optional[str]:
+        """Draw a key, None if the sampler is empty.
+
+        Parameters
+        ----------
+        random_fun : Callable[[], float]
+            Function returning a uniform float in [0, 1)
+
+        Returns
+        -------
+        str
+            One of the keys, None if there are none or all the weights
+            are 0
+        """
+        if not self._index:
+            return None
+        total = self.total()
+        if total <= 0:
+            return None
+        n = len(self._weights)
+        for _ in range(MAX_DRAWS):
+            remaining = random_fun() * total
+            pos = 0
+            step = 1 << (n.bit_length() - 1)
+            while step:
+                nxt = pos + step
+                if nxt <= n and self._tree[nxt] <= remaining:
+                    pos = nxt
+                    remaining -= self._tree[nxt]
+                step >>= 1
+            # rounding errors left by deleted slots can land on an
+            # empty slot or past the end, just draw again
+            if pos < n and self._keys[pos] is not None and (
+                    self._weights[pos] > 0):
+                return self._keys[pos]
+        # landed off every time, the nearest slot that can be chosen
+        before = range(min(pos, n - 1), -1, -1)
+        for slot in chain(before, range(pos + 1, n)):
+            if self._keys[slot] is not None and self._weights[slot] > 0:
+                return self._keys[slot]
+        # the total was only the rounding error of the deleted slots
+        return None
@@ -0,0 +1,386 @@
+"""Rotation of the outcome log into sealed segments.
+
+When the log grows too big, or its oldest outcome too old, it's moved to
+the directory of the segments and a new, empty log is started. The
+manifest lists the segments, with their size and time range, and keeps
+a summary of all the sealed outcomes: the statistics of each activity.
+The latest feedback of each activity is in a file of its own, so looking
+it up does not read the statistics. So the latest outcome and the
+statistics only need the summary and the active log, however many
+outcomes there are.
+
+The sealed segments are compressed in independent blocks, each holding
+whole lines. The block index lists where each block is and the end time
+of its first outcome, so reading a range of time decompresses only the
+blocks overlapping it.
+
+Rotation happens while appending, holding the lock of the log. Readers
+needing the manifest and the active log together hold it shared.
+"""
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from functools import partial
+import gzip
+import json
+import lzma
+import os
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional
+
+from choose_activity.locking import write_atomically
+from choose_activity.outcome_index import remove_index
+from choose_activity.stats import (
+    ActivityStats,
+    stats_from_json,
+    stats_path,
+    stats_to_json,
+)
+
+# the log is rotated when bigger than this
+SEGMENT_MAX_BYTES = 16 << 20
+# and, if set, when its oldest outcome ended before this
+SEGMENT_MAX_AGE: Optional[timedelta] = None
+# how the sealed segments are compressed, one of COMPRESSIONS or None
+SEGMENT_COMPRESSION: Optional[str] = 'gzip'
+# the uncompressed size of a block, more or less
+BLOCK_SIZE = 1 << 16
+
+# the functions to compress and decompress, and the file suffix
+COMPRESSIONS = {
+    # the default level 9 is much slower for a little gain
+    'gzip': (partial(gzip.compress, compresslevel=6), gzip.decompress, '.gz'),
+    'lzma': (lzma.compress, lzma.decompress, '.xz'),
+}
+
+
+@dataclass
+class Segment:
+    """A sealed part of the log."""
+
+    name: str
+    count: int
+    size: int
+    # end time of the first and last outcome, in ISO 8601
+    first_end_at: str
+    last_end_at: str
+    # one of COMPRESSIONS, None if it's plain JSONL
+    compression: Optional[str] = None
+
+
+@dataclass
+class Block:
+    """A compressed block of a segment."""
+
+    # end time of the first outcome, in ISO 8601
+    first_end_at: str
+    offset: int
+    length: int
+
+
+@dataclass
+class Manifest:
+    """The sealed segments, oldest first, and the summary of them all."""
+
+    segments: List[Segment] = field(default_factory=list)
+    stats: Dict[str, ActivityStats] = field(default_factory=dict)
+    # feedback of the latest outcome of each activity, in its own file
+    latest: Dict[str, str] = field(default_factory=dict)
+
+
+def segments_dir(log_fname: Path) -> Path:
+    """The directory of the sealed segments of a log."""
+    return Path(f'{log_fname}.segments')
+
+
+def manifest_path(log_fname: Path) -> Path:
+    """The path of the manifest of a log."""
+    return Path(f'{log_fname}.manifest')
+
+
+def latest_path(log_fname: Path) -> Path:
+    """The path of the latest feedback of the sealed outcomes of a log."""
+    return Path(f'{log_fname}.latest')
+
+
+def segment_path(log_fname: Path, segment: Segment) -> Path:
+    return segments_dir(log_fname) / segment.name
+
+
+def blocks_path(log_fname: Path, segment: Segment) -> Path:
+    """The path of the block index of a compressed segment."""
+    return segments_dir(log_fname) / f'{segment.name}.blocks'
+
+
+def _number(name: str) -> str:
+    return name.split('.')[0]
+
+
+def _summarize(
+        manifest: Manifest,
+        fname: Path,
+        name: str,
+) -> Optional[Segment]:
+    """Add a sealed segment to the manifest, None if it's empty."""
+    count = 0
+    first_end_at = last_end_at = None
+    with open(fname, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            logm = json.loads(line)
+            last_end_at = logm['end_at']
+            if first_end_at is None:
+                first_end_at = last_end_at
+            count += 1
+            manifest.stats.setdefault(logm['activity'], ActivityStats()).add(
+                datetime.fromisoformat(logm['start_at']),
+                datetime.fromisoformat(last_end_at),
+                logm['is_done'],
+            )
+            manifest.latest[logm['activity']] = logm['feedback']
+        size = f.tell()
+    if count == 0:
+        return None
+    segment = Segment(name, count, size, first_end_at, last_end_at)
+    manifest.segments.append(segment)
+    return segment
+
+
+def read_manifest(log_fname: Path) -> Manifest:
+    """Read the manifest of a log, an empty one if there is none.
+
+    A segment sealed by a rotation interrupted before writing the
+    manifest is summarized again.
+    """
+    try:
+        with open(manifest_path(log_fname), 'rb') as f:
+            raw_obj = json.loads(f.read())
+        manifest = Manifest(
+            segments=[Segment(**s) for s in raw_obj['segments']],
+            stats=stats_from_json(raw_obj['stats']),
+        )
+    except FileNotFoundError:
+        manifest = Manifest()
+    else:
+        raw_latest = _read_latest(log_fname)
+        if raw_latest is not None:
+            manifest.latest = raw_latest['latest']
+    directory = segments_dir(log_fname)
+    if directory.exists():
+        # a plain segment left by a compression is listed compressed
+        listed = {_number(segment.name) for segment in manifest.segments}
+        for fname in sorted(directory.iterdir()):
+            if _number(fname.name) not in listed and fname.suffix == '.jsonl':
+                _summarize(manifest, fname, fname.name)
+    return manifest
+
+
+def _read_latest(log_fname: Path) -> Optional[dict]:
+    try:
+        with open(latest_path(log_fname), 'rb') as f:
+            return json.loads(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def read_latest(log_fname: Path) -> Dict[str, str]:
+    """The feedback of the latest sealed outcome of each activity.
+
+    Only its own file is read, unless it does not cover every segment
+    because a rotation was interrupted: then the whole manifest is read.
+    """
+    raw_latest = _read_latest(log_fname)
+    listed = 0 if raw_latest is None else raw_latest['segments']
+    # the segments are numbered from 1, a new one is listed last
+    unlisted = f'{listed + 1:06d}.jsonl'
+    if (segments_dir(log_fname) / unlisted).exists():
+        return read_manifest(log_fname).latest
+    return {} if raw_latest is None else raw_latest['latest']
+
+
+def _write_manifest(log_fname: Path, manifest: Manifest) -> None:
+    # before the manifest, so it's never older than it
+    write_atomically(latest_path(log_fname), json.dumps(dict(
+        segments=len(manifest.segments),
+        latest=manifest.latest,
+    )).encode())
+    write_atomically(manifest_path(log_fname), json.dumps(dict(
+        segments=[vars(segment) for segment in manifest.segments],
+        stats=stats_to_json(manifest.stats),
+    )).encode())
+
+
+def rotate(log_fname: Path) -> Optional[Segment]:
+    """Seal the log as a segment and start a new one.
+
+    The caller must hold the lock of the log.
+
+    Parameters
+    ----------
+    log_fname : Path
+        The log file path
+
+    Returns
+    -------
+    Optional[Segment]
+        The new segment, None if the log is empty
+    """
+    manifest = read_manifest(log_fname)
+    if not log_fname.exists() or log_fname.stat().st_size == 0:
+        return None
+    directory = segments_dir(log_fname)
+    directory.mkdir(exist_ok=True)
+    number = len(manifest.segments) + 1
+    name = f'{number:06d}.jsonl'
+    sealed = directory / name
+    # after this a crash is recovered by read_manifest
+    os.replace(log_fname, sealed)
+    # they describe the sealed log, not the new one
+    remove_index(log_fname)
+    try:
+        stats_path(log_fname).unlink()
+    except FileNotFoundError:
+        pass
+    segment = _summarize(manifest, sealed, name)
+    if segment is not None and SEGMENT_COMPRESSION is not None:
+        _compress(log_fname, segment, SEGMENT_COMPRESSION)
+    _write_manifest(log_fname, manifest)
+    if segment is not None and segment.compression is not None:
+        sealed.unlink()
+    return segment
+
+
+def _blocks(f: BinaryIO) -> Iterator[List[bytes]]:
+    """The lines of a plain segment, grouped in blocks."""
+    block: List[bytes] = []
+    size = 0
+    for line in f:
+        if not line.endswith(b'\n'):
+            break
+        block.append(line)
+        size += len(line)
+        if size >= BLOCK_SIZE:
+            yield block
+            block, size = [], 0
+    if block:
+        yield block
+
+
+def _compress(log_fname: Path, segment: Segment, compression: str) -> None:
+    """Write the compressed copy of a plain segment and its block index.
+
+    The segment is changed to refer to the copy, the plain one is left
+    to be removed once the manifest is written.
+    """
+    compress = COMPRESSIONS[compression][0]
+    plain_path = segment_path(log_fname, segment)
+    compressed = Segment(**vars(segment))
+    compressed.name += COMPRESSIONS[compression][2]
+    compressed.compression = compression
+    target = segment_path(log_fname, compressed)
+    tmp_path = Path(f'{target}.tmp')
+    blocks = []
+    with open(plain_path, 'rb') as f, open(tmp_path, 'wb') as out:
+        for lines in _blocks(f):
+            data = compress(b''.join(lines))
+            first_end_at = json.loads(lines[0])['end_at']
+            blocks.append(Block(first_end_at, out.tell(), len(data)))
+            out.write(data)
+    with open(blocks_path(log_fname, compressed), 'w') as f:
+        f.write(json.dumps([vars(block) for block in blocks]))
+    os.replace(tmp_path, target)
+    segment.name = compressed.name
+    segment.compression = compression
+    segment.size = target.stat().st_size
+
+
+def read_blocks(log_fname: Path, segment: Segment) -> List[Block]:
+    """The block index of a compressed segment."""
+    with open(blocks_path(log_fname, segment), 'rb') as f:
+        return [Block(**raw_block) for raw_block in json.loads(f.read())]
+
+
+def compressed_lines(
+        f: BinaryIO,
+        compression: str,
+        blocks: List[Block],
+        since: Optional[datetime] = None,
+) -> Iterator[bytes]:
+    """The lines of a compressed segment, decompressing a block at a time.
+
+    Parameters
+    ----------
+    f : BinaryIO
+        The compressed segment
+    compression : str
+        How it was compressed, one of COMPRESSIONS
+    blocks : List[Block]
+        Its block index
+    since : Optional[datetime]
+        Skip the blocks ending before this moment, the block containing
+        it can still have lines ending before
+
+    Returns
+    -------
+    Iterator[bytes]
+        The lines, starting from the block containing the moment
+    """
+    decompress = COMPRESSIONS[compression][1]
+    first = 0
+    if since is not None:
+        starts = [datetime.fromisoformat(b.first_end_at) for b in blocks]
+        # the last block starting before the moment may contain it
+        first = max(bisect_left(starts, since) - 1, 0)
+    for block in blocks[first:]:
+        f.seek(block.offset)
+        yield from decompress(f.read(block.length)).splitlines(keepends=True)
+
+
+def _first_end_at(log_fname: Path) -> Optional[datetime]:
+    with open(log_fname, 'rb') as f:
+        line = f.readline()
+    if not line.endswith(b'\n'):
+        return None
+    return datetime.fromisoformat(json.loads(line)['end_at'])
+
+
+def maybe_rotate(
+        log_fname: Path,
+        max_bytes: Optional[int] = None,
+        max_age: Optional[timedelta] = None,
+) -> Optional[Segment]:
+    """Rotate the log if it's too big or too old.
+
+    The caller must hold the lock of the log.
+
+    Parameters
+    ----------
+    log_fname : Path
+        The log file path
+    max_bytes : Optional[int]
+        The maximum size of the log, by default SEGMENT_MAX_BYTES
+    max_age : Optional[timedelta]
+        The maximum age of its oldest outcome, by default SEGMENT_MAX_AGE
+
+    Returns
+    -------
+    Optional[Segment]
+        The new segment, if rotated
+    """
+    if max_bytes is None:
+        max_bytes = SEGMENT_MAX_BYTES
+    if max_age is None:
+        max_age = SEGMENT_MAX_AGE
+    try:
+        size = log_fname.stat().st_size
+    except FileNotFoundError:
+        return None
+    if size >= max_bytes:
+        return rotate(log_fname)
+    if max_age is not None and size > 0:
+        first_end_at = _first_end_at(log_fname)
+        if (first_end_at is not None
+                and datetime.now().astimezone() - first_end_at > max_age):
+            return rotate(log_fname)
+    return None
@@ -0,0 +1,179 @@
+"""A binary copy of the parsed state file, to start faster.
+
+Parsing the JSON of the state file takes most of the start up when there
+are many activities. The names, the weights and the other fields parsed
+are written next to it, with `marshal` and as an array of doubles,
+together with the modification time, size and hash of the file they
+come from. When those still match, the state is loaded from the copy
+and the JSON is not parsed at all.
+
+The journal is not part of the copy, it's replayed on top as usual.
+"""
+from array import array
+from functools import partial
+import hashlib
+from itertools import islice
+import marshal
+import os
+from pathlib import Path
+import struct
+import tempfile
+from typing import (
+    Any,
+    BinaryIO,
+    Dict,
+    List,
+    MutableMapping,
+    Optional,
+    Tuple,
+)
+
+from choose_activity.compact import CompactActivities
+
+# changed when the content of the cache changes
+CACHE_FORMAT = 1
+# the newer ones keep a table of the objects written, taking much memory
+MARSHAL_VERSION = 2
+CHUNK_SIZE = 1 << 16
+NAMES_PER_CHUNK = 1 << 12
+
+# the size of each piece written with marshal
+_SIZE = struct.Struct('<Q')
+
+
+def cache_path(fname: Path) -> Path:
+    """The path of the cache of a state file."""
+    return Path(f'{fname}.cache')
+
+
+def _digest(f: BinaryIO) -> bytes:
+    f.seek(0)
+    digest = hashlib.blake2b(digest_size=16)
+    for chunk in iter(partial(f.read, CHUNK_SIZE), b''):
+        digest.update(chunk)
+    return digest.digest()
+
+
+def _dump(obj: Any, f: BinaryIO) -> None:
+    data = marshal.dumps(obj, MARSHAL_VERSION)
+    f.write(_SIZE.pack(len(data)))
+    f.write(data)
+
+
+def _load(f: BinaryIO) -> Any:
+    # much faster than marshal.load, that reads the file a bit at a time
+    size, = _SIZE.unpack(f.read(_SIZE.size))
+    data = f.read(size)
+    if len(data) != size:
+        raise EOFError('The cache is incomplete')
+    return marshal.loads(data)
+
+
+def read_cache(
+        fname: Path,
+        f: BinaryIO,
+        compact: bool = False,
+) -> Optional[Tuple[MutableMapping[str, float], Dict[str, Any]]]:
+    """The state cached for a state file, None if missing or stale.
+
+    Parameters
+    ----------
+    fname : Path
+        The state file path
+    f : BinaryIO
+        The state file, opened by the caller
+    compact : bool
+        Whether to put the activities in a `CompactActivities`
+
+    Returns
+    -------
+    Optional[Tuple[MutableMapping[str, float], Dict[str, Any]]]
+        The activities and the other fields of the file, as
+        `state_reader.read_state_file` gives them
+    """
+    try:
+        with open(cache_path(fname), 'rb') as cache:
+            (cache_format, mtime_ns, size, digest, count, integers,
+             fields) = _load(cache)
+            stat = os.fstat(f.fileno())
+            # the hash is only computed when the rest matches
+            if (cache_format != CACHE_FORMAT
+                    or (mtime_ns, size) != (stat.st_mtime_ns, stat.st_size)
+                    or digest != _digest(f)):
+                return None
+            names: List[str] = []
+            while len(names) < count:
+                names.extend(_load(cache))
+            weights = array('d')
+            weights.fromfile(cache, count)
+    except (OSError, EOFError, ValueError, TypeError, struct.error):
+        return None
+    if compact:
+        return CompactActivities.from_lists(names, weights), fields
+    activities = dict(zip(names, weights))
+    # the same types json.loads would give
+    for position, weight in integers.items():
+        activities[names[position]] = weight
+    return activities, fields
+
+
+def write_cache(
+        fname: Path,
+        f: BinaryIO,
+        activities: MutableMapping[str, float],
+        fields: Dict[str, Any],
+) -> None:
+    """Cache the state parsed from a state file.
+
+    The file must not change meanwhile, the caller holds its lock. A
+    cache that can't be written is not an error, the next load parses
+    the file again.
+
+    Parameters
+    ----------
+    fname : Path
+        The state file path
+    f : BinaryIO
+        The state file, opened by the caller
+    activities : MutableMapping[str, float]
+        The activities parsed from it
+    fields : Dict[str, Any]
+        The other fields parsed from it
+    """
+    integers = {
+        position: weight
+        for position, weight in enumerate(activities.values())
+        if type(weight) is int
+    }
+    stat = os.fstat(f.fileno())
+    header = (
+        CACHE_FORMAT, stat.st_mtime_ns, stat.st_size, _digest(f),
+        len(activities), integers, fields,
+    )
+    target = cache_path(fname)
+    try:
+        # other readers may be writing it too, holding the lock shared
+        fd, tmp_name = tempfile.mkstemp(
+            dir=target.parent, prefix=f'{target.name}.', suffix='.tmp')
+    except OSError:
+        return
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            _dump(header, tmp)
+            # a piece at a time, not to copy all of them in memory
+            names = iter(activities)
+            while True:
+                chunk = list(islice(names, NAMES_PER_CHUNK))
+                if not chunk:
+                    break
+                _dump(chunk, tmp)
+            weights = iter(activities.values())
+            while True:
+                chunk = array('d', islice(weights, NAMES_PER_CHUNK))
+                if not chunk:
+                    break
+                chunk.tofile(tmp)
+        os.replace(tmp_name, target)
+    except (OSError, OverflowError, TypeError):
+        # or a weight a double can't hold, not worth a cache
+        os.unlink(tmp_name)
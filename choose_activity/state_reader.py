@@ -0,0 +1,180 @@
+"""Read the state file a piece at a time.
+
+`json.loads` needs the whole text of the file, and keeps it in memory
+together with the parsed objects. Here the file is read in chunks and
+every activity goes straight into its container, so the memory needed
+is the one of the activities plus a chunk.
+"""
+import json
+import re
+from typing import Any, Dict, IO, MutableMapping, Optional
+
+CHUNK_SIZE = 1 << 16
+
+_NUMBER_CHARS = '0123456789+-.eE'
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# an activity written by json.dumps, followed by the comma or brace
+# closing it, so a number cut at the end of the chunk does not match
+_ENTRY = re.compile(
+    r'[ \t\n\r]*"((?:[^"\\]|\\.)*)"[ \t\n\r]*:[ \t\n\r]*'
+    r'(-?\d+)((?:\.\d+)?(?:[eE][-+]?\d+)?)[ \t\n\r]*([,}])')
+
+
+class _ChunkReader:
+    """The text of a file, read a chunk at a time and parsed by token."""
+
+    def __init__(self, f: IO[str], chunk_size: int = CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self) -> bool:
+        """Read another chunk, dropping what was parsed already."""
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.text = self.text[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """The next character that is not a space, empty at the end."""
+        while True:
+            self.pos = _WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text) or not self.fill():
+                return self.text[self.pos:self.pos + 1]
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(
+                f'Expected {char!r} at {self.text[self.pos:self.pos + 20]!r}')
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Parse the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # a value touching the end of the chunk, or a number followed
+            # by what is left of it, may continue in the next chunk
+            if (end < len(self.text)
+                    and self.text[end] not in _NUMBER_CHARS
+                    or not self.fill()):
+                self.pos = end
+                return obj
+
+    def entries(self, target: MutableMapping[str, float]) -> None:
+        """Parse an object of numbers into the target, one at a time."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            match = _ENTRY.match(self.text, self.pos)
+            if match is None and not self.eof and (
+                    len(self.text) - self.pos < self.chunk_size):
+                # maybe cut by the end of the chunk
+                self.fill()
+                continue
+            if match is not None:
+                name, integer, fraction, closing = match.groups()
+                if '\\' in name:
+                    name = json.loads(f'"{name}"')
+                # the same types json.loads would give
+                target[name] = (
+                    float(integer + fraction) if fraction else int(integer))
+                self.pos = match.end()
+            else:
+                # written differently, like Infinity or a string weight
+                name = self.value()
+                if not isinstance(name, str):
+                    raise ValueError(f'Invalid activity name {name!r}')
+                self.expect(':')
+                target[name] = self.value()
+                closing = self.peek()
+                self.pos += 1
+            if closing == '}':
+                return
+            if closing != ',':
+                raise ValueError(f'Unexpected {closing!r} after {name!r}')
+
+
+def read_version(f: IO[str]) -> Optional[int]:
+    """The version of a state file, if it's the first of its fields.
+
+    Only the start of the file is read. The older files have it after
+    the activities, for them it's None.
+    """
+    reader = _ChunkReader(f, chunk_size=256)
+    try:
+        reader.expect('{')
+        if reader.peek() == '"' and reader.value() == 'version':
+            reader.expect(':')
+            version = reader.value()
+            if isinstance(version, int):
+                return version
+    except ValueError:
+        pass
+    return None
+
+
+def read_state_file(
+        f: IO[str],
+        activities: MutableMapping[str, float],
+        chunk_size: int = CHUNK_SIZE,
+) -> Dict[str, Any]:
+    """Parse a state file, putting the activities in a given container.
+
+    Parameters
+    ----------
+    f : IO[str]
+        The state file, as written by `helpers.save_state`
+    activities : MutableMapping[str, float]
+        Where to put the activities and their weight
+    chunk_size : int
+        How many characters to read at a time
+
+    Returns
+    -------
+    Dict[str, Any]
+        The other fields of the file, as `json.load` would parse them
+
+    Raises
+    ------
+    ValueError
+        If the file is not valid JSON or has no activities
+    """
+    reader = _ChunkReader(f, chunk_size)
+    fields = {}
+    found_activities = False
+    reader.expect('{')
+    if reader.peek() == '}':
+        reader.pos += 1
+    else:
+        while True:
+            key = reader.value()
+            reader.expect(':')
+            if key == 'activities':
+                reader.entries(activities)
+                found_activities = True
+            else:
+                fields[key] = reader.value()
+            if reader.peek() == '}':
+                reader.pos += 1
+                break
+            reader.expect(',')
+    if reader.peek():
+        raise ValueError('Extra data after the state')
+    if not found_activities:
+        raise ValueError('The state has no activities')
+    return fields
@@ -0,0 +1,204 @@
+"""Per-activity statistics over the outcome log.
+
+The statistics are computed in a single pass over the log and cached
+together with the size of the log they cover, so that later runs only
+read the lines appended since.
+
+Their size does not depend on the number of outcomes: the durations are
+summed, and counted in a histogram whose buckets grow geometrically, from
+which the median is estimated.
+"""
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+import json
+from math import floor, log
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+from choose_activity.locking import write_atomically
+
+# each bucket of the histogram of the durations is this much wider than
+# the previous one, so the median is estimated within about 2.5%, and an
+# activity lasting from a second to a year fills less than 400 of them
+BUCKET_RATIO = 1.05
+
+
+def duration_bucket(seconds: float) -> int:
+    """The bucket of the histogram counting a duration, in seconds."""
+    # the ones shorter than a second all go to the first bucket
+    return floor(log(max(seconds, 1.0), BUCKET_RATIO))
+
+
+def _bucket_value(bucket: int) -> float:
+    """The duration representing a bucket, in the middle of it."""
+    return BUCKET_RATIO ** (bucket + 0.5)
+
+
+@dataclass
+class ActivityStats:
+    """Aggregated outcomes of an activity.
+
+    The time spent is counted only for the outcomes marked as done.
+    """
+
+    done: int = 0
+    skipped: int = 0
+    # seconds between start and end of the outcomes done
+    total_time: float = 0.0
+    # how many outcomes done lasted a duration in each bucket
+    histogram: Dict[int, int] = field(default_factory=dict)
+    last_done: Optional[datetime] = None
+
+    @property
+    def done_rate(self) -> float:
+        return self.done / (self.done + self.skipped)
+
+    @property
+    def median_time(self) -> Optional[float]:
+        """The median time spent, estimated from the histogram.
+
+        The estimate is capped by the total time, since at least half of
+        the outcomes lasted the median or more: the durations shorter
+        than a second share a bucket and would be rounded up otherwise.
+        """
+        if not self.histogram:
+            return None
+        count = sum(self.histogram.values())
+        estimate = (self._nth_time((count - 1) // 2)
+                    + self._nth_time(count // 2)) / 2
+        return min(estimate, self.total_time / ((count + 1) // 2))
+
+    def _nth_time(self, position: int) -> float:
+        """The time spent on the outcome done at a position, by time."""
+        seen = 0
+        for bucket in sorted(self.histogram):
+            seen += self.histogram[bucket]
+            if seen > position:
+                return _bucket_value(bucket)
+        raise IndexError(position)
+
+    def _add_time(self, seconds: float) -> None:
+        self.total_time += seconds
+        bucket = duration_bucket(seconds)
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    def add(self, start_at: datetime, end_at: datetime, is_done: bool):
+        """Count an outcome of the activity."""
+        if not is_done:
+            self.skipped += 1
+            return
+        self.done += 1
+        self._add_time((end_at - start_at).total_seconds())
+        if self.last_done is None or end_at > self.last_done:
+            self.last_done = end_at
+
+    def merge(self, other: 'ActivityStats') -> None:
+        """Count the outcomes counted by other statistics too."""
+        self.done += other.done
+        self.skipped += other.skipped
+        self.total_time += other.total_time
+        for bucket, count in other.histogram.items():
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + count
+        if self.last_done is None or (
+                other.last_done is not None
+                and other.last_done > self.last_done):
+            self.last_done = other.last_done
+
+
+def stats_path(log_fname: Path) -> Path:
+    """The path of the statistics cache for a given log file."""
+    return Path(f'{log_fname}.stats')
+
+
+def stats_to_json(stats: Dict[str, ActivityStats]) -> Dict[str, dict]:
+    """The statistics as objects that can be serialized to JSON."""
+    raw_stats = {}
+    for activity, activity_stats in stats.items():
+        raw_stats[activity] = asdict(activity_stats)
+        # JSON would turn the buckets into strings
+        raw_stats[activity]['histogram'] = sorted(
+            activity_stats.histogram.items())
+        if activity_stats.last_done is not None:
+            raw_stats[activity]['last_done'] = (
+                activity_stats.last_done.isoformat())
+    return raw_stats
+
+
+def stats_from_json(raw_stats: Dict[str, dict]) -> Dict[str, ActivityStats]:
+    """The statistics from the output of `stats_to_json`."""
+    stats = {}
+    for activity, raw_activity_stats in raw_stats.items():
+        raw_activity_stats = dict(raw_activity_stats)
+        if raw_activity_stats['last_done'] is not None:
+            raw_activity_stats['last_done'] = datetime.fromisoformat(
+                raw_activity_stats['last_done'])
+        raw_activity_stats['histogram'] = dict(
+            raw_activity_stats['histogram'])
+        stats[activity] = ActivityStats(**raw_activity_stats)
+    return stats
+
+
+def _read_cache(log_fname: Path):
+    """The cached log size and statistics, None if missing or corrupt."""
+    try:
+        with open(stats_path(log_fname), 'rb') as f:
+            raw_obj = json.loads(f.read())
+        return raw_obj['log_size'], stats_from_json(raw_obj['stats'])
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+
+def _write_cache(
+        log_fname: Path,
+        log_size: int,
+        stats: Dict[str, ActivityStats],
+) -> None:
+    # readers holding the lock of the log shared may write it too
+    write_atomically(stats_path(log_fname), json.dumps(dict(
+        log_size=log_size, stats=stats_to_json(stats))).encode())
+
+
+def activity_stats(log_fname: Path) -> Dict[str, ActivityStats]:
+    """Compute the statistics of every activity in the log.
+
+    Only the lines appended after the cached statistics are read, unless
+    the cache is missing, corrupt or the log was replaced.
+
+    Parameters
+    ----------
+    log_fname : Path
+        The log file path
+
+    Returns
+    -------
+    Dict[str, ActivityStats]
+        The statistics of each activity in the log
+    """
+    cached = _read_cache(log_fname)
+    try:
+        f = open(log_fname, 'rb')
+    except FileNotFoundError:
+        return {}
+    with f:
+        log_size = os.fstat(f.fileno()).st_size
+        if cached is None or cached[0] > log_size:
+            offset, stats = 0, {}
+        else:
+            offset, stats = cached
+        if offset == log_size:
+            return stats
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                # being written right now, it's read the next time
+                break
+            offset += len(line)
+            logm = json.loads(line)
+            stats.setdefault(logm['activity'], ActivityStats()).add(
+                datetime.fromisoformat(logm['start_at']),
+                datetime.fromisoformat(logm['end_at']),
+                logm['is_done'],
+            )
+    _write_cache(log_fname, offset, stats)
+    return stats
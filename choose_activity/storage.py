@@ -0,0 +1,422 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import replace
+from datetime import datetime, timezone
+from pathlib import Path
+import sqlite3
+from typing import Any, Dict, Iterator, List, Optional
+
+from choose_activity import helpers
+from choose_activity.compact import CompactActivities
+from choose_activity.helpers import (
+    ActivitiesState,
+    ActivityOutcome,
+    ConflictError,
+    apply_mutation,
+    check_mutation,
+    mutation_record,
+    refresh_state,
+)
+from choose_activity.locking import file_lock
+from choose_activity.outcome_range import outcomes_between
+from choose_activity.segments import read_manifest
+from choose_activity.stats import (
+    ActivityStats,
+    activity_stats,
+    duration_bucket,
+)
+
+
+class Storage(ABC):
+    """Where the activities state and the outcomes are persisted."""
+
+    @abstractmethod
+    def load_state(self) -> ActivitiesState:
+        """Load the state, an empty one if nothing was stored yet."""
+
+    @abstractmethod
+    def save_state(self, state: ActivitiesState) -> None:
+        """Store the whole state, replacing the previous one.
+
+        The version of the state is increased. `ConflictError` is raised,
+        and nothing stored, if the stored state was changed meanwhile.
+        """
+
+    def stored_version(self) -> int:
+        """The version of the stored state, to tell whether it changed."""
+        return self.load_state().version
+
+    @abstractmethod
+    def record_mutation(
+            self,
+            state: ActivitiesState,
+            op: str,
+            **fields: Any,
+    ) -> None:
+        """Apply a mutation to the state and persist it.
+
+        See `helpers.apply_mutation` for the possible mutations. If the
+        stored state was changed meanwhile the mutation is applied on top
+        of it, or `ConflictError` is raised if the two are incompatible.
+        """
+
+    @abstractmethod
+    def log_activity_result(self, outcome: ActivityOutcome) -> None:
+        """Store the outcome of an activity."""
+
+    def log_activity_results(self, outcomes: List[ActivityOutcome]) -> None:
+        """Store the outcomes of many activities, in order."""
+        for outcome in outcomes:
+            self.log_activity_result(outcome)
+
+    @abstractmethod
+    def latest_outcome_for_activity(self, activity: str) -> Optional[str]:
+        """The feedback of the latest outcome of an activity, if any."""
+
+    @abstractmethod
+    def activity_stats(self) -> Dict[str, ActivityStats]:
+        """The statistics of the outcomes of each activity."""
+
+    @abstractmethod
+    def outcomes_between(
+            self,
+            since: Optional[datetime] = None,
+            until: Optional[datetime] = None,
+    ) -> Iterator[ActivityOutcome]:
+        """The outcomes ended in a range of time, ordered by end time.
+
+        See `outcome_range.outcomes_between` for the range.
+        """
+
+    def close(self) -> None:
+        """Release the resources held by the storage, if any."""
+
+
+class FileStorage(Storage):
+    """The JSON state file with its journal, and the JSONL outcome log.
+
+    Parameters
+    ----------
+    state_fname : Path
+        Path of the state file
+    log_fname : Path
+        Path of the outcome log
+    compact : bool
+        Whether to load the activities in a `CompactActivities`
+    """
+
+    def __init__(
+            self,
+            state_fname: Path,
+            log_fname: Path,
+            compact: bool = False,
+    ):
+        self.state_fname = state_fname
+        self.log_fname = log_fname
+        self.compact = compact
+
+    def load_state(self) -> ActivitiesState:
+        return helpers.load_state(self.state_fname, self.compact)
+
+    def save_state(self, state: ActivitiesState) -> None:
+        helpers.save_state(self.state_fname, state)
+
+    def stored_version(self) -> int:
+        return helpers.stored_version(self.state_fname)
+
+    def record_mutation(
+            self,
+            state: ActivitiesState,
+            op: str,
+            **fields: Any,
+    ) -> None:
+        helpers.record_mutation(self.state_fname, state, op, **fields)
+
+    def log_activity_result(self, outcome: ActivityOutcome) -> None:
+        helpers.log_activity_result(self.log_fname, outcome)
+
+    def log_activity_results(self, outcomes: List[ActivityOutcome]) -> None:
+        helpers.log_activity_results(self.log_fname, outcomes)
+
+    def latest_outcome_for_activity(self, activity: str) -> Optional[str]:
+        return helpers.latest_outcome_for_activity(self.log_fname, activity)
+
+    def activity_stats(self) -> Dict[str, ActivityStats]:
+        with file_lock(self.log_fname, exclusive=False):
+            # the rotated segments are summarized in the manifest
+            stats = read_manifest(self.log_fname).stats
+            for activity, active_stats in activity_stats(
+                    self.log_fname).items():
+                stats.setdefault(activity, ActivityStats()).merge(
+                    active_stats)
+        return stats
+
+    def outcomes_between(
+            self,
+            since: Optional[datetime] = None,
+            until: Optional[datetime] = None,
+    ) -> Iterator[ActivityOutcome]:
+        return outcomes_between(self.log_fname, since, until)
+
+
+# the seconds between start and end of an outcome, julianday keeps the
+# milliseconds
+_DURATION = 'ROUND((julianday(end_at) - julianday(start_at)) * 86400, 3)'
+
+
+def _utc_iso(moment: datetime) -> str:
+    """ISO 8601 in UTC, so that the text order is the time order."""
+    return moment.astimezone(timezone.utc).isoformat()
+
+
+class SQLiteStorage(Storage):
+    """A SQLite database in WAL mode, holding both state and outcomes.
+
+    Activities are keyed by name and outcomes are indexed by activity and
+    end time, so no operation needs to read all the data. Times of the
+    outcomes are stored in UTC. Every change is a transaction, so many
+    processes can use the same database.
+
+    Parameters
+    ----------
+    db_fname : Path
+        Path of the database, created if missing
+    compact : bool
+        Whether to load the activities in a `CompactActivities`
+    """
+
+    def __init__(self, db_fname: Path, compact: bool = False):
+        self.db_fname = db_fname
+        self.compact = compact
+        # transactions are handled explicitly by _transaction, and the
+        # connection may be closed by another thread than its user, see
+        # AsyncStorage
+        self.conn = sqlite3.connect(
+            str(db_fname), isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        # WAL makes it safe to not sync at every commit
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.create_function(
+            'duration_bucket', 1, duration_bucket, deterministic=True)
+        self.conn.executescript('''
+            BEGIN;
+            CREATE TABLE IF NOT EXISTS activities (
+                name TEXT PRIMARY KEY,
+                weight REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS current_activity (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                activity TEXT,
+                start_at TEXT,
+                version INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS outcomes (
+                id INTEGER PRIMARY KEY,
+                activity TEXT NOT NULL,
+                start_at TEXT NOT NULL,
+                end_at TEXT NOT NULL,
+                is_done INTEGER NOT NULL,
+                feedback TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS outcomes_activity_end_at
+                ON outcomes (activity, end_at);
+            CREATE INDEX IF NOT EXISTS outcomes_end_at
+                ON outcomes (end_at);
+            COMMIT;
+        ''')
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        """A write transaction, holding the database lock from the start."""
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.conn.execute('COMMIT')
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def load_state(self) -> ActivitiesState:
+        # the rowid keeps the insertion order, like a dictionary
+        rows = self.conn.execute(
+            'SELECT name, weight FROM activities ORDER BY rowid')
+        activities = CompactActivities(rows) if self.compact else dict(rows)
+        state = ActivitiesState(activities)
+        row = self.conn.execute(
+            'SELECT activity, start_at, version FROM current_activity'
+        ).fetchone()
+        if row is None:
+            return state
+        if row[0] is not None:
+            state.current_activity = row[0]
+            state.current_activity_start = datetime.fromisoformat(row[1])
+        state.version = row[2]
+        return state
+
+    def stored_version(self) -> int:
+        row = self.conn.execute(
+            'SELECT version FROM current_activity').fetchone()
+        return 0 if row is None else row[0]
+
+    def _write_current(self, state: ActivitiesState) -> None:
+        start_at = None
+        if state.current_activity_start is not None:
+            start_at = state.current_activity_start.isoformat()
+        self.conn.execute(
+            'INSERT OR REPLACE INTO current_activity VALUES (0, ?, ?, ?)',
+            (state.current_activity, start_at, state.version))
+
+    def _write_state(self, state: ActivitiesState) -> None:
+        self.conn.execute('DELETE FROM activities')
+        self.conn.executemany(
+            'INSERT INTO activities VALUES (?, ?)',
+            state.activities.items())
+        self._write_current(state)
+
+    def save_state(self, state: ActivitiesState) -> None:
+        with self._transaction():
+            if self.stored_version() != state.version:
+                raise ConflictError('The state was changed meanwhile')
+            state.version += 1
+            self._write_state(state)
+
+    def record_mutation(
+            self,
+            state: ActivitiesState,
+            op: str,
+            **fields: Any,
+    ) -> None:
+        record = mutation_record(op, **fields)
+        with self._transaction():
+            if self.stored_version() != state.version:
+                seen = replace(state, activities=dict(state.activities))
+                refresh_state(state, self.load_state())
+                check_mutation(seen, state, record)
+            apply_mutation(state, record)
+            if op in ('add', 'reweight'):
+                # an upsert keeps the position of an existing activity
+                self.conn.execute(
+                    'INSERT INTO activities VALUES (?, ?) ON CONFLICT (name)'
+                    ' DO UPDATE SET weight = excluded.weight',
+                    (record['activity'], record['weight']))
+            elif op == 'delete':
+                self.conn.execute(
+                    'DELETE FROM activities WHERE name = ?',
+                    (record['activity'],))
+            # the version is there, so it changes at every mutation
+            self._write_current(state)
+
+    def _insert_outcomes(self, outcomes) -> None:
+        self.conn.executemany(
+            'INSERT INTO outcomes'
+            ' (activity, start_at, end_at, is_done, feedback)'
+            ' VALUES (?, ?, ?, ?, ?)',
+            ((
+                o.activity,
+                _utc_iso(o.start_at),
+                _utc_iso(o.end_at),
+                o.is_done,
+                o.feedback,
+            ) for o in outcomes))
+
+    def log_activity_result(self, outcome: ActivityOutcome) -> None:
+        self.log_activity_results([outcome])
+
+    def log_activity_results(self, outcomes: List[ActivityOutcome]) -> None:
+        with self._transaction():
+            self._insert_outcomes(outcomes)
+
+    def latest_outcome_for_activity(self, activity: str) -> Optional[str]:
+        row = self.conn.execute(
+            'SELECT feedback FROM outcomes WHERE activity = ?'
+            ' ORDER BY end_at DESC, id DESC LIMIT 1',
+            (activity,)).fetchone()
+        return None if row is None else row[0]
+
+    def activity_stats(self) -> Dict[str, ActivityStats]:
+        # aggregated by the database, a row per activity comes back and
+        # one per bucket of the durations
+        stats = {}
+        rows = self.conn.execute(f'''
+            SELECT activity, SUM(is_done), SUM(NOT is_done),
+                SUM(CASE WHEN is_done THEN {_DURATION} ELSE 0 END),
+                MAX(CASE WHEN is_done THEN end_at END)
+            FROM outcomes GROUP BY activity
+        ''')
+        for activity, done, skipped, total_time, last_done in rows:
+            stats[activity] = ActivityStats(
+                done=done,
+                skipped=skipped,
+                total_time=total_time,
+                last_done=(
+                    None if last_done is None
+                    else datetime.fromisoformat(last_done)),
+            )
+        rows = self.conn.execute(f'''
+            SELECT activity, duration_bucket({_DURATION}) AS bucket, COUNT(*)
+            FROM outcomes WHERE is_done GROUP BY activity, bucket
+        ''')
+        for activity, bucket, count in rows:
+            stats[activity].histogram[bucket] = count
+        return stats
+
+    def outcomes_between(
+            self,
+            since: Optional[datetime] = None,
+            until: Optional[datetime] = None,
+    ) -> Iterator[ActivityOutcome]:
+        conditions, params = [], []
+        if since is not None:
+            conditions.append('end_at >= ?')
+            params.append(_utc_iso(since))
+        if until is not None:
+            conditions.append('end_at < ?')
+            params.append(_utc_iso(until))
+        where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+        for activity, start_at, end_at, is_done, feedback in self.conn.execute(
+                'SELECT activity, start_at, end_at, is_done, feedback'
+                f' FROM outcomes{where} ORDER BY end_at, id', params):
+            yield ActivityOutcome(
+                activity=activity,
+                start_at=datetime.fromisoformat(start_at),
+                end_at=datetime.fromisoformat(end_at),
+                is_done=bool(is_done),
+                feedback=feedback,
+            )
+
+
+def migrate_to_sqlite(
+        state_fname: Path,
+        log_fname: Path,
+        db_fname: Path,
+) -> SQLiteStorage:
+    """Copy the state and outcomes from the files to a new database.
+
+    The files are left untouched.
+
+    Parameters
+    ----------
+    state_fname : Path
+        Path of the state file
+    log_fname : Path
+        Path of the outcome log
+    db_fname : Path
+        Path of the database to create, must not exist
+
+    Returns
+    -------
+    SQLiteStorage
+        The storage of the new database
+    """
+    if db_fname.exists():
+        raise FileExistsError(f'The database {db_fname} already exists')
+    storage = SQLiteStorage(db_fname)
+    with storage._transaction():
+        storage._write_state(helpers.load_state(state_fname))
+    with storage._transaction():
+        # the rotated segments too
+        storage._insert_outcomes(outcomes_between(log_fname))
+    return storage
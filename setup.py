@@ -12,6 +12,10 @@ setup(
         'dev': [
             'pytest>=5',
             'pytest-cov>=2.8.1'
+            ],
+        # optional, makes the bulk sampling of the simulation faster
+        'numpy': [
+            'numpy>=1.17'
             ]
         },
     packages=['choose_activity'],
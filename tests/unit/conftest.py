@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from choose_activity.helpers import ActivityOutcome
+
+START = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def outcome():
+    """Build an outcome ending the given minutes after `START`.
+
+    The fields that are not given depend on the minutes: three
+    activities take turns, every other outcome is done and every
+    feedback is different.
+    """
+    def build(
+            minutes=0,
+            activity=None,
+            feedback=None,
+            is_done=None,
+            duration=5,
+            zone=timezone.utc,
+    ):
+        end_at = (START + timedelta(minutes=minutes)).astimezone(zone)
+        return ActivityOutcome(
+            activity=(
+                f'activity {minutes % 3}' if activity is None else activity),
+            start_at=end_at - timedelta(minutes=duration),
+            end_at=end_at,
+            is_done=minutes % 2 == 0 if is_done is None else is_done,
+            feedback=f'feedback {minutes}' if feedback is None else feedback,
+        )
+    return build
+
+
+@pytest.fixture
+def start():
+    """The moment the outcomes built by `outcome` are relative to."""
+    return START
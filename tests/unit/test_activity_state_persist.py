@@ -2,7 +2,11 @@ from datetime import datetime
 from pathlib import Path
 from random import choice
 
+import pytest
+
+import choose_activity.helpers as helpers
 from choose_activity.helpers import load_state, save_state, ActivitiesState
+from choose_activity.helpers import ConflictError, record_mutation
 
 
 def test_activities_state():
@@ -53,3 +57,38 @@ def test_save_back(tmp_path):
 
     assert loaded == state
 
+
+
+def test_load_missing_leaves_no_lock(tmp_path):
+    assert load_state(tmp_path / 'missing.dat').activities == {}
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_save_conflict(tmp_path):
+    test_path = tmp_path / 'activities_state.dat'
+    save_state(test_path, ActivitiesState({'a': 1.0}))
+    state = load_state(test_path)
+    record_mutation(test_path, load_state(test_path), 'add',
+                    activity='b', weight=2.0)
+    state.activities['c'] = 3.0
+    with pytest.raises(ConflictError):
+        save_state(test_path, state)
+    assert load_state(test_path).activities == {'a': 1.0, 'b': 2.0}
+    # a new state can't replace a stored one either
+    with pytest.raises(ConflictError):
+        save_state(test_path, ActivitiesState({}))
+
+
+def test_save_does_not_parse_the_state(tmp_path, monkeypatch):
+    test_path = tmp_path / 'activities_state.dat'
+    state = ActivitiesState({'a': 1.0})
+    save_state(test_path, state)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('the state was parsed')
+
+    monkeypatch.setattr(helpers, '_read_state', fail)
+    save_state(test_path, state)
+    record_mutation(test_path, state, 'add', activity='b', weight=2.0)
+    save_state(test_path, state)
+    assert state.version == 4
@@ -0,0 +1,37 @@
+from collections import Counter
+
+from choose_activity.sampling import AliasSampler
+
+
+def test_empty_sampler():
+    assert AliasSampler({}).choice() is None
+    assert len(AliasSampler({})) == 0
+
+
+def test_alias_distribution():
+    weights = {
+        'choice a': 1.0,
+        'choice b': 6.0,
+        'choice c': 0.2,
+        'choice d': 3.0,
+    }
+    sampler = AliasSampler(weights)
+    SAMPLE_SIZE = 20000
+    c = Counter(sampler.choice() for _ in range(SAMPLE_SIZE))
+    total = sum(weights.values())
+    for k, w in weights.items():
+        assert abs(c[k] / SAMPLE_SIZE - w / total) < 0.02
+
+
+def test_alias_extremes():
+    sampler = AliasSampler({'a': 1.0, 'b': 3.0})
+    # the draw is deterministic given the random value
+    assert sampler.choice(lambda: 0.0) == 'a'
+    assert sampler.choice(lambda: 0.3) == 'b'
+    assert sampler.choice(lambda: 0.9999999999999999) == 'b'
+
+
+def test_zero_weights():
+    assert AliasSampler({'a': 0.0, 'b': 0.0}).choice() is None
+    sampler = AliasSampler({'a': 0.0, 'b': 1.0, 'c': 0.0})
+    assert {sampler.choice() for _ in range(100)} == {'b'}
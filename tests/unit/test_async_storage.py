@@ -0,0 +1,90 @@
+import asyncio
+import threading
+
+import pytest
+
+from choose_activity.async_storage import AsyncStorage
+from choose_activity.helpers import ActivitiesState
+from choose_activity.storage import FileStorage, SQLiteStorage
+
+
+class CountingStorage(FileStorage):
+    """Count the loads, blocking them until released."""
+
+    loads = 0
+    release = None
+
+    def load_state(self):
+        CountingStorage.loads += 1
+        CountingStorage.release.wait(5)
+        return super().load_state()
+
+
+@pytest.fixture(params=['file', 'sqlite'])
+def open_storage(request, tmp_path):
+    if request.param == 'file':
+        return lambda: FileStorage(tmp_path / 'state', tmp_path / 'log')
+    return lambda: SQLiteStorage(tmp_path / 'db.sqlite3')
+
+
+def test_operations(open_storage, outcome):
+    async def run():
+        async with AsyncStorage(open_storage, max_workers=2) as storage:
+            state = await storage.load_state()
+            assert state.activities == {}
+            await storage.record_mutation(
+                state, 'add', activity='a', weight=1.0)
+            await storage.save_state(
+                ActivitiesState({'a': 1.0, 'b': 2.0}, version=state.version))
+            await asyncio.gather(*(
+                storage.log_activity_result(
+                    outcome(i, 'a', f'n{i}', is_done=True))
+                for i in range(10)))
+            state = await storage.load_state()
+            latest = await storage.latest_outcome_for_activity('a')
+            stats = await storage.activity_stats()
+        return state, latest, stats
+
+    state, latest, stats = asyncio.run(run())
+    assert state.activities == {'a': 1.0, 'b': 2.0}
+    assert latest == 'n9'
+    assert stats['a'].done == 10
+
+
+def test_concurrent_loads_are_coalesced(tmp_path):
+    CountingStorage.loads = 0
+    CountingStorage.release = threading.Event()
+
+    async def run():
+        async with AsyncStorage(
+                lambda: CountingStorage(tmp_path / 'state', tmp_path / 'log'),
+        ) as storage:
+            loads = [
+                asyncio.ensure_future(storage.load_state())
+                for _ in range(20)]
+            await asyncio.sleep(0.05)
+            CountingStorage.release.set()
+            states = await asyncio.gather(*loads)
+            # after the first load is done a new one is started
+            await storage.load_state()
+        return states
+
+    states = asyncio.run(run())
+    assert CountingStorage.loads == 2
+    assert len(states) == 20
+    # each caller can change its own state
+    states[0].activities['x'] = 1.0
+    assert 'x' not in states[1].activities
+
+
+def test_write_is_seen_by_later_reads(open_storage):
+    async def run():
+        async with AsyncStorage(open_storage) as storage:
+            state = await storage.load_state()
+            pending = asyncio.ensure_future(storage.load_state())
+            await storage.record_mutation(
+                state, 'add', activity='a', weight=1.0)
+            await pending
+            return await storage.load_state()
+
+    assert asyncio.run(run()).activities == {'a': 1.0}
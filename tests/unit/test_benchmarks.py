@@ -0,0 +1,51 @@
+import json
+
+from benchmarks.generate import activity_names, generate_log, generate_state
+from benchmarks.run import compare, format_report, percentile, run_benchmarks
+from choose_activity import segments
+from choose_activity.helpers import load_state
+from choose_activity.stats import activity_stats
+
+
+def test_generated_data(tmp_path):
+    names = activity_names(50, seed=1)
+    assert names == activity_names(50, seed=1)
+    assert len(set(names)) == 50
+    generate_state(tmp_path / 'state.json', names, seed=1)
+    assert list(load_state(tmp_path / 'state.json').activities) == names
+    generate_log(tmp_path / 'outcomes.log', names, 200, seed=1)
+    stats = activity_stats(tmp_path / 'outcomes.log')
+    assert sum(s.done + s.skipped for s in stats.values()) == 200
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([3.0], 90) == 3.0
+
+
+def test_log_is_not_rotated(monkeypatch):
+    def fail(log_fname):
+        raise AssertionError('the log was rotated')
+
+    monkeypatch.setattr(segments, 'SEGMENT_MAX_BYTES', 1000)
+    monkeypatch.setattr(segments, 'rotate', fail)
+    run_benchmarks([50], max_runs=3, max_seconds=0)
+    assert segments.SEGMENT_MAX_BYTES == 1000
+
+
+def test_run_and_compare():
+    report = run_benchmarks([20], max_runs=3, max_seconds=0)
+    json.dumps(report)
+    results = report['results']['20']
+    assert results['load_state']['runs'] == 3
+    assert results['load_state']['peak_kib'] > 0
+    assert 'weighted_choice' in format_report(report)
+
+    assert compare(report, report) == []
+    slower = json.loads(json.dumps(report))
+    slower['results']['20']['load_state']['p50_ms'] *= 2
+    regressions = compare(report, slower)
+    assert len(regressions) == 1
+    assert regressions[0].startswith('load_state at 20')
@@ -0,0 +1,182 @@
+from dataclasses import replace
+from datetime import timedelta, timezone
+
+import pytest
+
+from choose_activity import binary_log
+from choose_activity.binary_log import (
+    MAGIC,
+    BinaryLogWriter,
+    binary_to_log,
+    is_binary_log,
+    log_to_binary,
+    read_outcomes,
+)
+from choose_activity.helpers import (
+    ActivityOutcome,
+    latest_outcome_for_activity,
+    log_activity_results,
+)
+from choose_activity.outcome_range import outcomes_between
+from choose_activity.segments import rotate
+
+# the binary format keeps them
+MICROSECONDS = timedelta(microseconds=123456)
+
+
+@pytest.fixture
+def outcome(outcome):
+    """The shared outcomes, with names and feedback that are not ASCII.
+
+    Every fourth feedback is empty, and the moments have microseconds.
+    """
+    def build(minutes, zone=timezone.utc):
+        built = outcome(
+            minutes,
+            activity=f'activity ä {minutes % 3}',
+            feedback=f'feedback € {minutes}' if minutes % 4 else '',
+            zone=zone,
+        )
+        return replace(
+            built,
+            start_at=built.start_at + MICROSECONDS,
+            end_at=built.end_at + MICROSECONDS,
+        )
+    return build
+
+
+def test_round_trip(tmp_path, outcome, start):
+    path = tmp_path / 'outcomes.bin'
+    zones = [timezone.utc, timezone(timedelta(hours=-3, minutes=-30))]
+    outcomes = [outcome(m, zones[m % 2]) for m in range(20)]
+    moment = (start + MICROSECONDS).replace(tzinfo=None)
+    naive = ActivityOutcome('naive', moment, moment, True, '')
+    with BinaryLogWriter(path) as writer:
+        for o in outcomes + [naive]:
+            writer.write(o)
+    read = list(read_outcomes(path))
+    assert read == outcomes + [naive]
+    assert [o.end_at.utcoffset() for o in read[:2]] == [
+        timedelta(0), timedelta(hours=-3, minutes=-30)]
+    assert read[-1].end_at.tzinfo is None
+    assert is_binary_log(path)
+
+
+def test_names_written_once(tmp_path, outcome):
+    path = tmp_path / 'outcomes.bin'
+    with BinaryLogWriter(path) as writer:
+        writer.write(outcome(0))
+    size = path.stat().st_size
+    with BinaryLogWriter(path) as writer:
+        # the name is known from the file
+        assert writer.ids == {'activity ä 0': 0}
+        writer.write(outcome(0))
+    assert path.stat().st_size - size == size - len(MAGIC) - len(
+        b'Nxx' + 'activity ä 0'.encode())
+    assert [o.activity for o in read_outcomes(path)] == ['activity ä 0'] * 2
+
+
+def test_incomplete_record(tmp_path, outcome):
+    path = tmp_path / 'outcomes.bin'
+    with BinaryLogWriter(path) as writer:
+        writer.write(outcome(0))
+        writer.write(outcome(1))
+    with open(path, 'r+b') as f:
+        f.truncate(path.stat().st_size - 3)
+    assert list(read_outcomes(path)) == [outcome(0)]
+    with BinaryLogWriter(path) as writer:
+        writer.write(outcome(2))
+    assert list(read_outcomes(path)) == [outcome(0), outcome(2)]
+
+
+def test_not_binary(tmp_path, outcome):
+    path = tmp_path / 'activities.log'
+    log_activity_results(path, [outcome(0)])
+    assert not is_binary_log(path)
+    with pytest.raises(ValueError):
+        list(read_outcomes(path))
+
+
+def test_convert_log(tmp_path, outcome):
+    log_path = tmp_path / 'activities.log'
+    outcomes = [outcome(m) for m in range(100)]
+    log_activity_results(log_path, outcomes[:60])
+    rotate(log_path)
+    log_activity_results(log_path, outcomes[60:])
+    binary_path = tmp_path / 'outcomes.bin'
+    assert log_to_binary(log_path, binary_path) == 100
+    copy_path = tmp_path / 'copy.log'
+    assert binary_to_log(binary_path, copy_path) == 100
+    plain_path = tmp_path / 'plain.log'
+    log_activity_results(plain_path, outcomes)
+    # the same lines, the segments included
+    assert copy_path.read_bytes() == plain_path.read_bytes()
+    assert binary_path.stat().st_size * 2 < plain_path.stat().st_size
+    assert latest_outcome_for_activity(copy_path, 'activity ä 1') == \
+        'feedback € 97'
+
+
+def test_import_keeps_the_order(tmp_path, outcome):
+    log_path = tmp_path / 'activities.log'
+    log_activity_results(log_path, [outcome(m) for m in range(10)])
+    rotate(log_path)
+    log_activity_results(log_path, [outcome(10)])
+    content = log_path.read_bytes()
+
+    older_path = tmp_path / 'older.bin'
+    with BinaryLogWriter(older_path) as writer:
+        writer.write(outcome(11))
+        writer.write(outcome(12))
+        # not in the log, it can't be appended after the others
+        writer.write(replace(outcome(5), feedback='not logged'))
+    with pytest.raises(ValueError):
+        binary_to_log(older_path, log_path)
+    assert log_path.read_bytes() == content
+
+    # the latest outcome is in a segment, after a rotation
+    rotate(log_path)
+    with pytest.raises(ValueError):
+        binary_to_log(older_path, log_path)
+    newer_path = tmp_path / 'newer.bin'
+    with BinaryLogWriter(newer_path) as writer:
+        # ending together with the latest outcome of the log
+        writer.write(replace(outcome(10), feedback='not logged'))
+        for m in (11, 12):
+            writer.write(outcome(m, timezone(timedelta(hours=-5))))
+    assert binary_to_log(newer_path, log_path) == 3
+    assert len(log_path.read_bytes().splitlines()) == 3
+
+
+def test_import_skips_the_logged_outcomes(tmp_path, outcome):
+    log_path = tmp_path / 'activities.log'
+    log_activity_results(log_path, [outcome(m) for m in range(10)])
+    rotate(log_path)
+    log_activity_results(log_path, [outcome(m) for m in range(10, 15)])
+    binary_path = tmp_path / 'outcomes.bin'
+    log_to_binary(log_path, binary_path)
+    content = log_path.read_bytes()
+    assert binary_to_log(binary_path, log_path) == 0
+    assert log_path.read_bytes() == content
+
+    # the ones logged meanwhile are appended, the others skipped
+    with BinaryLogWriter(binary_path) as writer:
+        for m in range(15, 20):
+            writer.write(outcome(m))
+    assert binary_to_log(binary_path, log_path) == 5
+    assert [o.end_at for o in read_outcomes(binary_path)] == [
+        o.end_at for o in outcomes_between(log_path)]
+
+
+def test_writer_closes_a_file_not_binary(tmp_path, monkeypatch, outcome):
+    path = tmp_path / 'activities.log'
+    log_activity_results(path, [outcome(0)])
+    opened = []
+
+    def recording_open(*args):
+        opened.append(open(*args))
+        return opened[-1]
+
+    monkeypatch.setattr(binary_log, 'open', recording_open, raising=False)
+    with pytest.raises(ValueError):
+        BinaryLogWriter(path)
+    assert opened[0].closed
@@ -0,0 +1,51 @@
+from io import StringIO
+
+import pytest
+
+from choose_activity.bulk import (
+    guess_format,
+    read_activities,
+    write_activities,
+)
+
+
+def test_guess_format():
+    assert guess_format('activities.CSV') == 'csv'
+    assert guess_format('activities.jsonl') == 'jsonl'
+    assert guess_format('-') == 'jsonl'
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'jsonl'])
+def test_roundtrip(fmt):
+    activities = {'read, slowly': 1.5, '勉強': 2.0, 'with "quotes"': 3.0}
+    f = StringIO()
+    write_activities(f, activities, fmt)
+    f.seek(0)
+    assert dict(read_activities(f, fmt)) == activities
+
+
+def test_invalid():
+    with pytest.raises(ValueError) as excinfo:
+        content = StringIO('activity,weight\na,1\nb,heavy\n')
+        list(read_activities(content, 'csv'))
+    assert 'number 2' in str(excinfo.value)
+
+    for weight in ('-1', 'nan', 'inf'):
+        with pytest.raises(ValueError) as excinfo:
+            content = StringIO(f'{{"activity": "a", "weight": "{weight}"}}')
+            list(read_activities(content, 'jsonl'))
+        assert 'Invalid weight' in str(excinfo.value)
+
+    with pytest.raises(ValueError) as excinfo:
+        list(read_activities(StringIO(''), 'xml'))
+    assert 'Unknown format' in str(excinfo.value)
+
+
+def test_streaming():
+    def lines():
+        yield '{"activity": "a", "weight": 1}\n'
+        yield '\n'
+        raise AssertionError('read too far')
+
+    activities = read_activities(lines(), 'jsonl')
+    assert next(activities) == ('a', 1.0)
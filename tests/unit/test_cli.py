@@ -0,0 +1,262 @@
+import pytest
+
+import choose_activity.__main__ as cli
+from choose_activity.compact import CompactActivities
+from choose_activity.helpers import ActivitiesState, load_state, save_state
+
+
+@pytest.fixture
+def state_path(tmp_path, monkeypatch):
+    path = tmp_path / 'activities_state.dat'
+    monkeypatch.setattr(cli, 'ACTIVITIES_STATE_FILE_PATH', path)
+    monkeypatch.setattr(
+        cli, 'ACTIVITIES_LOG_FILE_PATH', tmp_path / 'activities.log')
+    monkeypatch.setattr(
+        cli, 'ACTIVITIES_DB_FILE_PATH', tmp_path / 'activities.sqlite3')
+    monkeypatch.setattr(cli, 'DAEMON_SOCKET_PATH', tmp_path / 'daemon.sock')
+    monkeypatch.delenv(cli.STORAGE_ENV_VAR, raising=False)
+    monkeypatch.delenv(cli.COMPACT_ENV_VAR, raising=False)
+    save_state(path, ActivitiesState({'a': 1.0, 'b': 2.0, 'c': 3.0}))
+    return path
+
+
+def test_plan(state_path, capsys):
+    cli.main(['plan', '2'])
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith('1) ')
+    assert lines[1].startswith('2) ')
+
+
+def test_plan_empty(state_path, capsys):
+    state = load_state(state_path)
+    state.activities.clear()
+    save_state(state_path, state)
+    cli.main(['plan', '2'])
+    assert 'no activities' in capsys.readouterr().out
+
+
+def test_plan_zero_weights(state_path, capsys):
+    cli.main(['add', 'never', '0'])
+    capsys.readouterr()
+    cli.main(['plan', '5'])
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 3
+    assert not any(line.endswith('never') for line in lines)
+
+
+def test_simulate(state_path, capsys):
+    cli.main(['simulate', '-n', '3000', '--seed', '1'])
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 4
+    assert lines[1].endswith('  a')
+    assert lines[1].split()[0] == '16.67%'
+
+
+def test_simulate_zero_weights(state_path, capsys):
+    save_state(state_path, ActivitiesState(
+        {'a': 0.0, 'b': 0.0}, version=load_state(state_path).version))
+    cli.main(['simulate', '-n', '10'])
+    assert 'All the weights are 0' in capsys.readouterr().out
+
+
+def test_interactive_add_and_start(state_path, monkeypatch):
+    answers = ['1', 'new one', '2.5']
+    monkeypatch.setattr('builtins.input', lambda *args: answers.pop(0))
+    cli.main([])
+    assert load_state(state_path).activities['new one'] == 2.5
+
+    answers = ['4']
+    cli.main([])
+    started = load_state(state_path)
+    assert started.current_activity in started.activities
+
+    answers = ['n', '1', 'great', 'y']
+    cli.main([])
+    finished = load_state(state_path)
+    assert finished.current_activity is None
+    assert started.current_activity not in finished.activities
+
+
+def test_migrate_and_use_sqlite(state_path, monkeypatch, capsys):
+    cli.main(['migrate-sqlite'])
+    assert 'Migrated' in capsys.readouterr().out
+    cli.main(['migrate-sqlite'])
+    assert 'already exists' in capsys.readouterr().out
+
+    monkeypatch.setenv(cli.STORAGE_ENV_VAR, 'sqlite')
+    answers = ['1', 'only in the db', '2.5']
+    monkeypatch.setattr('builtins.input', lambda *args: answers.pop(0))
+    cli.main([])
+    assert 'only in the db' not in load_state(state_path).activities
+    cli.main(['plan', '4'])
+    assert 'only in the db' in capsys.readouterr().out
+
+
+def test_client_without_daemon(state_path, capsys):
+    cli.main(['client', 'add', 'something', '2'])
+    assert 'not running' in capsys.readouterr().out
+
+
+def test_activity_commands(state_path, capsys):
+    cli.main(['add', 'new one', '2.5'])
+    cli.main(['reweight', 'a', '7'])
+    cli.main(['delete', 'b'])
+    cli.main(['delete', 'not there'])
+    assert 'Unknown activity' in capsys.readouterr().out
+    assert load_state(state_path).activities == {
+        'a': 7.0, 'c': 3.0, 'new one': 2.5}
+
+    cli.main(['finish', 'done'])
+    assert 'No activity is going on' in capsys.readouterr().out
+    cli.main(['pick'])
+    picked = load_state(state_path).current_activity
+    assert picked in capsys.readouterr().out
+    cli.main(['pick'])
+    assert 'finish it first' in capsys.readouterr().out
+    cli.main(['finish', 'done', '-m', 'so good', '--delete'])
+    state = load_state(state_path)
+    assert state.current_activity is None
+    assert picked not in state.activities
+
+    cli.main(['add', picked, '1'])
+    capsys.readouterr()
+    while load_state(state_path).current_activity != picked:
+        cli.main(['finish', 'skipped'])
+        cli.main(['pick'])
+    assert 'The latest outcome was: so good' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('weight', ['-1', 'nan', 'inf', 'heavy'])
+def test_invalid_weight(state_path, capsys, weight):
+    with pytest.raises(SystemExit):
+        cli.main(['add', 'x', weight])
+    assert f'Invalid weight {weight!r}' in capsys.readouterr().err
+    with pytest.raises(SystemExit):
+        cli.main(['reweight', 'a', weight])
+    assert load_state(state_path).activities == {'a': 1.0, 'b': 2.0, 'c': 3.0}
+
+
+def test_compact_env_var(state_path, capsys, monkeypatch):
+    monkeypatch.setenv(cli.COMPACT_ENV_VAR, '1')
+    storage = cli.open_storage()
+    assert isinstance(storage.load_state().activities, CompactActivities)
+    cli.main(['delete', 'b'])
+    cli.main(['pick'])
+    picked = load_state(state_path).current_activity
+    assert picked in ('a', 'c')
+    assert picked in capsys.readouterr().out
+
+
+def test_import_export(state_path, tmp_path, capsys):
+    csv_path = tmp_path / 'activities.csv'
+    csv_path.write_text('activity,weight\nd,4\n"with, comma",5.5\na,10\n')
+    cli.main(['import', str(csv_path)])
+    assert 'Imported 3 activities' in capsys.readouterr().out
+    assert load_state(state_path).activities == {
+        'a': 10.0, 'b': 2.0, 'c': 3.0, 'd': 4.0, 'with, comma': 5.5}
+
+    jsonl_path = tmp_path / 'activities.jsonl'
+    cli.main(['export', str(jsonl_path)])
+    cli.main(['import', '--replace', str(csv_path)])
+    assert list(load_state(state_path).activities) == [
+        'd', 'with, comma', 'a']
+    cli.main(['import', str(jsonl_path)])
+    assert len(load_state(state_path).activities) == 5
+
+    capsys.readouterr()
+    cli.main(['export', '--format', 'csv'])
+    out = capsys.readouterr().out
+    assert out.splitlines()[0] == 'activity,weight'
+    assert '"with, comma",5.5' in out
+
+
+def test_invalid_import(state_path, tmp_path, capsys):
+    jsonl_path = tmp_path / 'activities.jsonl'
+    jsonl_path.write_text('{"activity": "x", "weight": 1}\n{"activity": 3}\n')
+    cli.main(['import', str(jsonl_path)])
+    assert 'Invalid activity number 2' in capsys.readouterr().out
+    assert 'x' not in load_state(state_path).activities
+
+    csv_path = tmp_path / 'activities.csv'
+    csv_path.write_text('activity,weight\nx,1\ny,inf\n')
+    cli.main(['import', str(csv_path)])
+    assert 'Invalid activity number 2' in capsys.readouterr().out
+    assert 'x' not in load_state(state_path).activities
+
+
+def test_stats(state_path, capsys):
+    cli.main(['stats'])
+    assert 'No outcome stored yet' in capsys.readouterr().out
+    cli.main(['pick'])
+    cli.main(['finish', 'done'])
+    capsys.readouterr()
+    cli.main(['stats'])
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 2
+    assert lines[1].split()[:3] == ['1', '0', '100%']
+
+
+@pytest.mark.parametrize('storage', ['file', 'sqlite'])
+def test_history(state_path, capsys, monkeypatch, storage):
+    if storage == 'sqlite':
+        cli.main(['migrate-sqlite'])
+        monkeypatch.setenv(cli.STORAGE_ENV_VAR, 'sqlite')
+    cli.main(['history'])
+    assert 'No outcome' in capsys.readouterr().out
+    cli.main(['pick'])
+    cli.main(['finish', 'done', '-m', 'great'])
+    capsys.readouterr()
+    cli.main(['history', '--days', '1'])
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1
+    assert lines[0].endswith(': great')
+    assert ' done ' in lines[0]
+    cli.main(['history', '--until', '2000-01-01'])
+    assert 'No outcome' in capsys.readouterr().out
+    cli.main(['history', '--since', '2000-01-01T10:00'])
+    assert len(capsys.readouterr().out.splitlines()) == 1
+
+
+def test_profile(state_path, capsys, tmp_path):
+    trace_path = tmp_path / 'trace.json'
+    dump_path = tmp_path / 'profile.prof'
+    cli.main([
+        '--profile',
+        '--profile-trace', str(trace_path),
+        '--profile-dump', str(dump_path),
+        'plan', '2',
+    ])
+    err = capsys.readouterr().err
+    assert 'load_state' in err
+    assert 'weighted_sample' in err
+    assert trace_path.exists()
+    assert dump_path.exists()
+    assert cli.weighted_sample.__name__ == 'weighted_sample'
+    assert not hasattr(cli.weighted_sample, '__wrapped__')
+
+
+def test_profile_env_var(state_path, capsys, monkeypatch):
+    monkeypatch.setenv(cli.PROFILE_ENV_VAR, '1')
+    cli.main(['plan', '1'])
+    assert 'total' in capsys.readouterr().err
+
+
+def test_export_import_log(state_path, capsys, tmp_path):
+    cli.main(['pick'])
+    cli.main(['finish', 'done', '-m', 'great'])
+    binary_path = tmp_path / 'outcomes.bin'
+    cli.main(['export-log', str(binary_path)])
+    assert 'Exported 1 outcomes' in capsys.readouterr().out
+    # it's already in the log
+    cli.main(['import-log', str(binary_path)])
+    assert 'Imported 0 outcomes' in capsys.readouterr().out
+    cli.main(['history'])
+    assert len(capsys.readouterr().out.splitlines()) == 1
+
+    text_path = tmp_path / 'outcomes.txt'
+    text_path.write_text('not binary')
+    cli.main(['export-log', str(text_path)])
+    assert 'nothing was exported' in capsys.readouterr().out
+    cli.main(['import-log', str(text_path)])
+    assert 'nothing was imported' in capsys.readouterr().out
@@ -0,0 +1,102 @@
+from random import Random
+import tracemalloc
+
+from choose_activity.compact import CompactActivities
+from choose_activity.helpers import (
+    ActivitiesState,
+    load_state,
+    record_mutation,
+    save_state,
+    weighted_choice,
+)
+
+
+def test_behaves_like_a_dict():
+    rng = Random(42)
+    expected = {}
+    activities = CompactActivities()
+    for _ in range(5000):
+        name = f'activity {rng.randrange(500)}'
+        if rng.random() < 0.4:
+            assert expected.pop(name, None) == activities.pop(name, None)
+        else:
+            weight = rng.random()
+            expected[name] = weight
+            activities[name] = weight
+        assert (name in expected) == (name in activities)
+    assert len(activities) == len(expected)
+    assert list(activities.items()) == list(expected.items())
+    assert list(activities.values()) == list(expected.values())
+    assert activities == expected
+    assert CompactActivities(expected) == expected
+
+
+def test_missing():
+    activities = CompactActivities({'a': 1.0})
+    assert activities.get('b') is None
+    assert 1 not in activities
+    try:
+        del activities['b']
+    except KeyError:
+        pass
+    else:
+        assert False, 'KeyError not raised'
+
+
+def test_takes_less_memory():
+    names = [f'activity {i}' for i in range(50_000)]
+    tracemalloc.start()
+    try:
+        dictionary = {name: float(i) for i, name in enumerate(names)}
+        dictionary_size = tracemalloc.get_traced_memory()[0]
+        del dictionary
+        before = tracemalloc.get_traced_memory()[0]
+        activities = CompactActivities(
+            (name, float(i)) for i, name in enumerate(names))
+        compact_size = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    assert len(activities) == 50_000
+    assert compact_size * 1.5 < dictionary_size
+
+
+def test_columns_and_clear():
+    activities = CompactActivities({'a': 1.0, 'b': 2.0})
+    del activities['a']
+    names, weights = activities.columns()
+    assert names == [None, 'b']
+    assert list(weights) == [0.0, 2.0]
+    activities.clear()
+    assert dict(activities) == {}
+    activities['c'] = 3.0
+    assert dict(activities) == {'c': 3.0}
+
+
+def test_weighted_choice_follows_changes():
+    activities = CompactActivities({'a': 1.0, 'b': 2.0})
+    assert weighted_choice(activities) in ('a', 'b')
+    del activities['a']
+    assert {weighted_choice(activities) for _ in range(50)} == {'b'}
+    activities['a'] = 0.0
+    activities['c'] = 1.0
+    del activities['b']
+    assert {weighted_choice(activities) for _ in range(50)} == {'c'}
+    activities['c'] = 0.0
+    assert weighted_choice(activities) is None
+
+
+def test_load_compact_state(tmp_path):
+    fname = tmp_path / 'state'
+    save_state(fname, ActivitiesState({'a': 1.0, 'b': 2.0}))
+    state = load_state(fname, compact=True)
+    record_mutation(fname, state, 'add', activity='c', weight=3.0)
+    record_mutation(fname, state, 'delete', activity='a')
+    state = load_state(fname, compact=True)
+    assert isinstance(state.activities, CompactActivities)
+    assert dict(state.activities) == {'b': 2.0, 'c': 3.0}
+    assert weighted_choice(state.activities) in ('b', 'c')
+    save_state(fname, state)
+    assert load_state(fname).activities == {'b': 2.0, 'c': 3.0}
+    assert isinstance(
+        load_state(tmp_path / 'missing', compact=True).activities,
+        CompactActivities)
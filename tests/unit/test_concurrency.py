@@ -0,0 +1,110 @@
+from datetime import datetime
+from multiprocessing import get_context
+
+import pytest
+
+from choose_activity.helpers import ConflictError
+from choose_activity.journal import journal_path
+from choose_activity.storage import FileStorage, SQLiteStorage
+
+
+def make_storage(kind, tmp_path):
+    if kind == 'file':
+        return FileStorage(tmp_path / 'state.dat', tmp_path / 'outcomes.log')
+    return SQLiteStorage(tmp_path / 'db.sqlite3')
+
+
+@pytest.fixture(params=['file', 'sqlite'])
+def kind(request):
+    return request.param
+
+
+def test_concurrent_adds_are_merged(kind, tmp_path):
+    first = make_storage(kind, tmp_path)
+    second = make_storage(kind, tmp_path)
+    first_state = first.load_state()
+    second_state = second.load_state()
+
+    first.record_mutation(first_state, 'add', activity='a', weight=1.0)
+    second.record_mutation(second_state, 'add', activity='b', weight=2.0)
+    # the second session noticed the first change and merged it
+    assert second_state.activities == {'a': 1.0, 'b': 2.0}
+    assert first.load_state() == second_state
+
+    # saving the whole state would drop the change of the second session
+    with pytest.raises(ConflictError):
+        first.save_state(first_state)
+    assert first.load_state() == second_state
+    first_state = first.load_state()
+    first.save_state(first_state)
+    assert first.load_state().activities == {'a': 1.0, 'b': 2.0}
+    assert first.load_state().version > second_state.version
+    first.close()
+    second.close()
+
+
+def test_conflicts(kind, tmp_path):
+    first = make_storage(kind, tmp_path)
+    second = make_storage(kind, tmp_path)
+    state = first.load_state()
+    first.record_mutation(state, 'add', activity='a', weight=1.0)
+
+    first_state = first.load_state()
+    second_state = second.load_state()
+    first.record_mutation(first_state, 'delete', activity='a')
+    with pytest.raises(ConflictError):
+        second.record_mutation(
+            second_state, 'reweight', activity='a', weight=3.0)
+    # the state was reloaded anyway
+    assert second_state.activities == {}
+
+    now = datetime.now().astimezone()
+    first.record_mutation(first_state, 'add', activity='b', weight=1.0)
+    second_state = second.load_state()
+    first.record_mutation(first_state, 'start', activity='b', at=now)
+    with pytest.raises(ConflictError):
+        second.record_mutation(second_state, 'start', activity='b', at=now)
+
+    second_state = second.load_state()
+    first.record_mutation(first_state, 'finish')
+    with pytest.raises(ConflictError):
+        second.record_mutation(second_state, 'finish')
+    first.close()
+    second.close()
+
+
+def add_many(kind, tmp_path, worker):
+    storage = make_storage(kind, tmp_path)
+    state = storage.load_state()
+    for i in range(20):
+        storage.record_mutation(
+            state, 'add', activity=f'{worker} {i}', weight=1.0)
+    storage.close()
+
+
+def test_parallel_processes(kind, tmp_path):
+    make_storage(kind, tmp_path).close()
+    ctx = get_context('fork')
+    workers = [
+        ctx.Process(target=add_many, args=(kind, tmp_path, w))
+        for w in range(4)
+    ]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+        assert w.exitcode == 0
+    storage = make_storage(kind, tmp_path)
+    assert len(storage.load_state().activities) == 80
+    storage.close()
+
+
+def test_torn_journal_then_append(tmp_path):
+    storage = make_storage('file', tmp_path)
+    state = storage.load_state()
+    storage.record_mutation(state, 'add', activity='a', weight=1.0)
+    with open(journal_path(storage.state_fname), 'a') as f:
+        f.write('{"op": "delete", "activ')
+    state = storage.load_state()
+    storage.record_mutation(state, 'add', activity='b', weight=1.0)
+    assert storage.load_state().activities == {'a': 1.0, 'b': 1.0}
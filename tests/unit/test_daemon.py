@@ -0,0 +1,176 @@
+from datetime import datetime
+from threading import Thread
+
+import pytest
+
+from choose_activity.daemon import (
+    ActivityServer,
+    ActivityService,
+    DaemonError,
+    send_request,
+    serve,
+)
+from choose_activity.helpers import ActivitiesState, ActivityOutcome
+from choose_activity.storage import FileStorage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = FileStorage(tmp_path / 'state.dat', tmp_path / 'outcomes.log')
+    storage.save_state(ActivitiesState({'read': 1.0}))
+    return storage
+
+
+def test_service(storage):
+    service = ActivityService(storage, flush_interval=3600)
+    assert service.handle(dict(command='add', activity='run', weight=2.0))
+    assert service.handle(
+        dict(command='reweight', activity='read', weight=3.0)
+    ) == dict(activity='read', weight=3.0)
+    assert 'error' in service.handle(
+        dict(command='reweight', activity='nope', weight=3.0))
+    assert 'error' in service.handle(dict(command='feedback'))
+    assert 'error' in service.handle(dict(command='explode'))
+    assert 'error' in service.handle(['not', 'a', 'dict'])
+
+    picked = service.handle(dict(command='pick'))
+    assert picked['activity'] in ('read', 'run')
+    assert picked['latest'] is None
+    assert 'error' in service.handle(dict(command='pick'))
+    service.handle(dict(
+        command='feedback', is_done=True, feedback='nice', delete=True))
+    assert picked['activity'] not in service.state.activities
+
+    # nothing was written yet, the interval did not pass
+    assert storage.load_state().activities == {'read': 1.0}
+    service.flush(force=True)
+    assert storage.load_state().activities == dict(service.state.activities)
+    assert storage.load_state().current_activity is None
+    assert storage.latest_outcome_for_activity(picked['activity']) == 'nice'
+
+
+@pytest.mark.parametrize('request_', [
+    dict(command='add', activity='x', weight='x'),
+    dict(command='add', activity='x', weight=float('nan')),
+    dict(command='add', activity='x', weight=-1.0),
+    dict(command='add', activity='x', weight=True),
+    dict(command='add', activity=['x'], weight=1.0),
+    dict(command='add', activity='x'),
+    dict(command='reweight', activity='read', weight=None),
+    dict(command='delete', activity='read', extra=1),
+])
+def test_invalid_arguments(storage, request_):
+    service = ActivityService(storage, flush_interval=3600)
+    assert 'error' in service.handle(request_)
+    # nothing was changed, the sampler still works
+    assert service.state.activities == {'read': 1.0}
+    assert service.handle(dict(command='pick'))['activity'] == 'read'
+    assert 'error' in service.handle(
+        dict(command='feedback', is_done='yes', feedback='ok'))
+
+
+def test_zero_weights(storage):
+    service = ActivityService(storage, flush_interval=3600)
+    service.handle(dict(command='reweight', activity='read', weight=0))
+    assert 'error' in service.handle(dict(command='pick'))
+    service.handle(dict(command='add', activity='run', weight=2))
+    assert service.handle(dict(command='pick'))['activity'] == 'run'
+
+
+def test_concurrent_changes_are_merged(storage):
+    service = ActivityService(storage, flush_interval=3600)
+    service.handle(dict(command='add', activity='run', weight=2.0))
+    service.handle(dict(command='reweight', activity='read', weight=3.0))
+    state = storage.load_state()
+    storage.record_mutation(state, 'add', activity='walk', weight=4.0)
+    storage.record_mutation(state, 'delete', activity='read')
+
+    service.flush(force=True)
+    # the reweight of the deleted activity is dropped
+    assert storage.load_state().activities == {'walk': 4.0, 'run': 2.0}
+    assert dict(service.state.activities) == {'walk': 4.0, 'run': 2.0}
+    service.handle(dict(command='delete', activity='run'))
+    service.flush(force=True)
+    assert storage.load_state().activities == {'walk': 4.0}
+
+
+def test_finish_done_meanwhile_logs_one_outcome(storage):
+    service = ActivityService(storage, flush_interval=3600)
+    service.pick()
+    service.flush(force=True)
+    # finished from the command line while the daemon is running
+    state = storage.load_state()
+    storage.log_activity_result(ActivityOutcome(
+        activity='read',
+        start_at=state.current_activity_start,
+        end_at=datetime.now().astimezone(),
+        is_done=True,
+        feedback='from the command line',
+    ))
+    storage.record_mutation(state, 'finish')
+
+    service.feedback(False, 'from the daemon')
+    service.flush(force=True)
+    assert [o.feedback for o in storage.outcomes_between()] == [
+        'from the command line']
+    assert service.state.current_activity is None
+    assert service.pick()['latest'] == 'from the command line'
+
+
+def test_changes_done_meanwhile_are_loaded(storage):
+    service = ActivityService(storage, flush_interval=0)
+    state = storage.load_state()
+    storage.record_mutation(state, 'add', activity='walk', weight=4.0)
+    service.flush()
+    assert dict(service.state.activities) == {'read': 1.0, 'walk': 4.0}
+    assert service.handle(
+        dict(command='delete', activity='walk')) == dict(activity='walk')
+    service.flush()
+    assert storage.load_state().activities == {'read': 1.0}
+
+
+def test_latest_outcome_cached(storage):
+    service = ActivityService(storage, flush_interval=0)
+    service.pick()
+    service.feedback(True, 'first time')
+    service.flush()
+    assert service.pick()['latest'] == 'first time'
+    assert service.latest_outcomes == {'read': 'first time'}
+
+
+def test_socket_roundtrip(storage, tmp_path):
+    socket_path = tmp_path / 'daemon.sock'
+    service = ActivityService(storage, flush_interval=0)
+    server = ActivityServer(socket_path, service)
+    thread = Thread(target=server.serve_forever, args=(0.01,))
+    thread.start()
+    try:
+        assert send_request(socket_path, dict(command='ping')) == {}
+        assert send_request(
+            socket_path,
+            dict(command='add', activity='write', weight=2.0),
+        ) == dict(activity='write', weight=2.0)
+        with pytest.raises(DaemonError):
+            serve(socket_path, storage)
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+    service.flush(force=True)
+    assert storage.load_state().activities == {'read': 1.0, 'write': 2.0}
+
+
+def test_stale_socket_is_replaced(storage, tmp_path, monkeypatch):
+    socket_path = tmp_path / 'daemon.sock'
+    socket_path.write_text('')
+
+    def interrupted(server, poll_interval):
+        server.service.add('write', 2.0)
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr(ActivityServer, 'serve_forever', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        serve(socket_path, storage, flush_interval=3600)
+    # the pending changes were written anyway and the socket removed
+    assert storage.load_state().activities == {'read': 1.0, 'write': 2.0}
+    assert not socket_path.exists()
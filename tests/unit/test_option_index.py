@@ -0,0 +1,94 @@
+from unittest.mock import MagicMock
+
+from choose_activity import helpers
+from choose_activity.helpers import (
+    ActivitiesState,
+    activity_index,
+    apply_mutation,
+    get_answer,
+    mutation_record,
+    user_selection,
+)
+from choose_activity.option_index import OptionIndex
+
+
+def test_search():
+    index = OptionIndex(['the apple', 'The Banana', '🤠', 'blob'])
+    assert index.search('banana') == ['The Banana']
+    assert index.search('THE') == ['the apple', 'The Banana']
+    assert index.search('🤠') == ['🤠']
+    assert index.search('b') == ['The Banana', 'blob']
+    assert index.search('orange') == []
+    assert len(index) == 4
+
+
+def test_incremental_updates():
+    index = OptionIndex(['the apple', 'the banana'])
+    index.add('the cherry')
+    index.add('the apple')
+    index.remove('the banana')
+    assert list(index) == ['the apple', 'the cherry']
+    assert index.search('the') == ['the apple', 'the cherry']
+    assert index.search('banana') == []
+    assert index.search('a') == ['the apple']
+    assert 'the cherry' in index
+    assert 'the banana' not in index
+
+
+def test_fuzzy():
+    index = OptionIndex([
+        'read an article in German',
+        'try a new framework',
+        'learn German verbs',
+    ])
+    assert index.fuzzy('germna article')[0] == 'read an article in German'
+    assert index.fuzzy('framwork') == ['try a new framework']
+    assert index.fuzzy('german', limit=1) == ['learn German verbs']
+    assert index.fuzzy('zzz') == []
+
+
+def test_selection_with_index():
+    options = ['apple', 'the banana', 'blob']
+    index = OptionIndex(options)
+    assert user_selection(options, 'BAN', index) == 'the banana'
+    assert user_selection(options, '3', index) == 'blob'
+    assert user_selection(options, 'blo') == 'blob'
+
+
+def test_selection_without_index(monkeypatch):
+    # without an index the options are scanned, not indexed
+    monkeypatch.setattr(helpers, 'OptionIndex', None)
+    options = ['apple', 'the banana', 'blob']
+    assert user_selection(options, 'BAN') == 'the banana'
+    answers = ['/b', 'BAN']
+    assert get_answer(
+        options, lambda: answers.pop(0), page_size=2) == 'the banana'
+
+
+def test_activity_index_follows_mutations():
+    state = ActivitiesState(activities={'apple': 1.0, 'banana': 2.0})
+    index = activity_index(state)
+    apply_mutation(state, mutation_record('add', activity='cherry', weight=1))
+    apply_mutation(state, mutation_record('delete', activity='apple'))
+    # updated in place, not rebuilt
+    assert activity_index(state) is index
+    assert list(index) == ['banana', 'cherry']
+    # changed without a mutation, the version tells it's stale
+    state.activities['date'] = 1.0
+    state.version += 1
+    assert activity_index(state) is not index
+    assert list(activity_index(state)) == ['banana', 'cherry', 'date']
+
+
+def test_suggestions(capsys):
+    answers = ['banan split', 'banana']
+
+    def input_function():
+        return answers.pop(0)
+
+    assert get_answer(['apple', 'banana'], input_function) == 'banana'
+    out = capsys.readouterr().out
+    assert 'Did you mean:\n -  banana' in out
+
+    _input = MagicMock(return_value='apple')
+    assert get_answer(['apple', 'banana'], _input) == 'apple'
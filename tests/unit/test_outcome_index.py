@@ -0,0 +1,160 @@
+import json
+import sqlite3
+import threading
+
+from choose_activity.helpers import (
+    latest_outcome_for_activity,
+    log_activity_result,
+    log_activity_results,
+)
+from choose_activity.outcome_index import (
+    index_path,
+    latest_line,
+    read_index,
+    reverse_lines,
+    scan_latest_line,
+)
+
+
+def log_outcomes(test_path, outcome, minutes):
+    log_activity_results(test_path, [outcome(m) for m in minutes])
+
+
+def test_index_follows_appends(tmp_path, outcome):
+    test_path = tmp_path / 'activities_state.log'
+    log_outcomes(test_path, outcome, range(7))
+    index = read_index(test_path)
+    assert index.log_size == test_path.stat().st_size
+    assert set(index.offsets) == {f'activity {m}' for m in range(3)}
+    assert (
+        latest_outcome_for_activity(test_path, 'activity 1') ==
+        'feedback 4'
+    )
+
+
+def test_appends_write_their_rows(tmp_path, outcome):
+    test_path = tmp_path / 'activities_state.log'
+    log_activity_results(test_path, [
+        outcome(0, f'activity {n}') for n in range(1000)])
+    before = read_index(test_path)
+    log_activity_result(test_path, outcome(1, 'activity 3'))
+    after = read_index(test_path)
+    assert after.log_size == test_path.stat().st_size
+    changed = {
+        a for a, offset in after.offsets.items()
+        if before.offsets[a] != offset}
+    assert changed == {'activity 3'}
+
+
+def test_corrupt_index(tmp_path, outcome):
+    test_path = tmp_path / 'activities_state.log'
+    log_outcomes(test_path, outcome, range(5))
+    # the JSON format of older versions is not a database
+    index_path(test_path).write_text('{"log_size": 12, "offs')
+    assert latest_outcome_for_activity(test_path, 'activity 0') == (
+        'feedback 3')
+    # the index is rebuilt by the next append
+    assert read_index(test_path) is None
+    log_outcomes(test_path, outcome, [6])
+    assert read_index(test_path).log_size == test_path.stat().st_size
+    assert latest_outcome_for_activity(test_path, 'activity 1') == (
+        'feedback 4')
+
+
+def test_wrong_offsets(tmp_path, outcome):
+    test_path = tmp_path / 'activities_state.log'
+    log_outcomes(test_path, outcome, range(5))
+    with sqlite3.connect(index_path(test_path)) as conn:
+        conn.execute(
+            'UPDATE offsets SET offset = 0 WHERE activity = ?',
+            ('activity 2',))
+    conn.close()
+    assert latest_outcome_for_activity(test_path, 'activity 2') == (
+        'feedback 2')
+    assert read_index(test_path) is None
+
+
+def test_stale_and_missing_index(tmp_path, outcome):
+    test_path = tmp_path / 'activities_state.log'
+    log_outcomes(test_path, outcome, range(5))
+    # lines appended by someone not updating the index
+    with open(test_path, 'a') as f:
+        f.write(json.dumps(dict(
+            activity='activity 1',
+            feedback='written by hand',
+        )) + '\n')
+    assert latest_outcome_for_activity(test_path, 'activity 1') == (
+        'written by hand')
+    assert read_index(test_path).log_size == test_path.stat().st_size
+
+    index_path(test_path).unlink()
+    log_outcomes(test_path, outcome, [6])
+    assert latest_outcome_for_activity(test_path, 'activity 0') == (
+        'feedback 6')
+    assert latest_outcome_for_activity(test_path, 'activity 1') == (
+        'written by hand')
+
+
+def test_replaced_log(tmp_path, outcome):
+    test_path = tmp_path / 'activities_state.log'
+    log_outcomes(test_path, outcome, range(5))
+    test_path.unlink()
+    log_outcomes(test_path, outcome, [6])
+    assert latest_outcome_for_activity(test_path, 'activity 0') == (
+        'feedback 6')
+    assert latest_outcome_for_activity(test_path, 'activity 1') is None
+
+
+def test_reverse_lines():
+    assert list(reverse_lines(b'')) == []
+    assert list(reverse_lines(b'a\n')) == [b'a']
+    assert list(reverse_lines(b'a\nbb\n\nc')) == [b'c', b'', b'bb', b'a']
+
+
+def test_scan_latest_line(tmp_path, outcome):
+    test_path = tmp_path / 'activities_state.log'
+    test_path.write_bytes(b'')
+    assert scan_latest_line(test_path, 'activity 1') is None
+
+    log_outcomes(test_path, outcome, range(5))
+    # a line mentioning the activity in the feedback is not a match
+    with open(test_path, 'a') as f:
+        f.write(json.dumps(dict(
+            activity='other',
+            feedback='"activity 1"',
+        )) + '\n')
+        f.write('not even json "activity 1"\n')
+    assert scan_latest_line(test_path, 'activity 1')['feedback'] == (
+        'feedback 4')
+    assert scan_latest_line(test_path, 'never done') is None
+
+
+def test_concurrent_updates_of_a_stale_index(tmp_path, outcome):
+    test_path = tmp_path / 'activities_state.log'
+    log_outcomes(test_path, outcome, range(3))
+    with open(test_path, 'a') as f:
+        for m in range(3, 100):
+            f.write(json.dumps(dict(
+                activity=f'activity {m % 3}',
+                feedback=f'feedback {m}',
+            )) + '\n')
+    found = []
+    errors = []
+
+    def look_up(activity):
+        try:
+            for _ in range(20):
+                found.append(latest_line(test_path, activity)['feedback'])
+        except (OSError, sqlite3.Error) as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=look_up, args=(f'activity {n % 3}',))
+        for n in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert set(found) == {'feedback 97', 'feedback 98', 'feedback 99'}
+    assert read_index(test_path).log_size == test_path.stat().st_size
@@ -0,0 +1,91 @@
+from datetime import timedelta, timezone
+import io
+
+import pytest
+
+from choose_activity.helpers import log_activity_result
+from choose_activity.outcome_range import find_offset, outcomes_between
+from choose_activity.storage import SQLiteStorage
+
+@pytest.fixture
+def log_path(tmp_path, outcome):
+    path = tmp_path / 'activities.log'
+    # different time zones, the order is the one of the moments
+    zones = [timezone.utc, timezone(timedelta(hours=2))]
+    for minutes in range(0, 1000, 10):
+        zone = zones[minutes % 20 // 10]
+        log_activity_result(path, outcome(minutes, zone=zone))
+    return path
+
+
+def minutes(outcomes, start):
+    return [
+        int((o.end_at - start).total_seconds() // 60) for o in outcomes]
+
+
+def test_range(log_path, start):
+    since = start + timedelta(minutes=95)
+    until = start + timedelta(minutes=130)
+    assert minutes(outcomes_between(log_path, since, until), start) == [
+        100, 110, 120]
+    # the start is included, the end excluded
+    assert minutes(outcomes_between(
+        log_path, start + timedelta(minutes=100),
+        start + timedelta(minutes=120)), start) == [100, 110]
+
+
+def test_open_ranges(log_path, start):
+    assert len(list(outcomes_between(log_path))) == 100
+    assert minutes(outcomes_between(
+        log_path, since=start + timedelta(minutes=975)), start) == [980, 990]
+    assert minutes(outcomes_between(
+        log_path, until=start + timedelta(minutes=15)), start) == [0, 10]
+    assert list(outcomes_between(
+        log_path, since=start + timedelta(days=1))) == []
+    assert list(outcomes_between(log_path.with_name('missing'))) == []
+
+
+def test_reads_few_lines(log_path, monkeypatch, start):
+    from choose_activity import outcome_range
+    parsed = []
+    original = outcome_range._end_at
+    monkeypatch.setattr(
+        outcome_range, '_end_at',
+        lambda line: parsed.append(line) or original(line))
+    with open(log_path, 'rb') as f:
+        size = log_path.stat().st_size
+        offset = find_offset(f, size, start + timedelta(minutes=500))
+        f.seek(offset)
+        assert b'feedback 500' in f.readline()
+    assert len(parsed) <= 2 * size.bit_length()
+
+
+def test_partial_last_line(log_path, start):
+    with open(log_path, 'ab') as f:
+        f.write(b'{"activity": "being writ')
+    assert minutes(outcomes_between(
+        log_path, since=start + timedelta(minutes=985)), start) == [990]
+
+
+def test_find_offset_every_position(start):
+    lines = [
+        f'{{"end_at": "2024-01-01T12:{m:02d}:00+00:00"}}\n'.encode()
+        for m in range(0, 60, 7)]
+    data = b''.join(lines)
+    for m in range(-1, 62):
+        moment = start + timedelta(minutes=m)
+        expected = sum(
+            len(line) for line, mm in zip(lines, range(0, 60, 7))
+            if mm < m)
+        assert find_offset(io.BytesIO(data), len(data), moment) == expected
+
+
+def test_sqlite(tmp_path, outcome, start):
+    storage = SQLiteStorage(tmp_path / 'db.sqlite3')
+    for m in range(0, 100, 10):
+        storage.log_activity_result(outcome(m))
+    outcomes = list(storage.outcomes_between(
+        start + timedelta(minutes=20), start + timedelta(minutes=50)))
+    storage.close()
+    assert minutes(outcomes, start) == [20, 30, 40]
+    assert outcomes[0].feedback == 'feedback 20'
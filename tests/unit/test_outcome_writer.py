@@ -0,0 +1,133 @@
+import gc
+import weakref
+
+from choose_activity.helpers import (
+    latest_outcome_for_activity,
+    log_activity_result,
+    log_activity_results,
+    outcome_line,
+)
+from choose_activity import outcome_writer
+from choose_activity.outcome_index import read_index
+from choose_activity.outcome_writer import OutcomeWriter
+from choose_activity.storage import FileStorage, SQLiteStorage
+
+
+def test_batch_equals_single_appends(tmp_path, outcome):
+    outcomes = [outcome(l) for l in range(7)]
+    for o in outcomes:
+        log_activity_result(tmp_path / 'single.log', o)
+    log_activity_results(tmp_path / 'batch.log', outcomes[:3])
+    log_activity_results(tmp_path / 'batch.log', outcomes[3:], fsync=True)
+    log_activity_results(tmp_path / 'batch.log', [])
+    assert ((tmp_path / 'single.log').read_bytes()
+            == (tmp_path / 'batch.log').read_bytes())
+    assert (read_index(tmp_path / 'single.log')
+            == read_index(tmp_path / 'batch.log'))
+
+
+def test_flush_by_count(tmp_path, outcome):
+    log_path = tmp_path / 'activities.log'
+    writer = OutcomeWriter(log_path, max_count=3, max_delay=60)
+    writer.write(outcome(0))
+    writer.write(outcome(1))
+    assert not log_path.exists()
+    assert writer.latest_outcome_for_activity(
+        'activity 1') == 'feedback 1'
+    assert latest_outcome_for_activity(log_path, 'activity 1') is None
+    writer.write(outcome(2))
+    assert len(log_path.read_bytes().splitlines()) == 3
+    assert latest_outcome_for_activity(
+        log_path, 'activity 1') == 'feedback 1'
+    writer.close()
+
+
+def test_flush_by_bytes(tmp_path, outcome):
+    log_path = tmp_path / 'activities.log'
+    with OutcomeWriter(log_path, max_bytes=1, max_delay=60) as writer:
+        writer.write(outcome(0))
+        assert len(log_path.read_bytes().splitlines()) == 1
+
+
+def test_flush_by_time(tmp_path, outcome):
+    log_path = tmp_path / 'activities.log'
+    writer = OutcomeWriter(log_path, max_delay=60)
+    writer.write(outcome(0))
+    writer.flush_if_due()
+    assert not log_path.exists()
+    writer.max_delay = 0
+    writer.flush_if_due()
+    assert log_path.exists()
+    writer.close()
+
+
+def test_close_flushes(tmp_path, outcome):
+    log_path = tmp_path / 'activities.log'
+    with OutcomeWriter(log_path, fsync=True) as writer:
+        for l in range(10):
+            writer.write(outcome(l))
+        assert not log_path.exists()
+    assert len(log_path.read_bytes().splitlines()) == 10
+    assert read_index(log_path).log_size == log_path.stat().st_size
+    assert latest_outcome_for_activity(
+        log_path, 'activity 0') == 'feedback 9'
+
+
+def test_not_kept_alive(tmp_path, outcome):
+    log_path = tmp_path / 'activities.log'
+    writer = OutcomeWriter(log_path)
+    writer.write(outcome(0))
+    writer_ref = weakref.ref(writer)
+    del writer
+    gc.collect()
+    assert writer_ref() is None
+    # what was buffered is written when it's collected
+    assert latest_outcome_for_activity(
+        log_path, 'activity 0') == 'feedback 0'
+
+
+def test_open_writers_closed_at_exit(tmp_path, outcome):
+    log_path = tmp_path / 'activities.log'
+    writer = OutcomeWriter(log_path)
+    writer.write(outcome(0))
+    outcome_writer._close_writers()
+    assert len(log_path.read_bytes().splitlines()) == 1
+    assert writer not in outcome_writer._open_writers
+
+
+def test_encoded_once(tmp_path, monkeypatch, outcome):
+    encoded = []
+
+    def counting_line(o):
+        encoded.append(o)
+        return outcome_line(o)
+
+    monkeypatch.setattr(outcome_writer, 'outcome_line', counting_line)
+    log_path = tmp_path / 'activities.log'
+    with OutcomeWriter(log_path, max_count=2) as writer:
+        for l in range(3):
+            writer.write(outcome(l))
+        assert writer.latest_outcome_for_activity(
+            'activity 2') == 'feedback 2'
+    assert len(encoded) == 3
+    assert len(log_path.read_bytes().splitlines()) == 3
+
+
+def test_storage_target(tmp_path, outcome):
+    storage = SQLiteStorage(tmp_path / 'db.sqlite3')
+    with OutcomeWriter(storage, max_delay=60) as writer:
+        writer.write(outcome(0))
+        assert writer.latest_outcome_for_activity(
+            'activity 0') == 'feedback 0'
+        assert storage.latest_outcome_for_activity('activity 0') is None
+    assert storage.latest_outcome_for_activity(
+        'activity 0') == 'feedback 0'
+    storage.close()
+
+    # the lines of the log of a file storage are written directly
+    storage = FileStorage(tmp_path / 'state.dat', tmp_path / 'outcomes.log')
+    with OutcomeWriter(storage) as writer:
+        assert writer.fname == storage.log_fname
+        writer.write(outcome(0))
+    assert storage.latest_outcome_for_activity(
+        'activity 0') == 'feedback 0'
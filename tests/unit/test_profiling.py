@@ -0,0 +1,58 @@
+import json
+
+from choose_activity import helpers, profiling, storage
+from choose_activity.helpers import ActivitiesState
+
+
+def test_disabled_does_not_wrap():
+    original = helpers.load_state
+    with profiling.span('anything'):
+        pass
+    assert helpers.load_state is original
+
+
+def test_enable_and_disable(tmp_path):
+    original = helpers.load_state
+    profiler = profiling.enable()
+    try:
+        assert profiling.enable() is profiler
+        assert helpers.load_state is not original
+        assert storage.helpers.load_state is helpers.load_state
+        fname = tmp_path / 'state'
+        helpers.save_state(fname, ActivitiesState({'a': 1.0}))
+        with profiling.span('choice'):
+            helpers.weighted_choice(helpers.load_state(fname).activities)
+    finally:
+        profiling.disable()
+    assert helpers.load_state is original
+    names = [event[0] for event in profiler.events]
+    assert names == ['save_state', 'load_state', 'weighted_choice', 'choice']
+    lines = profiler.breakdown().splitlines()
+    assert len(lines) == 5
+    assert sorted(line.split()[-1] for line in lines[1:]) == sorted(names)
+
+
+def test_sqlite_methods_are_wrapped(tmp_path):
+    original = storage.SQLiteStorage.load_state
+    profiler = profiling.enable()
+    try:
+        db = storage.SQLiteStorage(tmp_path / 'db.sqlite3')
+        db.load_state()
+        db.close()
+    finally:
+        profiling.disable()
+    assert storage.SQLiteStorage.load_state is original
+    assert [event[0] for event in profiler.events] == [
+        'SQLiteStorage.load_state']
+
+
+def test_write_trace(tmp_path):
+    profiler = profiling.Profiler()
+    with profiler.span('outer'):
+        with profiler.span('inner'):
+            pass
+    profiler.write_trace(tmp_path / 'trace.json')
+    events = json.loads((tmp_path / 'trace.json').read_text())['traceEvents']
+    assert [event['name'] for event in events] == ['inner', 'outer']
+    assert events[0]['ts'] >= events[1]['ts']
+    assert events[0]['dur'] <= events[1]['dur']
@@ -1,6 +1,15 @@
 from collections import Counter
 
-from choose_activity.helpers import weighted_choice
+from choose_activity.helpers import (
+    ActivitiesState,
+    apply_mutation,
+    mutation_record,
+    pick_activity,
+    weighted_choice,
+    weighted_choice_counts,
+    weighted_choice_many,
+    weighted_sample,
+)
 
 
 def test_no_choice():
@@ -12,6 +21,11 @@ def test_single_choice():
     assert weighted_choice({'only me!': 1.0}) == 'only me!'
 
 
+def test_zero_weights():
+    assert weighted_choice({'a': 0.0, 'b': 0.0}) is None
+    assert weighted_choice({'a': 0.0, 'b': 1.0}) == 'b'
+
+
 def test_weighted_choice():
     SAMPLE_SIZE = 600
     c = Counter()
@@ -26,3 +40,73 @@ def test_weighted_choice():
     assert c['choice a'] > c['choice c']
     assert sum(c.values()) == SAMPLE_SIZE
     assert len(c.keys()) == 3
+
+
+def test_pick_activity_keeps_the_table():
+    state = ActivitiesState({'a': 0.0, 'b': 1.0})
+    assert pick_activity(state) == 'b'
+    sampler = state.sampler
+    assert pick_activity(state) == 'b'
+    assert state.sampler is sampler
+    apply_mutation(state, mutation_record('reweight', activity='a', weight=1))
+    apply_mutation(state, mutation_record('delete', activity='b'))
+    assert pick_activity(state) == 'a'
+    assert state.sampler is not sampler
+    assert pick_activity(ActivitiesState({})) is None
+
+
+def test_weighted_sample():
+    assert weighted_sample(None, 3) == []
+    assert weighted_sample({}, 3) == []
+    assert weighted_sample({'a': 1.0}, 0) == []
+    assert sorted(weighted_sample({'a': 1.0, 'b': 2.0}, 5)) == ['a', 'b']
+    assert weighted_sample({'a': 0.0, 'b': 2.0, 'c': -1.0}, 2) == ['b']
+    assert weighted_sample({'a': 0.0}, 1) == []
+
+    choices = {f'choice {i}': float(i + 1) for i in range(20)}
+    for _ in range(50):
+        chosen = weighted_sample(choices, 7)
+        assert len(chosen) == 7
+        assert len(set(chosen)) == 7
+        assert all(c in choices for c in chosen)
+
+
+def test_weighted_sample_bias():
+    SAMPLE_SIZE = 600
+    c = Counter()
+    for _ in range(SAMPLE_SIZE):
+        c.update(weighted_sample({
+            'choice a': 1.0,
+            'choice b': 6.0,
+            'choice c': 0.2,
+            'choice d': 0.2,
+            }, 2))
+    assert sum(c.values()) == 2 * SAMPLE_SIZE
+    assert c['choice b'] > c['choice a'] > c['choice c']
+
+
+def test_weighted_choice_many():
+    assert weighted_choice_many(None, 10) == []
+    assert weighted_choice_many({'a': 1.0}, 0) == []
+    assert weighted_choice_many({'only me!': 1.0}, 3) == ['only me!'] * 3
+
+    choices = {
+        'choice a': 1.0,
+        'choice b': 6.0,
+        'choice c': 0.2,
+        }
+    SAMPLE_SIZE = 6000
+    drawn = weighted_choice_many(choices, SAMPLE_SIZE, seed=3)
+    c = Counter(drawn)
+    assert c['choice b'] > c['choice a'] > c['choice c']
+    assert sum(c.values()) == SAMPLE_SIZE
+    # the same seed gives the same draws
+    assert weighted_choice_many(choices, SAMPLE_SIZE, seed=3) == drawn
+    # the same draws, counted
+    assert weighted_choice_counts(choices, SAMPLE_SIZE, seed=3) == c
+
+
+def test_zero_weights_many():
+    assert weighted_choice_many({'a': 0.0, 'b': 0.0}, 5) == []
+    assert weighted_choice_counts({'a': 0.0, 'b': 0.0}, 5) == {}
+    assert weighted_choice_counts({'a': 0.0, 'b': 1.0}, 5) == {'b': 5}
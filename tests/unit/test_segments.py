@@ -0,0 +1,198 @@
+from datetime import timedelta
+import gzip
+import json
+
+import pytest
+
+from choose_activity import segments
+from choose_activity.helpers import (
+    latest_outcome_for_activity,
+    log_activity_result,
+)
+from choose_activity.outcome_range import outcomes_between
+from choose_activity.segments import (
+    latest_path,
+    manifest_path,
+    maybe_rotate,
+    read_manifest,
+    rotate,
+    segments_dir,
+)
+from choose_activity.storage import FileStorage
+
+@pytest.fixture(params=[None, 'gzip', 'lzma'])
+def small_segments(request, monkeypatch):
+    monkeypatch.setattr(segments, 'SEGMENT_MAX_BYTES', 2000)
+    monkeypatch.setattr(segments, 'SEGMENT_COMPRESSION', request.param)
+    monkeypatch.setattr(segments, 'BLOCK_SIZE', 300)
+    return request.param
+
+
+def test_rotation_by_size(tmp_path, small_segments, outcome):
+    log_path = tmp_path / 'activities.log'
+    for m in range(100):
+        log_activity_result(log_path, outcome(m))
+    manifest = read_manifest(log_path)
+    assert len(manifest.segments) > 3
+    assert all(
+        s.compression == small_segments for s in manifest.segments)
+    if small_segments is None:
+        assert all(s.size >= 2000 for s in manifest.segments)
+    else:
+        assert all(s.size < 2000 for s in manifest.segments)
+        # only the compressed segments are kept
+        assert len(list(segments_dir(log_path).glob('*.jsonl'))) == 0
+    assert log_path.stat().st_size < 2000
+    sealed = sum(s.count for s in manifest.segments)
+    assert sealed + len(log_path.read_bytes().splitlines()) == 100
+    assert sum(s.done + s.skipped for s in manifest.stats.values()) == sealed
+    assert [o.feedback for o in outcomes_between(log_path)] == [
+        f'feedback {m}' for m in range(100)]
+
+
+def test_latest_and_stats_use_the_summary(
+        tmp_path, small_segments, outcome, start):
+    log_path = tmp_path / 'activities.log'
+    log_activity_result(log_path, outcome(0, 'old one'))
+    for m in range(1, 100):
+        log_activity_result(log_path, outcome(m))
+    assert b'old one' not in log_path.read_bytes()
+    assert latest_outcome_for_activity(log_path, 'old one') == 'feedback 0'
+    assert latest_outcome_for_activity(
+        log_path, 'activity 0') == 'feedback 99'
+    assert latest_outcome_for_activity(log_path, 'missing') is None
+    stats = FileStorage(tmp_path / 'state', log_path).activity_stats()
+    assert stats['old one'].done == 1
+    assert sum(s.done + s.skipped for s in stats.values()) == 100
+    assert stats['activity 0'].last_done == start + timedelta(minutes=96)
+
+
+def test_latest_does_not_read_the_stats(tmp_path, monkeypatch, outcome):
+    log_path = tmp_path / 'activities.log'
+    log_activity_result(log_path, outcome(0, 'old one'))
+    rotate(log_path)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('the statistics were parsed')
+
+    monkeypatch.setattr(segments, 'stats_from_json', fail)
+    assert latest_outcome_for_activity(log_path, 'old one') == 'feedback 0'
+    assert latest_outcome_for_activity(log_path, 'missing') is None
+
+
+def test_range_skips_segments(
+        tmp_path, small_segments, monkeypatch, outcome, start):
+    log_path = tmp_path / 'activities.log'
+    for m in range(100):
+        log_activity_result(log_path, outcome(m))
+    opened = []
+    original_open = open
+
+    def tracking_open(fname, *args, **kwargs):
+        opened.append(str(fname))
+        return original_open(fname, *args, **kwargs)
+
+    monkeypatch.setattr('builtins.open', tracking_open)
+    found = list(outcomes_between(
+        log_path, start + timedelta(minutes=40),
+        start + timedelta(minutes=45)))
+    assert [o.feedback for o in found] == [
+        f'feedback {m}' for m in range(40, 45)]
+    segment_files = [
+        f for f in opened if '.segments' in f and not f.endswith('.blocks')]
+    assert 1 <= len(segment_files) <= 2
+
+
+def test_range_decompresses_few_blocks(tmp_path, monkeypatch, outcome, start):
+    monkeypatch.setattr(segments, 'BLOCK_SIZE', 300)
+    log_path = tmp_path / 'activities.log'
+    for m in range(100):
+        log_activity_result(log_path, outcome(m))
+    segment = rotate(log_path)
+    assert segment.compression == 'gzip'
+    blocks = segments.read_blocks(log_path, segment)
+    assert len(blocks) > 10
+    decompressed = []
+    compress, decompress, suffix = segments.COMPRESSIONS['gzip']
+    monkeypatch.setitem(segments.COMPRESSIONS, 'gzip', (
+        compress,
+        lambda data: decompressed.append(data) or decompress(data),
+        suffix,
+    ))
+    found = list(outcomes_between(
+        log_path, start + timedelta(minutes=50),
+        start + timedelta(minutes=53)))
+    assert [o.feedback for o in found] == [
+        f'feedback {m}' for m in range(50, 53)]
+    assert 1 <= len(decompressed) <= 3 < len(blocks)
+    # the whole segment is a valid gzip file too
+    lines = gzip.decompress(
+        segments.segment_path(log_path, segment).read_bytes()).splitlines()
+    assert len(lines) == 100
+
+
+def test_rotation_by_age(tmp_path, outcome):
+    log_path = tmp_path / 'activities.log'
+    log_activity_result(log_path, outcome(0))
+    assert maybe_rotate(log_path, max_age=timedelta(days=365 * 100)) is None
+    segment = maybe_rotate(log_path, max_age=timedelta(days=1))
+    assert segment.count == 1
+    assert not log_path.exists()
+    assert latest_outcome_for_activity(
+        log_path, 'activity 0') == 'feedback 0'
+    assert rotate(log_path) is None
+
+
+def test_interrupted_rotation(tmp_path, monkeypatch, outcome):
+    monkeypatch.setattr(segments, 'SEGMENT_COMPRESSION', None)
+    log_path = tmp_path / 'activities.log'
+    log_activity_result(log_path, outcome(0))
+    rotate(log_path)
+    first_manifest = manifest_path(log_path).read_text()
+    first_latest = latest_path(log_path).read_text()
+    log_activity_result(log_path, outcome(1))
+    rotate(log_path)
+    # as if the second rotation stopped before writing the manifest
+    manifest_path(log_path).write_text(first_manifest)
+    latest_path(log_path).write_text(first_latest)
+    assert latest_outcome_for_activity(
+        log_path, 'activity 1') == 'feedback 1'
+    manifest = read_manifest(log_path)
+    assert [s.name for s in manifest.segments] == [
+        '000001.jsonl', '000002.jsonl']
+    assert manifest.latest['activity 1'] == 'feedback 1'
+    assert sorted(f.name for f in segments_dir(log_path).iterdir()) == [
+        '000001.jsonl', '000002.jsonl']
+
+
+def test_interrupted_first_rotation(tmp_path, monkeypatch, outcome):
+    monkeypatch.setattr(segments, 'SEGMENT_COMPRESSION', None)
+    log_path = tmp_path / 'activities.log'
+    log_activity_result(log_path, outcome(0))
+    rotate(log_path)
+    # as if it stopped before writing the latest feedback and the manifest
+    latest_path(log_path).unlink()
+    manifest_path(log_path).unlink()
+    assert latest_outcome_for_activity(
+        log_path, 'activity 0') == 'feedback 0'
+    log_activity_result(log_path, outcome(1))
+    rotate(log_path)
+    assert json.loads(latest_path(log_path).read_text())['latest'] == {
+        'activity 0': 'feedback 0', 'activity 1': 'feedback 1'}
+
+
+def test_interrupted_compression(tmp_path, outcome):
+    log_path = tmp_path / 'activities.log'
+    log_activity_result(log_path, outcome(0))
+    segment = rotate(log_path)
+    # as if the plain segment was not removed after the compression
+    plain = segments_dir(log_path) / '000001.jsonl'
+    plain.write_bytes(b''.join(
+        segments.compressed_lines(
+            open(segments.segment_path(log_path, segment), 'rb'),
+            'gzip',
+            segments.read_blocks(log_path, segment),
+        )))
+    manifest = read_manifest(log_path)
+    assert len(manifest.segments) == 1
+    assert manifest.stats['activity 0'].done == 1
@@ -0,0 +1,80 @@
+from datetime import datetime
+import os
+
+import pytest
+
+import choose_activity.helpers as helpers
+from choose_activity.compact import CompactActivities
+from choose_activity.helpers import (
+    ActivitiesState,
+    load_state,
+    record_mutation,
+    save_state,
+)
+from choose_activity.state_cache import cache_path
+
+ACTIVITIES = {'plain': 1.5, 'integer': 2, 'unicode ☕ café': 5.0, '': 6.0}
+
+
+@pytest.fixture
+def state_path(tmp_path):
+    path = tmp_path / 'activities_state.dat'
+    state = ActivitiesState(
+        dict(ACTIVITIES),
+        current_activity='plain',
+        current_activity_start=datetime.now().astimezone(),
+    )
+    save_state(path, state)
+    return path
+
+
+def no_json(*args):
+    raise AssertionError('The JSON was parsed')
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_warm_load(state_path, monkeypatch, compact):
+    assert not cache_path(state_path).exists()
+    cold = load_state(state_path, compact)
+    assert cache_path(state_path).exists()
+    monkeypatch.setattr(helpers, 'read_state_file', no_json)
+    warm = load_state(state_path, compact)
+    assert warm == cold
+    assert list(warm.activities.items()) == list(ACTIVITIES.items())
+    if compact:
+        assert isinstance(warm.activities, CompactActivities)
+    else:
+        assert type(warm.activities['integer']) is int
+
+
+def test_journal_on_top(state_path, monkeypatch):
+    state = load_state(state_path)
+    record_mutation(state_path, state, 'add', activity='new', weight=3.0)
+    monkeypatch.setattr(helpers, 'read_state_file', no_json)
+    assert load_state(state_path) == state
+
+
+def test_stale_cache(state_path):
+    state = load_state(state_path)
+    state.activities['plain'] = 9.0
+    save_state(state_path, state)
+    assert load_state(state_path).activities['plain'] == 9.0
+
+    # the same size and modification time, but another content
+    stat = os.stat(state_path)
+    text = state_path.read_text()
+    state_path.write_text(text.replace('9.0', '8.0'))
+    os.utime(state_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert load_state(state_path).activities['plain'] == 8.0
+
+
+@pytest.mark.parametrize('content', [b'', b'garbage', None])
+def test_broken_cache(state_path, content):
+    load_state(state_path)
+    path = cache_path(state_path)
+    if content is None:
+        # cut in the middle
+        content = path.read_bytes()[:-10]
+    path.write_bytes(content)
+    assert load_state(state_path).activities == ACTIVITIES
+    assert path.read_bytes() != content
@@ -0,0 +1,86 @@
+from datetime import datetime
+
+import pytest
+
+import choose_activity.helpers as helpers
+from choose_activity.helpers import (
+    ActivitiesState,
+    apply_mutation,
+    load_state,
+    record_mutation,
+    save_state,
+)
+from choose_activity.journal import journal_path
+
+
+def test_replay_journal(tmp_path):
+    test_path = tmp_path / 'activities_state.dat'
+    state = ActivitiesState({'bla': 2.3})
+    save_state(test_path, state)
+    now = datetime.now().astimezone()
+
+    record_mutation(test_path, state, 'add', activity='blop', weight=1.3)
+    record_mutation(test_path, state, 'reweight', activity='bla', weight=4.0)
+    record_mutation(test_path, state, 'add', activity='gone', weight=1.0)
+    record_mutation(test_path, state, 'delete', activity='gone')
+    record_mutation(test_path, state, 'start', activity='blop', at=now)
+
+    assert journal_path(test_path).exists()
+    loaded = load_state(test_path)
+    assert loaded == state
+    assert loaded.activities == {'bla': 4.0, 'blop': 1.3}
+    assert loaded.current_activity == 'blop'
+    assert loaded.current_activity_start == now
+
+    record_mutation(test_path, state, 'finish')
+    assert load_state(test_path).current_activity is None
+
+
+def test_journal_without_snapshot(tmp_path):
+    test_path = tmp_path / 'activities_state.dat'
+    state = load_state(test_path)
+    record_mutation(test_path, state, 'add', activity='blop', weight=1.3)
+    assert not test_path.exists()
+    assert load_state(test_path).activities == {'blop': 1.3}
+
+
+def test_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.setattr(helpers, 'JOURNAL_CHECKPOINT_MIN_BYTES', 0)
+    test_path = tmp_path / 'activities_state.dat'
+    state = ActivitiesState({f'activity {i}': 1.0 for i in range(10)})
+    save_state(test_path, state)
+    assert not journal_path(test_path).exists()
+
+    record_mutation(test_path, state, 'delete', activity='activity 1')
+    # the journal is still smaller than the snapshot
+    assert journal_path(test_path).exists()
+    for i in range(2, 10):
+        record_mutation(test_path, state, 'delete', activity=f'activity {i}')
+        if not journal_path(test_path).exists():
+            break
+    # the journal grew bigger than the snapshot and was merged into it
+    assert not journal_path(test_path).exists()
+    assert load_state(test_path) == state
+
+
+def test_torn_journal(tmp_path):
+    test_path = tmp_path / 'activities_state.dat'
+    state = load_state(test_path)
+    record_mutation(test_path, state, 'add', activity='blop', weight=1.3)
+    with open(journal_path(test_path), 'a') as f:
+        f.write('{"op": "delete", "activ')
+    assert load_state(test_path).activities == {'blop': 1.3}
+
+
+def test_replay_is_idempotent():
+    state = ActivitiesState({'bla': 1.0})
+    for _ in range(2):
+        apply_mutation(state, dict(op='delete', activity='bla'))
+        apply_mutation(state, dict(op='add', activity='blop', weight=2.0))
+    assert state.activities == {'blop': 2.0}
+
+
+def test_unknown_mutation():
+    with pytest.raises(ValueError) as excinfo:
+        apply_mutation(ActivitiesState({}), dict(op='explode'))
+    assert 'Unknown mutation' in str(excinfo.value)
@@ -0,0 +1,76 @@
+import io
+import json
+import tracemalloc
+
+import pytest
+
+from choose_activity.compact import CompactActivities
+from choose_activity.helpers import ActivitiesState, load_state, save_state
+from choose_activity.state_reader import read_state_file
+
+ACTIVITIES = {
+    'plain': 1.5,
+    'integer': 2,
+    'exponent': 1e-07,
+    'negative': -3.25,
+    'infinite': float('inf'),
+    'quote " and \\ backslash': 4.0,
+    'unicode ☕ café': 5.0,
+    '': 6.0,
+}
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64, 1 << 16])
+@pytest.mark.parametrize('indent', [None, 2])
+def test_same_as_json(chunk_size, indent):
+    raw_obj = dict(
+        version=3,
+        activities=ACTIVITIES,
+        current_activity='plain',
+        current_activity_start=None,
+    )
+    text = json.dumps(raw_obj, indent=indent)
+    activities = {}
+    fields = read_state_file(io.StringIO(text), activities, chunk_size)
+    expected = json.loads(text)
+    assert list(activities.items()) == list(
+        expected.pop('activities').items())
+    assert [type(w) for w in activities.values()] == [
+        type(w) for w in ACTIVITIES.values()]
+    assert fields == expected
+
+
+@pytest.mark.parametrize('text', [
+    '',
+    '[]',
+    '{}',
+    '{"activities": {"a": 1.0}',
+    '{"activities": {"a": 1.0,}}',
+    '{"activities": {"a" 1.0}}',
+    '{"activities": {1: 1.0}}',
+    '{"activities": {}} {}',
+])
+def test_invalid(text):
+    with pytest.raises(ValueError):
+        read_state_file(io.StringIO(text), {}, chunk_size=3)
+
+
+def test_load_state_peak_memory(tmp_path):
+    fname = tmp_path / 'state'
+    activities = {f'activity number {i}': i + 0.5 for i in range(50_000)}
+    save_state(fname, ActivitiesState(activities))
+    del activities
+
+    tracemalloc.start()
+    try:
+        json.loads(fname.read_text())
+        json_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        tracemalloc.start()
+        state = load_state(fname, compact=True)
+        streaming_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert isinstance(state.activities, CompactActivities)
+    assert len(state.activities) == 50_000
+    assert streaming_peak * 2 < json_peak
@@ -0,0 +1,111 @@
+from datetime import timedelta
+import json
+
+import pytest
+
+from choose_activity.helpers import log_activity_result, log_activity_results
+from choose_activity.stats import activity_stats, stats_path
+from choose_activity.storage import FileStorage, SQLiteStorage
+
+# the minutes in a day, to end the outcomes on different days; being
+# even, the outcomes built with a multiple of it are done
+DAY = 24 * 60
+
+
+@pytest.fixture(params=['file', 'sqlite'])
+def storage(request, tmp_path):
+    if request.param == 'file':
+        s = FileStorage(tmp_path / 'state.dat', tmp_path / 'outcomes.log')
+    else:
+        s = SQLiteStorage(tmp_path / 'db.sqlite3')
+    yield s
+    s.close()
+
+
+def test_aggregates(storage, outcome, start):
+    assert storage.activity_stats() == {}
+    storage.log_activity_result(outcome(0, 'read', duration=10))
+    storage.log_activity_result(outcome(2 * DAY, 'read', duration=30))
+    storage.log_activity_result(outcome(DAY, 'read', duration=50))
+    storage.log_activity_result(outcome(3 * DAY + 1, 'read'))
+    storage.log_activity_result(outcome(1, 'run'))
+
+    stats = storage.activity_stats()
+    assert stats['read'].done == 3
+    assert stats['read'].skipped == 1
+    assert stats['read'].done_rate == 0.75
+    assert stats['read'].total_time == 90 * 60
+    assert stats['read'].median_time == pytest.approx(30 * 60, rel=0.025)
+    assert stats['read'].last_done == start + timedelta(days=2)
+    assert stats['run'].done_rate == 0
+    assert stats['run'].median_time is None
+    assert stats['run'].last_done is None
+
+
+def test_sub_second_durations(storage, outcome):
+    storage.log_activity_result(outcome(0, 'read', duration=0.005))
+    stats = storage.activity_stats()['read']
+    assert stats.total_time == pytest.approx(0.3)
+    assert stats.median_time == pytest.approx(0.3)
+    storage.log_activity_result(outcome(0, 'read', duration=0.01))
+    storage.log_activity_result(outcome(0, 'read', duration=0.015))
+    stats = storage.activity_stats()['read']
+    assert stats.median_time <= stats.total_time / 2
+
+
+def test_incremental_cache(tmp_path, outcome):
+    log_path = tmp_path / 'outcomes.log'
+    log_activity_result(log_path, outcome(0, 'read', duration=10))
+    assert activity_stats(log_path)['read'].done == 1
+    cached = json.loads(stats_path(log_path).read_text())
+    assert cached['log_size'] == log_path.stat().st_size
+
+    # the lines already counted are not read again
+    cached['stats']['read']['done'] = 100
+    stats_path(log_path).write_text(json.dumps(cached))
+    log_activity_result(log_path, outcome(0, 'read', duration=20))
+    assert activity_stats(log_path)['read'].done == 101
+    # a partial line is left for later
+    with open(log_path, 'a') as f:
+        f.write('{"activity": "read"')
+    assert activity_stats(log_path)['read'].done == 101
+
+
+def test_bounded_aggregates(tmp_path, outcome):
+    log_path = tmp_path / 'outcomes.log'
+    log_activity_results(log_path, [
+        outcome(0, 'read', duration=minutes) for minutes in range(1, 1000)])
+    log_activity_results(log_path, [outcome(0, 'read', duration=2000)] * 998)
+    stats = activity_stats(log_path)['read']
+    assert stats.total_time == (999 * 1000 // 2 + 2000 * 998) * 60
+    assert stats.median_time == pytest.approx(999 * 60, rel=0.025)
+    # the cache does not grow with the outcomes
+    assert len(stats.histogram) < 150
+    assert stats_path(log_path).stat().st_size < 4000
+
+
+def test_cache_of_older_versions(tmp_path, outcome):
+    log_path = tmp_path / 'outcomes.log'
+    log_activity_result(log_path, outcome(0, 'read', duration=10))
+    # they kept every duration, such a cache is computed again
+    stats_path(log_path).write_text(json.dumps(dict(
+        log_size=log_path.stat().st_size,
+        stats=dict(read=dict(
+            done=2, skipped=0, durations=[60.0, 180.0], last_done=None)),
+    )))
+    stats = activity_stats(log_path)['read']
+    assert stats.done == 1
+    assert stats.total_time == 600
+
+
+def test_corrupt_or_stale_cache(tmp_path, outcome):
+    log_path = tmp_path / 'outcomes.log'
+    log_activity_result(log_path, outcome(0, 'read', duration=10))
+    log_activity_result(log_path, outcome(0, 'read', duration=10))
+    stats_path(log_path).write_text('{"log_size": 3')
+    assert activity_stats(log_path)['read'].done == 2
+
+    # the log was replaced by a shorter one
+    log_path.unlink()
+    log_activity_result(log_path, outcome(0, 'run', duration=10))
+    assert list(activity_stats(log_path)) == ['run']
@@ -0,0 +1,97 @@
+from datetime import datetime
+
+import pytest
+
+from choose_activity.compact import CompactActivities
+from choose_activity.helpers import (
+    ActivitiesState,
+    log_activity_result,
+    save_state,
+)
+from choose_activity.storage import (
+    FileStorage,
+    SQLiteStorage,
+    migrate_to_sqlite,
+)
+
+
+@pytest.fixture(params=['file', 'sqlite'])
+def storage(request, tmp_path):
+    if request.param == 'file':
+        s = FileStorage(tmp_path / 'state.dat', tmp_path / 'outcomes.log')
+    else:
+        s = SQLiteStorage(tmp_path / 'db.sqlite3')
+    yield s
+    s.close()
+
+
+def test_state_roundtrip(storage):
+    assert storage.load_state() == ActivitiesState({})
+    state = ActivitiesState({'bla': 2.3, 'blop': 1.3})
+    storage.save_state(state)
+    assert storage.load_state() == state
+
+    now = datetime.now().astimezone()
+    storage.record_mutation(state, 'add', activity='new', weight=4.0)
+    storage.record_mutation(state, 'reweight', activity='bla', weight=9.0)
+    storage.record_mutation(state, 'delete', activity='blop')
+    storage.record_mutation(state, 'start', activity='new', at=now)
+    loaded = storage.load_state()
+    assert loaded == state
+    assert list(loaded.activities) == ['bla', 'new']
+    assert loaded.current_activity_start == now
+
+    storage.record_mutation(state, 'finish')
+    assert storage.load_state().current_activity is None
+
+
+@pytest.mark.parametrize('kind', ['file', 'sqlite'])
+def test_compact_state(kind, tmp_path):
+    if kind == 'file':
+        s = FileStorage(
+            tmp_path / 'state.dat', tmp_path / 'outcomes.log', compact=True)
+    else:
+        s = SQLiteStorage(tmp_path / 'db.sqlite3', compact=True)
+    s.save_state(ActivitiesState({'a': 1.0, 'b': 2.0}))
+    state = s.load_state()
+    assert isinstance(state.activities, CompactActivities)
+    s.record_mutation(state, 'delete', activity='a')
+    assert s.load_state().activities == {'b': 2.0}
+    s.close()
+
+
+def test_outcomes(storage, outcome):
+    assert storage.latest_outcome_for_activity('bla') is None
+    for i in range(5):
+        storage.log_activity_result(outcome(i, f'act {i % 2}', f'fb {i}'))
+    assert storage.latest_outcome_for_activity('act 0') == 'fb 4'
+    assert storage.latest_outcome_for_activity('act 1') == 'fb 3'
+    assert storage.latest_outcome_for_activity('bla') is None
+
+
+def test_migration(tmp_path, outcome):
+    state_path = tmp_path / 'state.dat'
+    log_path = tmp_path / 'outcomes.log'
+    db_path = tmp_path / 'db.sqlite3'
+    state = ActivitiesState({'bla': 2.3, 'blop': 1.3})
+    save_state(state_path, state)
+    log_activity_result(log_path, outcome(0, 'bla', 'first'))
+    log_activity_result(log_path, outcome(60, 'bla', 'second'))
+
+    storage = migrate_to_sqlite(state_path, log_path, db_path)
+    assert storage.load_state() == state
+    assert storage.latest_outcome_for_activity('bla') == 'second'
+    storage.close()
+
+    with pytest.raises(FileExistsError):
+        migrate_to_sqlite(state_path, log_path, db_path)
+
+
+def test_migration_without_log(tmp_path):
+    storage = migrate_to_sqlite(
+        tmp_path / 'state.dat',
+        tmp_path / 'outcomes.log',
+        tmp_path / 'db.sqlite3',
+    )
+    assert storage.load_state() == ActivitiesState({})
+    storage.close()
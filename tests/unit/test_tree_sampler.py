@@ -0,0 +1,94 @@
+from collections import Counter
+from random import Random
+
+from choose_activity.helpers import (
+    ActivitiesState,
+    load_state,
+    save_state,
+    weighted_choice,
+)
+from choose_activity.sampling import TreeSampler
+
+
+def test_mapping_interface():
+    sampler = TreeSampler({'a': 1.0, 'b': 2.0})
+    sampler['c'] = 3.0
+    sampler['a'] = 5.0
+    del sampler['b']
+    assert dict(sampler) == {'a': 5.0, 'c': 3.0}
+    assert list(sampler) == ['a', 'c']
+    assert len(sampler) == 2
+    assert 'b' not in sampler
+    assert sampler == {'a': 5.0, 'c': 3.0}
+    assert sampler.total() == 8.0
+
+
+def test_empty():
+    sampler = TreeSampler()
+    assert sampler.choice() is None
+    sampler['x'] = 1.0
+    del sampler['x']
+    assert sampler.choice() is None
+    assert weighted_choice(sampler) is None
+
+
+def test_zero_weights():
+    sampler = TreeSampler({'a': 0.0, 'b': 0.0})
+    assert sampler.choice() is None
+    assert weighted_choice(sampler) is None
+    sampler['c'] = 1.0
+    assert {sampler.choice() for _ in range(100)} == {'c'}
+    # only the rounding errors of the deleted weights are left
+    sampler = TreeSampler({'a': 0.1, 'b': 0.2, 'c': 0.3})
+    sampler['a'] = 0.0
+    del sampler['b']
+    del sampler['c']
+    assert sampler.choice(lambda: 0.9999999999999999) is None
+
+
+def test_landing_off_is_bounded():
+    sampler = TreeSampler({'a': 0.1, 'b': 0.2, 'c': 0.3})
+    del sampler['c']
+    # whatever the rounding, the draw ends on a key that can be chosen
+    assert sampler.choice(lambda: 0.9999999999999999) == 'b'
+    assert sampler.choice(lambda: 0.0) == 'a'
+
+
+def test_deleted_never_chosen():
+    sampler = TreeSampler({f'act {i}': 1.0 for i in range(50)})
+    for i in range(0, 50, 2):
+        del sampler[f'act {i}']
+    rng = Random(42)
+    for _ in range(2000):
+        chosen = sampler.choice(rng.random)
+        assert int(chosen.split()[1]) % 2 == 1
+
+
+def test_updates_distribution():
+    sampler = TreeSampler()
+    rng = Random(1)
+    # grow it one by one, then reweight and delete to exercise the tree
+    for i in range(37):
+        sampler[f'act {i}'] = float(i + 1)
+    for i in range(10):
+        del sampler[f'act {i}']
+    sampler['act 20'] = 100.0
+    sampler['reused slot'] = 50.0
+    assert abs(sampler.total() - sum(sampler.values())) < 1e-9
+
+    SAMPLE_SIZE = 40000
+    c = Counter(sampler.choice(rng.random) for _ in range(SAMPLE_SIZE))
+    total = sum(sampler.values())
+    for k, w in sampler.items():
+        assert abs(c[k] / SAMPLE_SIZE - w / total) < 0.015
+
+
+def test_weighted_choice_on_tree():
+    assert weighted_choice(TreeSampler({'only me!': 1.0})) == 'only me!'
+
+
+def test_save_tree_state(tmp_path):
+    test_path = tmp_path / 'activities_state.dat'
+    state = ActivitiesState(TreeSampler({'a': 1.0, 'b': 2.0}))
+    save_state(test_path, state)
+    assert load_state(test_path).activities == {'a': 1.0, 'b': 2.0}
@@ -133,7 +133,7 @@ def test_get_weight():
     _input = MagicMock(return_value='1.3')
     assert get_weight('hello', _input) == 1.3
 
-    answers = ['blarp', '3', 'never reached']
+    answers = ['blarp', '-1', 'nan', '3', 'never reached']
 
     def input_function():
         return answers.pop(0)
@@ -157,3 +157,40 @@ def test_get_bool():
         return answers.pop(0)
 
     assert get_bool('hello', input_function)
+
+
+def test_enumerate_page():
+    options = [f'option {i}' for i in range(10)]
+    page = enumerate_options(options, 3, 5)
+    assert page == '4) option 3\n5) option 4'
+    assert enumerate_options(options, 8) == '9) option 8\n10) option 9'
+
+
+def test_paginated_answer(capsys):
+    options = [f'option {i}' for i in range(25)]
+    answers = ['>', '>', '<', '/ion 1', '>', '/', '24']
+
+    def input_function():
+        return answers.pop(0)
+
+    assert get_answer(options, input_function, page_size=10) == 'option 23'
+    out = capsys.readouterr().out
+    # only a page at a time is shown
+    assert '11) option 10' not in out.split('Page 1 of 3')[0]
+    assert 'Page 2 of 3' in out
+    assert 'Page 3 of 3' in out
+    assert '21) option 20' in out
+    # the filter shows the matches and pages through them
+    assert ' -  option 1\n -  option 10' in out
+    assert 'Page 2 of 2' in out
+
+
+def test_paginated_empty_filter(capsys):
+    options = [f'option {i}' for i in range(25)]
+    answers = ['/nothing', 'option 7']
+
+    def input_function():
+        return answers.pop(0)
+
+    assert get_answer(options, input_function, page_size=10) == 'option 7'
+    assert 'No option matches the filter' in capsys.readouterr().out